@@ -1,12 +1,168 @@
 from src.plots import create_plot_rentabilidad_por_periodo_por_simulacion, create_plot_rentabilidad_final_por_activo_por_simulacion, create_plot_rentabilidad_por_simulacion
+from src.plots import create_plot_abanico_rentabilidad_por_periodo
 from src.rentabilidad import clean_rentabilidad_por_periodo
-from src.simulation import run_multiple_simulations
+from src.simulation import run_multiple_simulations, MEMORIA_MAXIMA
 from datetime import datetime, timedelta
-from src.load_data import load_data
+from src.catalogo import cargar_catalogo
+from src.instrumentacion import Instrumentacion, medir_etapa
+from src.almacen import RUTA_ALMACEN
+from src.calendario import CalendarioEventos
+from src.etapas import CacheEtapas, cargar_precios, simular, buscar_objetivo, clave_etapa
+from src.tareas import GestorTareas
 import plotly.graph_objects as go
 import streamlit as st
-import pandas as pd
+import logging
+import time
+import os
 
+# Segundos entre dos refrescos de la pagina mientras una simulacion esta en curso
+INTERVALO_REFRESCO = 1.0
+
+
+
+@st.cache_resource
+def obtener_catalogo():
+
+    # El catalogo se carga una sola vez por proceso, no en cada rerun
+    return cargar_catalogo()
+
+
+@st.cache_resource
+def obtener_cache_etapas():
+
+    # Una sola cache por proceso, compartida por todas las sesiones: cada pulsacion de Simular solo
+    # recalcula las etapas cuyas entradas cambiaron
+    return CacheEtapas()
+
+
+def mostrar_resultado(resultado, vista, cache, clave = None, instrumentacion = None, solucion = None):
+
+    """
+    Metricas, tablas y graficos de una simulacion
+
+    Con clave, los Data Frames y graficos se guardan como etapas de la cache. Un resultado parcial o cancelado
+    se muestra sin clave: se calcula en cada refresco y no se guarda.
+    """
+
+    inversion_inicial = vista["inversion_inicial"]
+    rentabilidad_objetivo = vista["rentabilidad_objetivo"]
+    grafico_por_periodo = vista["grafico_por_periodo"]
+    fase = vista["fase"]
+
+    def obtener(etapa, partes, calcular):
+        if clave is None:
+            return calcular()
+        return cache.obtener(etapa, clave_etapa(*partes, clave), calcular)
+
+    # Si la simulacion completa no cabia en memoria se hizo en modo agregado
+    if resultado.agregado and grafico_por_periodo != "Abanico":
+        st.info("La simulación no cabía en memoria con todas las trayectorias: se muestra el gráfico de abanico")
+        grafico_por_periodo = "Abanico"
+
+    # Rentabilidaid Final por activo por simulacion, con la rentabilidad total por iteracion
+    def rentabilidad_final_dataframes():
+        with medir_etapa(instrumentacion, "dataframes", resultado.num_simulaciones):
+            return (resultado.rentabilidad_final_por_activo_por_simulacion("real"),
+                    resultado.rentabilidad_final_por_activo_por_simulacion("nominal"))
+
+    rentabilidad_final_por_activo_por_simulacion, rentabilidad_final_por_activo_por_simulacion_nominal = \
+        obtener("dataframes", ("dataframes",), rentabilidad_final_dataframes)
+
+    # Metrics
+    # Calculate % Probabilidad de Alcanzar Rentabilidad Objetivo
+    p_iteraciones_favorables = resultado.probabilidad_objetivo(rentabilidad_objetivo, "real")
+
+    # Mejor simulacion
+    rentabilidad_iteracion = resultado.rentabilidad_iteracion("real")
+    promedio_simulacion = round(rentabilidad_iteracion.mean(), 0)
+    mejor_simulacion = round(rentabilidad_iteracion.max(), 0)
+    peor_simulacion = round(rentabilidad_iteracion.min(), 0)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Prob. Monto Objetivo", f"{p_iteraciones_favorables:.2f}%")
+    col2.metric("Rentabilidad Media", f"${promedio_simulacion:,.0f}")
+    col3.metric("Mejor Iteracion", f"${mejor_simulacion:,.0f}")
+    col4.metric("Peor Iteración", f"${peor_simulacion:,.0f}")
+
+    if solucion is not None:
+        etiqueta = "Aporte necesario por periodo" if fase == "Acumulación" else "Retiro sostenible por periodo"
+        if solucion["fase_dinero"] is None:
+            st.warning(f"{etiqueta}: no se alcanza el objetivo con las trayectorias simuladas")
+        else:
+            inferior, superior = solucion["intervalo"]
+            inferior = f"${inferior:,.2f}" if inferior is not None else "sin acotar"
+            superior = f"${superior:,.2f}" if superior is not None else "sin acotar"
+            st.metric(etiqueta, f"${solucion['fase_dinero']:,.2f}")
+            st.caption(f"Intervalo de confianza del 95%: {inferior} - {superior}, sobre {solucion['num_simulaciones']:,} simulaciones. "
+                       f"Probabilidad {'de alcanzar el objetivo' if fase == 'Acumulación' else 'de ruina'} con este monto: {solucion['probabilidad']:.2f}%")
+
+    if resultado.convergencia is not None:
+        inferior, superior = resultado.convergencia["intervalo_probabilidad"]
+        st.caption(f"Simulaciones usadas: {resultado.convergencia['num_simulaciones']:,} "
+                   f"({resultado.convergencia['tiempo']:.1f} s, parada por {resultado.convergencia['motivo']}). "
+                   f"Intervalo de confianza del 95% de la probabilidad: {inferior:.2f}% - {superior:.2f}%")
+
+    # Resumen Rentabilidad Real por Simulacion
+    st.write("Resumen de Rentabilidad Real por simulación")
+    metrics_rentabilidad_final_por_activo_por_simulacion = resultado.resumen("real")
+    st.write(metrics_rentabilidad_final_por_activo_por_simulacion)
+    st.download_button(label="Descargar",
+                       data= metrics_rentabilidad_final_por_activo_por_simulacion.to_csv().encode("utf-8"),
+                       file_name = "simulation_metrics.csv",
+                       mime = "text/csv")
+
+    # Grafico Rentabilidad por periodo para cada Simulacion
+    def graficos_por_periodo():
+        if grafico_por_periodo == "Abanico":
+            with medir_etapa(instrumentacion, "graficos", resultado.num_simulaciones):
+                return (create_plot_abanico_rentabilidad_por_periodo(resultado.agregado_por_periodo("real")),
+                        create_plot_abanico_rentabilidad_por_periodo(resultado.agregado_por_periodo("nominal")))
+
+        with medir_etapa(instrumentacion, "dataframes", resultado.num_simulaciones):
+            rentabilidad_por_periodo_por_simulacion = clean_rentabilidad_por_periodo(resultado.rentabilidad_por_periodo("real"), periodos = resultado.periodos)
+            rentabilidad_por_periodo_por_simulacion_nominal = clean_rentabilidad_por_periodo(resultado.rentabilidad_por_periodo("nominal"), periodos = resultado.periodos)
+
+        with medir_etapa(instrumentacion, "graficos", resultado.num_simulaciones):
+            return (create_plot_rentabilidad_por_periodo_por_simulacion(rentabilidad_por_periodo_por_simulacion),
+                    create_plot_rentabilidad_por_periodo_por_simulacion(rentabilidad_por_periodo_por_simulacion_nominal))
+
+    # Rentabilidad Final por activo por simulacion
+    def graficos_por_activo():
+        with medir_etapa(instrumentacion, "graficos", resultado.num_simulaciones):
+            return (create_plot_rentabilidad_final_por_activo_por_simulacion(rentabilidad_final_por_activo_por_simulacion),
+                    create_plot_rentabilidad_final_por_activo_por_simulacion(rentabilidad_final_por_activo_por_simulacion_nominal))
+
+    # Rentabilidad Total, el unico grafico que depende del objetivo
+    def graficos_objetivo():
+        with medir_etapa(instrumentacion, "graficos", resultado.num_simulaciones):
+            return (create_plot_rentabilidad_por_simulacion(inversion_inicial, rentabilidad_final_por_activo_por_simulacion, rentabilidad_objetivo),
+                    create_plot_rentabilidad_por_simulacion(inversion_inicial, rentabilidad_final_por_activo_por_simulacion_nominal, rentabilidad_objetivo))
+
+    plot_rentabilidad_por_periodo_por_simulacion, plot_rentabilidad_por_periodo_por_simulacion_nominal = \
+        obtener("graficos", ("graficos_por_periodo", grafico_por_periodo), graficos_por_periodo)
+    plot_rentabilidad_final_por_activo_por_simulacion, plot_rentabilidad_final_por_activo_por_simulacion_nominal = \
+        obtener("graficos", ("graficos_por_activo",), graficos_por_activo)
+    plot_rentabilidad_por_simulacion, plot_rentabilidad_por_simulacion_nominal = \
+        obtener("graficos", ("graficos_objetivo", inversion_inicial, rentabilidad_objetivo), graficos_objetivo)
+
+    tab1, tab2 = st.tabs(["Real", "Nominal"])
+
+    with tab1:
+        st.plotly_chart(plot_rentabilidad_por_periodo_por_simulacion)
+        st.plotly_chart(plot_rentabilidad_final_por_activo_por_simulacion)
+        st.plotly_chart(plot_rentabilidad_por_simulacion)
+
+    with tab2:
+        st.plotly_chart(plot_rentabilidad_por_periodo_por_simulacion_nominal)
+        st.plotly_chart(plot_rentabilidad_final_por_activo_por_simulacion_nominal)
+        st.plotly_chart(plot_rentabilidad_por_simulacion_nominal)
+
+    if vista["mostrar_rendimiento"] and instrumentacion is not None:
+        with st.expander("Rendimiento", expanded = False):
+            st.caption(f"Tiempo total medido: {instrumentacion.tiempo_total:.2f} s")
+            st.dataframe(instrumentacion.a_dataframe())
+            st.caption(f"Cache de etapas: {len(cache)} entradas, {cache.bytes / 2**20:.1f} MiB. "
+                       f"Reutilizadas: {cache.aciertos}. Calculadas: {cache.fallos}")
 
 
 def home():
@@ -29,18 +185,65 @@ def home():
         fase_dinero = st.sidebar.number_input("Ingrese dinero que desea invertir en cada periodo de rebalanceo", value = 0, placeholder = None, step=1)
     else :
         fase_dinero = st.sidebar.number_input("Ingrese dinero que desea retirar en cada periodo de rebalanceo", value = 0, placeholder = None, step=1)
+
+    # Calendario de los rebalanceos: los dias fijos de siempre (30, 60, 180, 365), el año dividido en partes iguales
+    # o cada 21, 63, 126 o 252 dias habiles desde hoy
+    tipo_calendario = st.sidebar.selectbox("Seleccione el calendario de rebalanceo", ("legacy", "natural", "bursatil"))
+    crecimiento_dinero = st.sidebar.number_input("Crecimiento anual del dinero invertido o retirado %", value = 0.0, step = 0.5)
+
+    # Buscar el aporte o retiro por periodo que cumple un objetivo de probabilidad, sobre las mismas trayectorias
+    if fase == "Acumulación":
+        buscar = st.sidebar.checkbox("Calcular el aporte necesario para el monto objetivo", value = False)
+        probabilidad_buscada = st.sidebar.number_input("Probabilidad deseada de alcanzar el monto objetivo %", value = 80, min_value = 1, max_value = 99, step = 1, disabled = not buscar)
+    else:
+        buscar = st.sidebar.checkbox("Calcular el retiro sostenible", value = False)
+        probabilidad_buscada = st.sidebar.number_input("Riesgo de ruina maximo %", value = 10, min_value = 1, max_value = 99, step = 1, disabled = not buscar)
     
     num_simulaciones = st.sidebar.number_input("Ingrese el numero de simulaciones", value = 10, placeholder = None, step=1)
     periodo_simulacion = st.sidebar.number_input("Ingrese el periodo por el cual desea simular en años", value = 1, placeholder = None, step=1, min_value = 1, max_value = 50)
 
+    # Simulacion adaptativa: el numero de simulaciones pasa a ser el maximo
+    adaptativo = st.sidebar.checkbox("Detener cuando la probabilidad converja", value = False)
+    if adaptativo:
+        tolerancia = st.sidebar.number_input("Margen de error de la probabilidad (puntos %)", value = 1.0, min_value = 0.1, step = 0.1)
+        tiempo_maximo = st.sidebar.number_input("Tiempo maximo de simulacion (segundos)", value = 30, min_value = 1, step = 1)
+    else:
+        tolerancia, tiempo_maximo = None, None
+
+    # Esquema de muestreo de los shocks, los de reduccion de varianza estabilizan la probabilidad con menos simulaciones
+    muestreo = st.sidebar.selectbox("Seleccione el esquema de muestreo", ("estandar", "antitetico", "sobol", "estratificado"))
+
+    # float32 usa la mitad de memoria en las trayectorias y la rentabilidad por periodo
+    precision = st.sidebar.selectbox("Seleccione la precision de las trayectorias", ("float64", "float32"))
+
+    # Con la misma semilla se reutilizan las trayectorias ya simuladas: cambiar la cartera, la inflacion o el objetivo no vuelve a simularlas
+    semilla = st.sidebar.number_input("Semilla de la simulacion", value = 0, min_value = 0, step = 1)
+
+    # El grafico de abanico solo necesita los estadisticos en las fechas de rebalanceo, no todas las trayectorias diarias
+    grafico_por_periodo = st.sidebar.radio("Seleccione el grafico de rentabilidad por periodo", ["Abanico", "Todas las simulaciones"])
+
+    # Guardar todas las trayectorias en disco para analizarlas o exportarlas sin volver a simular
+    guardar = st.sidebar.checkbox("Guardar simulación en disco", value = False, disabled = grafico_por_periodo == "Abanico")
+
+    # Usar solo los precios guardados en la cache local, sin descargar
+    offline = st.sidebar.checkbox("Modo sin conexión (usar solo precios guardados)", value = False)
+
+    # Tiempo y memoria de cada etapa. La memoria pico solo se mide si se muestra el panel, porque ralentiza el calculo
+    mostrar_rendimiento = st.sidebar.checkbox("Mostrar panel de rendimiento", value = False)
+
     # Definir opciones de pares
-    activos_data = pd.read_csv('data/nasdaq_screener.csv') 
-    activos = activos_data["Symbol"].unique().tolist()
+    catalogo = obtener_catalogo()
+    activos = catalogo.simbolos
 
     activos_seleccionados =  st.sidebar.multiselect(label = "Selecione los activos de su cartera", options = activos, key = "select_activos")
 
+    cache = obtener_cache_etapas()
+    gestor = st.session_state.setdefault("tareas", GestorTareas())
+
     if st.sidebar.button("Simular", type="primary", key="simular") :
 
+        instrumentacion = Instrumentacion(medir_memoria = mostrar_rendimiento)
+
         # Load Base Data
         # Calculate the current date
         end_date = datetime.today()
@@ -52,97 +255,128 @@ def home():
         start_date_str = start_date.strftime('%Y-%m-%d')
         end_date_str = end_date.strftime('%Y-%m-%d')
 
-        print(start_date_str)
-        print(end_date_str)
-        
-        base_data = load_data(empresas = activos_seleccionados, start_date = start_date_str, end_date = end_date_str) 
-
-        # Run Simulations and get Rentabilidad Total
-        rentabilidad_total, rentabilidad_por_periodo, rentabilidad_total_nominal, rentabilidad_por_periodo_nominal = run_multiple_simulations(df_consolidado = base_data,
-                                                                                                                                              T = periodo_simulacion,
-                                                                                                                                              activos_seleccionados = activos_seleccionados,
-                                                                                                                                              inversion_inicial = inversion_inicial,
-                                                                                                                                              distribucion_cartera = [1 / len(activos_seleccionados)] * len(activos_seleccionados),
-                                                                                                                                              num_simulaciones = int(num_simulaciones),
-                                                                                                                                              balanceo = balanceo,
-                                                                                                                                              fase = fase,
-                                                                                                                                              fase_dinero = fase_dinero,
-                                                                                                                                              inflacion = inflacion)
-        
-        # Rentabilidaid Final por activo por simulacion
-        rentabilidad_final_por_activo_por_simulacion = pd.DataFrame(rentabilidad_total, columns =  activos_seleccionados)
-        rentabilidad_final_por_activo_por_simulacion_nominal = pd.DataFrame(rentabilidad_total_nominal, columns =  activos_seleccionados)
-
-        # Calcular rentabilidad total por iteracion
-        rentabilidad_final_por_activo_por_simulacion['rentabilidad_iteracion'] = rentabilidad_final_por_activo_por_simulacion.sum(axis=1)
-        rentabilidad_final_por_activo_por_simulacion_nominal['rentabilidad_iteracion'] = rentabilidad_final_por_activo_por_simulacion_nominal.sum(axis=1)
-
-        # Metrics
-        # Calculate % Probabilidad de Alcanzar Rentabilidad Objetivo
-        n_iteraciones = len(rentabilidad_final_por_activo_por_simulacion)
-        n_iteraciones_favorables = (rentabilidad_final_por_activo_por_simulacion['rentabilidad_iteracion'] > rentabilidad_objetivo).sum()
-        p_iteraciones_favorables = (n_iteraciones_favorables / n_iteraciones) * 100
-
-        # Mejor simulacion
-        promedio_simulacion = round(rentabilidad_final_por_activo_por_simulacion['rentabilidad_iteracion'].mean(), 0)
-        mejor_simulacion = round(rentabilidad_final_por_activo_por_simulacion['rentabilidad_iteracion'].max(), 0)
-        peor_simulacion = round(rentabilidad_final_por_activo_por_simulacion['rentabilidad_iteracion'].min(), 0)
-
-        col1, col2, col3, col4 = st.columns(4)
-        col1.metric("Prob. Monto Objetivo", f"{p_iteraciones_favorables:.2f}%")
-        col2.metric("Rentabilidad Media", f"${promedio_simulacion:,.0f}")
-        col3.metric("Mejor Iteracion", f"${mejor_simulacion:,.0f}")
-        col4.metric("Peor Iteración", f"${peor_simulacion:,.0f}")
-        
-        # Resumen Rentabilidad Real por Simulacion
-        st.write("Resumen de Rentabilidad Real por simulación")    
-        metrics_rentabilidad_final_por_activo_por_simulacion = pd.DataFrame({
-            'Rent. Media': rentabilidad_final_por_activo_por_simulacion.mean(),
-            'Desv.': rentabilidad_final_por_activo_por_simulacion.std(),
-            'Mejor Iter.':  rentabilidad_final_por_activo_por_simulacion.max(),
-            'Peor Iter.':  rentabilidad_final_por_activo_por_simulacion.min()
-            })
-
-        metrics_rentabilidad_final_por_activo_por_simulacion.index = metrics_rentabilidad_final_por_activo_por_simulacion.index[:-1].tolist() + ["Rentabilidad Total"]
-        st.write(metrics_rentabilidad_final_por_activo_por_simulacion)
-        st.download_button(label="Descargar",
-                           data= metrics_rentabilidad_final_por_activo_por_simulacion.to_csv().encode("utf-8"),
-                           file_name = "simulation_metrics.csv",
-                           mime = "text/csv") 
-      
-        # Grafico Rentabilidad por periodo para cada Simulacion
-        rentabilidad_por_periodo_por_simulacion = clean_rentabilidad_por_periodo(rentabilidad_por_periodo)
-        rentabilidad_por_periodo_por_simulacion_nominal = clean_rentabilidad_por_periodo(rentabilidad_por_periodo_nominal)
-
-        plot_rentabilidad_por_periodo_por_simulacion = create_plot_rentabilidad_por_periodo_por_simulacion(rentabilidad_por_periodo_por_simulacion)
-        plot_rentabilidad_por_periodo_por_simulacion_nominal = create_plot_rentabilidad_por_periodo_por_simulacion(rentabilidad_por_periodo_por_simulacion_nominal)
-        
-
-        # Rentabilidad Final por activo por simulacion
-        plot_rentabilidad_final_por_activo_por_simulacion = create_plot_rentabilidad_final_por_activo_por_simulacion(rentabilidad_final_por_activo_por_simulacion)
-        plot_rentabilidad_final_por_activo_por_simulacion_nominal = create_plot_rentabilidad_final_por_activo_por_simulacion(rentabilidad_final_por_activo_por_simulacion_nominal)
-
-
-        # Rentabilidad Total
-        plot_rentabilidad_por_simulacion = create_plot_rentabilidad_por_simulacion(inversion_inicial, rentabilidad_final_por_activo_por_simulacion, rentabilidad_objetivo)
-        plot_rentabilidad_por_simulacion_nominal = create_plot_rentabilidad_por_simulacion(inversion_inicial, rentabilidad_final_por_activo_por_simulacion_nominal, rentabilidad_objetivo)  
-
-        tab1, tab2 = st.tabs(["Real", "Nominal"])
-
-        with tab1:
-            st.plotly_chart(plot_rentabilidad_por_periodo_por_simulacion)
-            st.plotly_chart(plot_rentabilidad_final_por_activo_por_simulacion)
-            st.plotly_chart(plot_rentabilidad_por_simulacion)
-
-        with tab2:
-            st.plotly_chart(plot_rentabilidad_por_periodo_por_simulacion_nominal)
-            st.plotly_chart(plot_rentabilidad_final_por_activo_por_simulacion_nominal)
-            st.plotly_chart(plot_rentabilidad_por_simulacion_nominal)
+        # Sin cambios respecto al calendario por defecto no se pasa calendario y la simulacion puede reutilizar etapas
+        calendario = None
+        if tipo_calendario != "legacy" or crecimiento_dinero:
+            calendario = CalendarioEventos.desde_balanceo(balanceo, int(periodo_simulacion / (1/365)) + 1, fase, fase_dinero,
+                                                          calendario = tipo_calendario, crecimiento = crecimiento_dinero,
+                                                          inicio = end_date_str)
+
+        argumentos = dict(T = periodo_simulacion,
+                          activos_seleccionados = activos_seleccionados,
+                          inversion_inicial = inversion_inicial,
+                          distribucion_cartera = [1 / len(activos_seleccionados)] * len(activos_seleccionados),
+                          num_simulaciones = int(num_simulaciones),
+                          balanceo = balanceo,
+                          fase = fase,
+                          fase_dinero = fase_dinero,
+                          inflacion = inflacion,
+                          modo = "agregado" if grafico_por_periodo == "Abanico" else "completo",
+                          motor = "eventos" if grafico_por_periodo == "Abanico" else "diario",
+                          muestreo = muestreo,
+                          semilla = int(semilla),
+                          # El objetivo solo afecta a la simulacion si es adaptativa
+                          rentabilidad_objetivo = rentabilidad_objetivo if adaptativo else None,
+                          tolerancia = tolerancia,
+                          tiempo_maximo = tiempo_maximo,
+                          precision = precision,
+                          memoria_maxima = MEMORIA_MAXIMA,
+                          calendario = calendario)
+
+        # El directorio depende solo de la simulacion y de sus precios: simular otra vez lo mismo despues de una
+        # interrupcion abre la simulacion guardada y la continua desde el ultimo lote completado
+        almacen = None
+        if guardar and grafico_por_periodo != "Abanico":
+            almacen = os.path.join(RUTA_ALMACEN, clave_etapa("almacen", activos_seleccionados, start_date_str, end_date_str, offline,
+                                                             sorted(argumentos.items()))[:16])
+
+        # La simulacion se ejecuta en segundo plano: esta funcion corre en el hilo de la tarea y no puede usar st
+        def trabajo(progreso, cancelar):
+
+            # Solo se cargan los precios de los activos que no estan en la cache
+            base_data = cargar_precios(cache, empresas = activos_seleccionados, start_date = start_date_str, end_date = end_date_str,
+                                       offline = offline, instrumentacion = instrumentacion)
+
+            # Run Simulations and get Rentabilidad Total
+            if almacen is not None:
+                # La simulacion guardada en disco no pasa por la cache
+                resultado = run_multiple_simulations(df_consolidado = base_data, almacen = almacen, instrumentacion = instrumentacion,
+                                                     progreso = progreso, cancelar = cancelar, **argumentos)
+                clave = clave_etapa("almacen", almacen)
+            else:
+                clave, resultado = simular(cache, base_data, instrumentacion = instrumentacion, progreso = progreso, cancelar = cancelar,
+                                           **argumentos)
+
+            solucion = None
+            if buscar and not cancelar.is_set():
+                solucion = buscar_objetivo(cache, base_data, T = periodo_simulacion, activos_seleccionados = activos_seleccionados,
+                                           inversion_inicial = inversion_inicial, distribucion_cartera = argumentos["distribucion_cartera"],
+                                           num_simulaciones = int(num_simulaciones), balanceo = balanceo, fase = fase, inflacion = inflacion,
+                                           semilla = int(semilla), rentabilidad_objetivo = rentabilidad_objetivo,
+                                           probabilidad = probabilidad_buscada, riesgo_ruina = probabilidad_buscada,
+                                           modo = argumentos["modo"], motor = argumentos["motor"], muestreo = muestreo,
+                                           precision = precision, memoria_maxima = MEMORIA_MAXIMA, calendario = calendario,
+                                           instrumentacion = instrumentacion)
+
+            return {"clave": clave, "resultado": resultado, "solucion": solucion, "almacen": almacen, "instrumentacion": instrumentacion}
+
+        # Pulsar Simular otra vez con los mismos parametros mientras la simulacion sigue en curso no la repite.
+        # La ruta del almacen depende de los mismos argumentos, por lo que solo cuenta si se guarda o no
+        clave_tarea = clave_etapa("tarea", activos_seleccionados, start_date_str, end_date_str, offline, sorted(argumentos.items()),
+                                  almacen is not None, buscar, probabilidad_buscada if buscar else None,
+                                  rentabilidad_objetivo if buscar else None)
+        gestor.lanzar(clave_tarea, trabajo)
+
+        st.session_state["vista"] = {"inversion_inicial": inversion_inicial,
+                                     "rentabilidad_objetivo": rentabilidad_objetivo,
+                                     "grafico_por_periodo": grafico_por_periodo,
+                                     "fase": fase,
+                                     "num_simulaciones": int(num_simulaciones),
+                                     "mostrar_rendimiento": mostrar_rendimiento}
+
+    tarea = gestor.actual
+    if tarea is not None:
+
+        vista = st.session_state["vista"]
+
+        if not tarea.terminada:
+            # Mientras la tarea sigue, la pagina se refresca sola con el progreso y el ultimo resultado parcial
+            st.progress(tarea.fraccion, text = f"Simulando: {tarea.completadas:,} de {tarea.total or vista['num_simulaciones']:,} "
+                                               f"simulaciones ({tarea.tiempo:.0f} s)")
+            if st.button("Cancelar", key = "cancelar", disabled = tarea.cancelada):
+                tarea.cancelar()
+
+            parcial = tarea.parcial
+            if parcial is not None:
+                st.caption(f"Resultado parcial con {parcial.num_simulaciones:,} simulaciones")
+                mostrar_resultado(parcial, vista, cache)
+
+            time.sleep(INTERVALO_REFRESCO)
+            st.rerun()
+
+        elif tarea.error is not None:
+            st.error(str(tarea.error))
+
+        else:
+            salida = tarea.resultado
+            if salida["almacen"] is not None:
+                st.caption(f"Simulación guardada en {salida['almacen']}")
+
+            if tarea.cancelada:
+                # El resultado cancelado no esta en la cache: sus graficos tampoco se guardan
+                st.warning(f"Simulación cancelada: se muestran las {salida['resultado'].num_simulaciones:,} simulaciones completadas")
+                mostrar_resultado(salida["resultado"], vista, cache, instrumentacion = salida["instrumentacion"])
+            else:
+                mostrar_resultado(salida["resultado"], vista, cache, salida["clave"], salida["instrumentacion"], salida["solucion"])
 
     
     st.write("Activos Disponibles")
-    st.write(activos_data)
+    col_busqueda, col_sector = st.columns(2)
+    busqueda = col_busqueda.text_input("Buscar por símbolo o nombre", value = "")
+    sector = col_sector.selectbox("Sector", ["Todos"] + catalogo.sectores)
+    st.write(catalogo.consultar(texto = busqueda, sector = None if sector == "Todos" else sector))
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level = logging.INFO, format = "%(asctime)s %(name)s %(levelname)s %(message)s")
     home()
\ No newline at end of file
@@ -0,0 +1,323 @@
+"""
+Benchmarks del camino que va desde el boton "Simular" hasta los graficos
+
+Mide tiempo y memoria pico de las funciones de src sobre precios sinteticos, sin acceso a yfinance, para
+distintos numeros de simulaciones, activos y años de horizonte. El resultado se guarda en JSON, por defecto
+en benchmarks/resultados (fuera del control de versiones), para poder comparar dos commits:
+
+    python -m benchmarks.benchmark --salida benchmarks/resultados/base.json
+    python -m benchmarks.benchmark --salida benchmarks/resultados/nuevo.json --comparar benchmarks/resultados/base.json
+
+Cada resultado guarda en simulaciones_medidas las simulaciones que realmente se ejecutaron, que en las
+versiones por simulacion pueden ser menos que las del escenario (ver MAX_SIMULACIONES_BUCLE).
+"""
+
+from src.simulation import metricas_para_simulacion, geometric_brownian_motion, geometric_brownian_motion_batch
+from src.rentabilidad import compute_cambio_porcentual_por_activo, compute_cambio_porcentual_cubo
+from src.rentabilidad import rentabilidad_cartera_rebalanceo_inflacion, rentabilidad_cartera_rebalanceo_inflacion_vectorizada
+from src.rentabilidad import clean_rentabilidad_por_periodo
+from src.plots import create_plot_rentabilidad_por_periodo_por_simulacion, create_plot_rentabilidad_final_por_activo_por_simulacion
+from src.plots import create_plot_rentabilidad_por_simulacion, create_plot_abanico_rentabilidad_por_periodo
+from src.resultados import agregar_por_periodo
+import pandas as pd
+import numpy as np
+import subprocess
+import platform
+import argparse
+import datetime
+import tracemalloc
+import json
+import time
+import math
+import os
+
+# Escenario base. Cada eje se recorre por separado manteniendo los otros dos en su valor base
+BASE = {"simulaciones": 100, "activos": 3, "anios": 5}
+ESCALAS = {"simulaciones": (10, 100, 1000),
+           "activos": (1, 3, 10),
+           "anios": (1, 5, 20)}
+
+# Escalas reducidas para una comprobacion rapida
+ESCALAS_RAPIDAS = {"simulaciones": (10, 100),
+                   "activos": (1, 3),
+                   "anios": (1, 5)}
+
+# Las versiones con bucles de Python por simulacion son muy lentas en los escenarios grandes
+MAX_SIMULACIONES_BUCLE = 100
+
+# Casos que se miden con como mucho MAX_SIMULACIONES_BUCLE simulaciones
+CASOS_BUCLE = ("geometric_brownian_motion", "compute_cambio_porcentual_por_activo", "rentabilidad_cartera_rebalanceo_inflacion")
+
+# Fichero de resultados por defecto
+SALIDA = os.path.join("benchmarks", "resultados", "benchmark.json")
+
+DIAS_HISTORICO = 5 * 365
+INVERSION_INICIAL = 1000
+BALANCEO = "Mensual"
+FASE = "Acumulación"
+FASE_DINERO = 100
+INFLACION = 2
+DT = 1 / 365
+
+
+def precios_sinteticos(num_activos, num_dias = DIAS_HISTORICO, semilla = 0):
+
+    """
+    Genera una serie temporal de precios con la misma forma que el Data Frame consolidado de load_data
+
+    Args:
+    - num_activos: Numero de activos (columnas)
+    - num_dias: Numero de dias de historico
+    - semilla: Semilla del generador aleatorio
+
+    Returns:
+    - df_consolidado: Data Frame (dias x activos) con un indice de fechas diario
+    """
+
+    generador = np.random.default_rng(semilla)
+
+    rendimiento = generador.normal(0.0004, 0.015, size=(num_dias, num_activos))
+    precios = 100 * np.cumprod(1 + rendimiento, axis=0)
+
+    fechas = pd.date_range("2015-01-01", periods=num_dias, freq="D")
+
+    return pd.DataFrame(precios, index = fechas, columns = [f"ACT{i}" for i in range(num_activos)])
+
+
+def medir(funcion, repeticiones):
+
+    """
+    Mide el tiempo y la memoria pico de una funcion sin argumentos
+
+    El tiempo se mide sin tracemalloc, que ralentiza las reservas de memoria. La memoria pico se mide en una
+    ejecucion aparte.
+
+    Args:
+    - funcion: Funcion a medir
+    - repeticiones: Numero de ejecuciones para medir el tiempo
+
+    Returns:
+    - medida: diccionario con el tiempo minimo y mediano en segundos y la memoria pico en bytes
+    """
+
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    funcion()
+    _, memoria_pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"tiempo_min": min(tiempos),
+            "tiempo_mediana": float(np.median(tiempos)),
+            "memoria_pico": memoria_pico}
+
+
+def casos(num_simulaciones, num_activos, anios):
+
+    """
+    Prepara las funciones a medir para un escenario, con las entradas de cada etapa ya calculadas
+
+    Args:
+    - num_simulaciones: Numero de simulaciones
+    - num_activos: Numero de activos de la cartera
+    - anios: Horizonte de la simulacion en años
+
+    Returns:
+    - casos: diccionario nombre -> funcion sin argumentos
+    """
+
+    df_consolidado = precios_sinteticos(num_activos)
+    metricas = metricas_para_simulacion(df_consolidado)
+
+    mu = (1 + np.asarray(metricas[0])) ** 365 - 1
+    sigma = np.asarray(metricas[1]) * math.sqrt(365)
+    S0 = np.asarray(metricas[2])
+    pesos = [1 / num_activos] * num_activos
+    num_periodos = int(anios / DT) + 1
+
+    generador = np.random.default_rng(0)
+    _, S = geometric_brownian_motion_batch(anios, mu, sigma, S0, DT, num_activos, num_simulaciones, generador = generador)
+    tasa_de_cambio = compute_cambio_porcentual_cubo(S)
+
+    rentabilidad_total, rentabilidad_por_periodo = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(
+        INVERSION_INICIAL, tasa_de_cambio, pesos, BALANCEO, FASE, FASE_DINERO, INFLACION, "real")
+
+    rentabilidad_final_por_activo_por_simulacion = pd.DataFrame(rentabilidad_total, columns = df_consolidado.columns.tolist())
+    rentabilidad_final_por_activo_por_simulacion['rentabilidad_iteracion'] = rentabilidad_total.sum(axis=1)
+
+    rentabilidad_por_periodo_por_simulacion = clean_rentabilidad_por_periodo(rentabilidad_por_periodo)
+    agregado_por_periodo = agregar_por_periodo(rentabilidad_por_periodo)
+
+    # Entradas de las versiones por simulacion, con el formato de listas que esperan
+    num_simulaciones_bucle = min(num_simulaciones, MAX_SIMULACIONES_BUCLE)
+    S_lista = [S[i].tolist() for i in range(num_simulaciones_bucle)]
+    tasa_de_cambio_lista = [tasa_de_cambio[i].tolist() for i in range(num_simulaciones_bucle)]
+
+    casos = {
+        "metricas_para_simulacion":
+            lambda: metricas_para_simulacion(df_consolidado),
+        "geometric_brownian_motion":
+            lambda: [geometric_brownian_motion(anios, mu, sigma, S0, DT, num_activos) for _ in range(num_simulaciones_bucle)],
+        "geometric_brownian_motion_batch":
+            lambda: geometric_brownian_motion_batch(anios, mu, sigma, S0, DT, num_activos, num_simulaciones),
+        "compute_cambio_porcentual_por_activo":
+            lambda: [compute_cambio_porcentual_por_activo(S_i) for S_i in S_lista],
+        "compute_cambio_porcentual_cubo":
+            lambda: compute_cambio_porcentual_cubo(S),
+        "rentabilidad_cartera_rebalanceo_inflacion":
+            lambda: [rentabilidad_cartera_rebalanceo_inflacion([INVERSION_INICIAL], tasa_i, pesos, num_periodos, num_activos,
+                                                               BALANCEO, FASE, FASE_DINERO, INFLACION, "real")
+                     for tasa_i in tasa_de_cambio_lista],
+        "rentabilidad_cartera_rebalanceo_inflacion_vectorizada":
+            lambda: rentabilidad_cartera_rebalanceo_inflacion_vectorizada(INVERSION_INICIAL, tasa_de_cambio, pesos, BALANCEO,
+                                                                          FASE, FASE_DINERO, INFLACION, "real"),
+        "clean_rentabilidad_por_periodo":
+            lambda: clean_rentabilidad_por_periodo(rentabilidad_por_periodo),
+        "create_plot_rentabilidad_por_periodo_por_simulacion":
+            lambda: create_plot_rentabilidad_por_periodo_por_simulacion(rentabilidad_por_periodo_por_simulacion),
+        "create_plot_rentabilidad_final_por_activo_por_simulacion":
+            lambda: create_plot_rentabilidad_final_por_activo_por_simulacion(rentabilidad_final_por_activo_por_simulacion),
+        "create_plot_rentabilidad_por_simulacion":
+            lambda: create_plot_rentabilidad_por_simulacion(INVERSION_INICIAL, rentabilidad_final_por_activo_por_simulacion,
+                                                            2 * INVERSION_INICIAL),
+        "agregar_por_periodo":
+            lambda: agregar_por_periodo(rentabilidad_por_periodo),
+        "create_plot_abanico_rentabilidad_por_periodo":
+            lambda: create_plot_abanico_rentabilidad_por_periodo(agregado_por_periodo),
+        }
+
+    return casos, num_simulaciones_bucle
+
+
+def escenarios(escalas):
+
+    """
+    Lista de escenarios (simulaciones, activos, anios) sin repetir, variando un eje cada vez sobre BASE
+    """
+
+    escenarios = []
+    for eje, valores in escalas.items():
+        for valor in valores:
+            escenario = dict(BASE, **{eje: valor})
+            if escenario not in escenarios:
+                escenarios.append(escenario)
+
+    return escenarios
+
+
+def metadatos():
+
+    """
+    Informacion del entorno para poder comparar resultados entre commits y maquinas
+    """
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {"commit": commit,
+            "fecha": datetime.datetime.now().isoformat(timespec = "seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "plataforma": platform.platform()}
+
+
+def ejecutar(escalas, repeticiones, funciones = None):
+
+    """
+    Ejecuta todos los benchmarks
+
+    Args:
+    - escalas: Diccionario eje -> valores a recorrer
+    - repeticiones: Ejecuciones por medida de tiempo
+    - funciones: Nombres de las funciones a medir, o None para todas
+
+    Returns:
+    - resultados: lista de diccionarios, uno por funcion y escenario, con las simulaciones del escenario y las medidas
+    """
+
+    resultados = []
+
+    for escenario in escenarios(escalas):
+        casos_escenario, num_simulaciones_bucle = casos(escenario["simulaciones"], escenario["activos"], escenario["anios"])
+
+        for nombre, funcion in casos_escenario.items():
+            if funciones is not None and nombre not in funciones:
+                continue
+
+            simulaciones_medidas = num_simulaciones_bucle if nombre in CASOS_BUCLE else escenario["simulaciones"]
+            medida = medir(funcion, repeticiones)
+            resultados.append(dict(funcion = nombre, **escenario, simulaciones_medidas = simulaciones_medidas, **medida))
+
+            print(f"{nombre:<58} sims={simulaciones_medidas:<5} activos={escenario['activos']:<3} "
+                  f"anios={escenario['anios']:<3} {medida['tiempo_min'] * 1000:10.2f} ms {medida['memoria_pico'] / 2**20:9.2f} MiB")
+
+        if num_simulaciones_bucle < escenario["simulaciones"]:
+            print(f"(las versiones por simulacion se miden con {num_simulaciones_bucle} simulaciones)")
+
+    return resultados
+
+
+def comparar(resultados, resultados_base):
+
+    """
+    Imprime el cociente de tiempo y memoria respecto a una ejecucion anterior, por simulacion medida si las dos
+    ejecuciones no midieron las mismas simulaciones
+
+    Args:
+    - resultados: Resultados de la ejecucion actual
+    - resultados_base: Resultados de la ejecucion de referencia
+    """
+
+    clave = lambda r: (r["funcion"], r["simulaciones"], r["activos"], r["anios"])
+    base = {clave(r): r for r in resultados_base}
+
+    print(f"\n{'funcion':<58} {'escenario':<20} {'tiempo':>8} {'memoria':>8}")
+    for r in resultados:
+        b = base.get(clave(r))
+        if b is None:
+            continue
+
+        # Los resultados sin simulaciones_medidas son de antes de registrarlas: se midieron las del escenario, con el limite de los bucles
+        medidas = r.get("simulaciones_medidas", r["simulaciones"])
+        medidas_base = b.get("simulaciones_medidas", min(b["simulaciones"], MAX_SIMULACIONES_BUCLE) if b["funcion"] in CASOS_BUCLE else b["simulaciones"])
+        escala = medidas_base / medidas
+
+        ratio_tiempo = r["tiempo_min"] * escala / b["tiempo_min"] if b["tiempo_min"] > 0 else float("nan")
+        ratio_memoria = r["memoria_pico"] * escala / b["memoria_pico"] if b["memoria_pico"] > 0 else float("nan")
+        print(f"{r['funcion']:<58} {r['simulaciones']:>5}/{r['activos']:>3}/{r['anios']:>3}{'':<8} {ratio_tiempo:8.2f}x {ratio_memoria:8.2f}x")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Benchmarks de simulacion, rebalanceo, formato y graficos con precios sinteticos")
+    parser.add_argument("--salida", default = SALIDA, help = "Fichero JSON de resultados")
+    parser.add_argument("--comparar", help = "Fichero JSON de una ejecucion anterior con el que comparar")
+    parser.add_argument("--repeticiones", type = int, default = 3, help = "Ejecuciones por medida de tiempo")
+    parser.add_argument("--rapido", action = "store_true", help = "Usar escalas reducidas")
+    parser.add_argument("--funciones", nargs = "+", help = "Medir solo estas funciones")
+    args = parser.parse_args()
+
+    escalas = ESCALAS_RAPIDAS if args.rapido else ESCALAS
+    resultados = ejecutar(escalas, args.repeticiones, args.funciones)
+
+    directorio = os.path.dirname(args.salida)
+    if directorio:
+        os.makedirs(directorio, exist_ok = True)
+
+    with open(args.salida, "w") as f:
+        json.dump({"metadatos": metadatos(), "resultados": resultados}, f, indent = 2)
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            comparar(resultados, json.load(f)["resultados"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+from src.resultados import SimulationResult
+from numpy.lib.format import open_memmap
+import numpy as np
+import json
+import os
+
+# Directorio por defecto de las simulaciones guardadas
+RUTA_ALMACEN = os.path.join("data", "cache", "simulaciones")
+
+# Simulaciones por grupo de filas al exportar a Parquet
+SIMULACIONES_POR_GRUPO = 1000
+
+TIPOS = ("real", "nominal")
+
+
+class AlmacenResultados:
+
+    """
+    Resultado completo de una simulacion guardado en disco
+
+    Cada simulacion es un directorio con:
+    - parametros.json: parametros de la simulacion, activos y dtype
+    - progreso.json: numero de lotes ya escritos (siempre un prefijo de los lotes, que se escriben en orden)
+    - periodos.npy: periodo (base 1) de cada columna de la rentabilidad por periodo
+    - rentabilidad_total_{real,nominal}.npy: array (simulaciones x activos) con la rentabilidad final de cada activo
+    - rentabilidad_por_periodo_{real,nominal}.npy: array (simulaciones x periodos) con la rentabilidad de la cartera
+
+    Los .npy se abren como memoria mapeada (np.lib.format.open_memmap), por lo que se escriben lote a lote sin
+    tener la simulacion entera en memoria y se leen solo las partes que se usan. Si una simulacion larga se
+    interrumpe, los lotes ya escritos se conservan y run_multiple_simulations continua desde el siguiente.
+
+    Args:
+    - ruta (string): Directorio de la simulacion
+    - modo: "r" para leer o "r+" para seguir escribiendo
+    """
+
+    def __init__(self, ruta, modo = "r"):
+
+        self.ruta = ruta
+        self.modo = modo
+
+        with open(self._archivo("parametros.json")) as f:
+            self.parametros = json.load(f)
+
+        self.periodos = np.load(self._archivo("periodos.npy"))
+
+        # Memoria mapeada: no se lee nada del disco hasta que se accede a los datos
+        self._rentabilidad_total = {tipo: open_memmap(self._archivo(f"rentabilidad_total_{tipo}.npy"), mode = modo) for tipo in TIPOS}
+        self._rentabilidad_por_periodo = {tipo: open_memmap(self._archivo(f"rentabilidad_por_periodo_{tipo}.npy"), mode = modo) for tipo in TIPOS}
+
+    @classmethod
+    def crear(cls, ruta, parametros, activos, num_simulaciones, periodos, dtype = np.float64):
+
+        """
+        Crea el directorio de una simulacion nueva con los arrays vacios
+
+        Args:
+        - ruta (string): Directorio de la simulacion, se crea si no existe
+        - parametros (dict): Parametros de la simulacion, serializables a JSON
+        - activos (list): Activos de la cartera
+        - num_simulaciones: Numero de simulaciones
+        - periodos: array con el periodo (base 1) de cada columna de la rentabilidad por periodo
+        - dtype: Tipo de la rentabilidad por periodo. La rentabilidad final siempre es float64
+
+        Returns:
+        - almacen (AlmacenResultados) abierto para escritura
+        """
+
+        os.makedirs(ruta, exist_ok=True)
+
+        periodos = np.asarray(periodos)
+        np.save(os.path.join(ruta, "periodos.npy"), periodos)
+
+        for tipo in TIPOS:
+            open_memmap(os.path.join(ruta, f"rentabilidad_total_{tipo}.npy"), mode = "w+", dtype = np.float64,
+                        shape = (num_simulaciones, len(activos))).flush()
+            open_memmap(os.path.join(ruta, f"rentabilidad_por_periodo_{tipo}.npy"), mode = "w+", dtype = dtype,
+                        shape = (num_simulaciones, len(periodos))).flush()
+
+        _escribir_json(os.path.join(ruta, "parametros.json"), {"parametros": parametros,
+                                                               "activos": list(activos),
+                                                               "num_simulaciones": num_simulaciones,
+                                                               "dtype": np.dtype(dtype).name})
+        _escribir_json(os.path.join(ruta, "progreso.json"), {"lotes_completados": 0, "simulaciones_completadas": 0})
+
+        return cls(ruta, modo = "r+")
+
+    @classmethod
+    def abrir_o_crear(cls, ruta, parametros, activos, num_simulaciones, periodos, dtype = np.float64):
+
+        """
+        Abre la simulacion de ruta para continuarla o, si no existe, la crea
+
+        Raises:
+        - ValueError: Si ruta contiene una simulacion con otros parametros
+        """
+
+        if not os.path.exists(os.path.join(ruta, "parametros.json")):
+            return cls.crear(ruta, parametros, activos, num_simulaciones, periodos, dtype)
+
+        almacen = cls(ruta, modo = "r+")
+
+        # Se compara a traves de JSON para que tuplas y listas, o floats de NumPy y de Python, sean iguales
+        guardado = almacen.parametros
+        nuevo = json.loads(json.dumps({"parametros": parametros, "activos": list(activos), "num_simulaciones": num_simulaciones,
+                                       "dtype": np.dtype(dtype).name}))
+        if guardado != nuevo:
+            raise ValueError(f"El almacen {ruta} contiene una simulacion con otros parametros")
+
+        return almacen
+
+    def _archivo(self, nombre):
+        return os.path.join(self.ruta, nombre)
+
+    @property
+    def activos(self):
+        return self.parametros["activos"]
+
+    @property
+    def num_simulaciones(self):
+        return self.parametros["num_simulaciones"]
+
+    @property
+    def progreso(self):
+
+        """
+        Lotes y simulaciones ya escritos
+        """
+
+        with open(self._archivo("progreso.json")) as f:
+            return json.load(f)
+
+    @property
+    def completo(self):
+        return self.progreso["simulaciones_completadas"] >= self.num_simulaciones
+
+    def escribir_lote(self, inicio, lote_total, lote_por_periodo, lote_total_nominal, lote_por_periodo_nominal):
+
+        """
+        Escribe un lote de simulaciones a partir de la fila inicio y lo marca como completado
+
+        Los datos se vuelcan a disco antes de actualizar progreso.json, y este se reemplaza de forma atomica,
+        por lo que una interrupcion nunca deja marcado como completado un lote a medio escribir.
+        """
+
+        final = inicio + len(lote_total)
+
+        for tipo, total, por_periodo in (("real", lote_total, lote_por_periodo), ("nominal", lote_total_nominal, lote_por_periodo_nominal)):
+            self._rentabilidad_total[tipo][inicio:final] = total
+            self._rentabilidad_por_periodo[tipo][inicio:final] = por_periodo
+            self._rentabilidad_total[tipo].flush()
+            self._rentabilidad_por_periodo[tipo].flush()
+
+        progreso = self.progreso
+        _escribir_json(self._archivo("progreso.json"), {"lotes_completados": progreso["lotes_completados"] + 1,
+                                                        "simulaciones_completadas": final})
+
+    def rentabilidad_total(self, tipo_rentabilidad = "real"):
+        return self._rentabilidad_total[tipo_rentabilidad]
+
+    def rentabilidad_por_periodo(self, tipo_rentabilidad = "real"):
+        return self._rentabilidad_por_periodo[tipo_rentabilidad]
+
+    def resultado(self, convergencia = None):
+
+        """
+        SimulationResult de las simulaciones ya escritas, sobre la memoria mapeada y sin copiar los datos
+        """
+
+        completadas = self.progreso["simulaciones_completadas"]
+
+        return SimulationResult(activos = self.activos,
+                                rentabilidad_total = self._rentabilidad_total["real"][:completadas],
+                                rentabilidad_por_periodo = self._rentabilidad_por_periodo["real"][:completadas],
+                                rentabilidad_total_nominal = self._rentabilidad_total["nominal"][:completadas],
+                                rentabilidad_por_periodo_nominal = self._rentabilidad_por_periodo["nominal"][:completadas],
+                                convergencia = convergencia,
+                                periodos = self.periodos)
+
+    def exportar_parquet(self, directorio = None, simulaciones_por_grupo = SIMULACIONES_POR_GRUPO):
+
+        """
+        Exporta las simulaciones escritas a Parquet, por grupos de simulaciones para no cargarlas todas en memoria
+
+        - rentabilidad_por_periodo.parquet: formato largo con las columnas simulation, period, rentabilidad_real y rentabilidad_nominal
+        - rentabilidad_final.parquet: una fila por simulacion con la rentabilidad final real y nominal de cada activo
+
+        Args:
+        - directorio (string): Directorio de salida. Por defecto el de la simulacion
+        - simulaciones_por_grupo: Simulaciones por grupo de filas de Parquet
+
+        Returns:
+        - rutas: lista con las rutas de los dos archivos
+        """
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        directorio = self.ruta if directorio is None else directorio
+        os.makedirs(directorio, exist_ok=True)
+
+        completadas = self.progreso["simulaciones_completadas"]
+        num_periodos = len(self.periodos)
+
+        ruta_por_periodo = os.path.join(directorio, "rentabilidad_por_periodo.parquet")
+        ruta_final = os.path.join(directorio, "rentabilidad_final.parquet")
+
+        escritor = None
+        try:
+            for inicio in range(0, completadas, simulaciones_por_grupo):
+                final = min(inicio + simulaciones_por_grupo, completadas)
+
+                tabla = pa.table({"simulation": np.repeat(np.arange(inicio + 1, final + 1), num_periodos),
+                                  "period": np.tile(self.periodos, final - inicio),
+                                  "rentabilidad_real": self._rentabilidad_por_periodo["real"][inicio:final].ravel(),
+                                  "rentabilidad_nominal": self._rentabilidad_por_periodo["nominal"][inicio:final].ravel()})
+
+                if escritor is None:
+                    escritor = pq.ParquetWriter(ruta_por_periodo, tabla.schema)
+                escritor.write_table(tabla)
+        finally:
+            if escritor is not None:
+                escritor.close()
+
+        columnas = {"simulation": np.arange(1, completadas + 1)}
+        for tipo in TIPOS:
+            for j, activo in enumerate(self.activos):
+                columnas[f"{activo}_{tipo}"] = self._rentabilidad_total[tipo][:completadas, j]
+        pq.write_table(pa.table(columnas), ruta_final)
+
+        return [ruta_por_periodo, ruta_final]
+
+
+def abrir_almacen(ruta):
+
+    """
+    Abre una simulacion guardada para leerla, sin cargar sus datos en memoria
+
+    Args:
+    - ruta (string): Directorio de la simulacion
+
+    Returns:
+    - almacen (AlmacenResultados)
+    """
+
+    return AlmacenResultados(ruta, modo = "r")
+
+
+def semilla_guardada(ruta):
+
+    """
+    Semilla de la simulacion guardada en ruta, para continuarla con los mismos generadores por lote
+
+    Returns:
+    - semilla (int), o None si ruta no contiene una simulacion
+    """
+
+    archivo = os.path.join(ruta, "parametros.json")
+    if not os.path.exists(archivo):
+        return None
+
+    with open(archivo) as f:
+        return json.load(f)["parametros"].get("semilla")
+
+
+def _escribir_json(ruta, datos):
+
+    # Se escribe en un archivo temporal y se reemplaza, para no dejar nunca un JSON a medias
+    temporal = ruta + ".tmp"
+    with open(temporal, "w") as f:
+        json.dump(datos, f, indent = 2)
+    os.replace(temporal, ruta)
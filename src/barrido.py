@@ -0,0 +1,139 @@
+from src.simulation import parametros_mercado, generar_cambio_porcentual, _dividir_en_lotes, TAMANO_LOTE
+from src.rentabilidad import rentabilidad_cartera_rebalanceo_inflacion_vectorizada
+from src.resultados import intervalo_probabilidad, CONFIANZA
+from itertools import product
+import pandas as pd
+import numpy as np
+
+# Percentiles de la rentabilidad final que se incluyen en la tabla del barrido
+PERCENTILES_BARRIDO = (5, 50, 95)
+
+
+def _resumir(valores, base, rentabilidad_objetivo, confianza, sufijo):
+
+    """
+    Estadisticos de la rentabilidad final de un punto del barrido y su diferencia pareada con el punto base
+
+    Con numeros aleatorios comunes la diferencia se estima simulacion a simulacion, por lo que su error es
+    mucho menor que el de comparar dos simulaciones independientes.
+    """
+
+    n = len(valores)
+    diferencia = valores - base
+
+    fila = {f"media_{sufijo}": valores.mean(),
+            f"desv_{sufijo}": valores.std(ddof=1) if n > 1 else 0.0}
+    for percentil, valor in zip(PERCENTILES_BARRIDO, np.percentile(valores, PERCENTILES_BARRIDO)):
+        fila[f"p{percentil}_{sufijo}"] = valor
+
+    fila[f"diferencia_media_{sufijo}"] = diferencia.mean()
+    fila[f"error_diferencia_{sufijo}"] = diferencia.std(ddof=1) / np.sqrt(n) if n > 1 else 0.0
+
+    if sufijo == "real":
+        exitos = int((valores > rentabilidad_objetivo).sum())
+        probabilidad, inferior, superior = intervalo_probabilidad(exitos, n, confianza)
+        fila[f"prob_objetivo_{sufijo}"] = probabilidad * 100
+        fila[f"prob_objetivo_{sufijo}_inferior"] = inferior * 100
+        fila[f"prob_objetivo_{sufijo}_superior"] = superior * 100
+
+    return fila
+
+
+def barrido_parametros(df_consolidado, T, activos_seleccionados, inversion_inicial, num_simulaciones, fase, rentabilidad_objetivo,
+                       balanceos = ("Mensual",), fases_dinero = (0,), inflaciones = (2,), distribuciones = None,
+                       tamano_lote = TAMANO_LOTE, semilla = None, muestreo = "estandar", correlacion = True, precision = "float64",
+                       confianza = CONFIANZA):
+
+    """
+    Compara variantes de una cartera con numeros aleatorios comunes
+
+    El cubo de cambios porcentuales de los activos se genera una sola vez por lote y se valora con cada
+    combinacion de balanceo x fase_dinero x inflacion x distribucion, pasando solo por la etapa de rebalanceo.
+    Todas las variantes ven las mismas trayectorias de mercado, por lo que sus diferencias no se mezclan con
+    el ruido de la simulacion y el coste de cada variante adicional es solo el del rebalanceo.
+
+    La rentabilidad nominal no depende de la inflacion, por lo que se calcula una vez por balanceo, fase_dinero
+    y distribucion.
+
+    Args:
+    - df_cosolidado (data.frane): Data Frame con la serie temportal de los precios de las acciones
+    - T: Periodo por el cual se desea simular en años
+    - activos_seleccionados (list): Lista de activos
+    - inversion_inicial: Inversion Inicial
+    - num_simulaciones: Numero de simulaciones, las mismas para todas las variantes
+    - fase: Fase en la que se encuentra, Acumulacion o Distribucion
+    - rentabilidad_objetivo: Monto final objetivo
+    - balanceos: Frecuencias de rebalanceo a comparar
+    - fases_dinero: Dinero que se invierte o retira en cada periodo de rebalanceo, valores a comparar
+    - inflaciones: Inflaciones anuales a comparar
+    - distribuciones: Lista de listas de pesos a comparar. Por defecto solo la cartera equiponderada
+    - tamano_lote, semilla, muestreo, correlacion, precision, confianza: ver run_multiple_simulations
+
+    Returns:
+    - barrido: Data Frame con una fila por combinacion: sus parametros, la probabilidad real de superar el objetivo
+      (prob_objetivo_real) con su intervalo de confianza y los estadisticos de la rentabilidad final real y nominal. Las columnas
+      diferencia_media_* y error_diferencia_* comparan cada combinacion con la primera, simulacion a simulacion
+    """
+
+    num_assets = len(activos_seleccionados)
+
+    if distribuciones is None:
+        distribuciones = [[1 / num_assets] * num_assets]
+    for pesos in distribuciones:
+        if len(pesos) != num_assets:
+            raise ValueError(f"La distribucion {pesos} no tiene un peso por activo")
+
+    parametros = parametros_mercado(df_consolidado, T, num_assets, correlacion, muestreo, precision)
+
+    combinaciones = list(product(balanceos, fases_dinero, inflaciones, range(len(distribuciones))))
+    carteras = list(product(balanceos, fases_dinero, range(len(distribuciones))))
+
+    # Rentabilidad total final de cada combinacion en cada simulacion
+    finales_real = {combinacion: np.empty(num_simulaciones) for combinacion in combinaciones}
+    finales_nominal = {cartera: np.empty(num_simulaciones) for cartera in carteras}
+
+    lotes = _dividir_en_lotes(num_simulaciones, tamano_lote)
+    semillas = np.random.SeedSequence(semilla).spawn(len(lotes))
+
+    inicio = 0
+    for tamano, semilla_lote in zip(lotes, semillas):
+
+        final = inicio + tamano
+
+        # Un solo cubo por lote, comun a todas las combinaciones
+        cambio_porcentual_por_activo = generar_cambio_porcentual(parametros, tamano, np.random.default_rng(semilla_lote))
+
+        for balanceo, fase_dinero, indice_pesos in carteras:
+
+            rentabilidad_total, _ = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(inversion_inicial, cambio_porcentual_por_activo,
+                                                                                          distribuciones[indice_pesos], balanceo, fase,
+                                                                                          fase_dinero, 0, "nominal")
+            finales_nominal[(balanceo, fase_dinero, indice_pesos)][inicio:final] = rentabilidad_total.sum(axis=1)
+
+            for inflacion in inflaciones:
+                rentabilidad_total, _ = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(inversion_inicial, cambio_porcentual_por_activo,
+                                                                                              distribuciones[indice_pesos], balanceo, fase,
+                                                                                              fase_dinero, inflacion, "real")
+                finales_real[(balanceo, fase_dinero, inflacion, indice_pesos)][inicio:final] = rentabilidad_total.sum(axis=1)
+
+        del cambio_porcentual_por_activo
+        inicio = final
+
+    base_real = finales_real[combinaciones[0]]
+    base_nominal = finales_nominal[carteras[0]]
+
+    filas = []
+    for balanceo, fase_dinero, inflacion, indice_pesos in combinaciones:
+
+        fila = {"balanceo": balanceo,
+                "fase_dinero": fase_dinero,
+                "inflacion": inflacion,
+                "pesos": ";".join(f"{peso:g}" for peso in distribuciones[indice_pesos]),
+                "num_simulaciones": num_simulaciones}
+
+        fila.update(_resumir(finales_real[(balanceo, fase_dinero, inflacion, indice_pesos)], base_real, rentabilidad_objetivo, confianza, "real"))
+        fila.update(_resumir(finales_nominal[(balanceo, fase_dinero, indice_pesos)], base_nominal, rentabilidad_objetivo, confianza, "nominal"))
+
+        filas.append(fila)
+
+    return pd.DataFrame(filas)
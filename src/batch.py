@@ -0,0 +1,290 @@
+"""
+Proyeccion por lotes de muchas carteras sin la app de Streamlit
+
+Lee un archivo de escenarios (CSV o JSON), descarga una sola vez los precios de todos los activos que
+aparecen en ellos, simula los escenarios en paralelo y escribe un resumen con una fila por escenario:
+
+    python -m src.batch escenarios.csv --salida resumen.parquet --procesos 4
+
+Columnas del CSV (una fila por escenario; activos y pesos separados por ";"):
+    id, activos, pesos, inversion_inicial, fase, fase_dinero, balanceo, inflacion, anios, rentabilidad_objetivo
+
+En JSON, una lista de objetos con las mismas claves, con activos y pesos como listas. Solo activos es
+obligatorio; el resto toma los valores de ESCENARIO_POR_DEFECTO y, sin pesos, la cartera es equiponderada.
+"""
+
+from src.simulation import run_multiple_simulations
+from src.load_data import load_data
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import pandas as pd
+import numpy as np
+import argparse
+import logging
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Valores de los campos que no indica el escenario, los mismos que la app
+ESCENARIO_POR_DEFECTO = {"pesos": None,
+                         "inversion_inicial": 1000,
+                         "fase": "Acumulación",
+                         "fase_dinero": 0,
+                         "balanceo": "Mensual",
+                         "inflacion": 2,
+                         "anios": 1,
+                         "rentabilidad_objetivo": 1000}
+
+# Años de historico de precios para estimar los parametros, como en la app
+ANIOS_HISTORICO = 3
+
+# Percentiles de la rentabilidad final que se incluyen en el resumen
+PERCENTILES_RESUMEN = (5, 50, 95)
+
+
+def _lista(valor, tipo = str):
+
+    """
+    Convierte "a;b;c", una lista o un solo valor en una lista de tipo. Los valores vacios se convierten en None
+    """
+
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return None
+    if isinstance(valor, str):
+        valor = [parte.strip() for parte in valor.split(";") if parte.strip()]
+    elif np.ndim(valor) == 0:
+        # Un CSV con un solo activo y peso numerico da un numero, no un texto
+        valor = [valor]
+
+    return [tipo(elemento) for elemento in valor]
+
+
+def leer_escenarios(ruta):
+
+    """
+    Lee y valida el archivo de escenarios
+
+    Args:
+    - ruta (string): Archivo .csv o .json
+
+    Returns:
+    - escenarios: lista de diccionarios con todos los campos de ESCENARIO_POR_DEFECTO, id y activos
+
+    Raises:
+    - ValueError: Si el formato no es valido o un escenario no tiene activos o sus pesos no corresponden
+    """
+
+    if ruta.endswith(".json"):
+        with open(ruta) as f:
+            filas = json.load(f)
+    elif ruta.endswith(".csv"):
+        filas = pd.read_csv(ruta).to_dict(orient = "records")
+    else:
+        raise ValueError(f"Formato de escenarios no valido: {ruta}")
+
+    escenarios = []
+    for i, fila in enumerate(filas):
+
+        # Campos vacios del CSV llegan como NaN
+        fila = {clave: valor for clave, valor in fila.items() if not (isinstance(valor, float) and np.isnan(valor))}
+        escenario = dict(ESCENARIO_POR_DEFECTO, **fila)
+        escenario["id"] = str(fila.get("id", i + 1))
+
+        escenario["activos"] = _lista(escenario.get("activos"))
+        if not escenario["activos"]:
+            raise ValueError(f"El escenario {escenario['id']} no tiene activos")
+
+        num_activos = len(escenario["activos"])
+        pesos = _lista(escenario["pesos"], float)
+        if pesos is None:
+            pesos = [1 / num_activos] * num_activos
+        if len(pesos) != num_activos:
+            raise ValueError(f"El escenario {escenario['id']} tiene {num_activos} activos y {len(pesos)} pesos")
+        if not np.isclose(sum(pesos), 1):
+            raise ValueError(f"Los pesos del escenario {escenario['id']} no suman 1")
+        escenario["pesos"] = pesos
+
+        escenarios.append(escenario)
+
+    return escenarios
+
+
+def _simular_escenario(escenario, df_consolidado, opciones, semilla):
+
+    """
+    Simula un escenario y resume su rentabilidad final
+
+    Returns:
+    - fila (dict): Resumen del escenario. Si la simulacion falla, la columna error tiene el mensaje
+    """
+
+    inicio = time.perf_counter()
+
+    fila = {"id": escenario["id"],
+            "activos": ";".join(escenario["activos"]),
+            "inversion_inicial": escenario["inversion_inicial"],
+            "fase": escenario["fase"],
+            "fase_dinero": escenario["fase_dinero"],
+            "balanceo": escenario["balanceo"],
+            "inflacion": escenario["inflacion"],
+            "anios": escenario["anios"],
+            "rentabilidad_objetivo": escenario["rentabilidad_objetivo"],
+            "error": None}
+
+    try:
+        sin_precios = [activo for activo in escenario["activos"] if df_consolidado[activo].count() < 2]
+        if sin_precios:
+            raise ValueError(f"Sin precios para {', '.join(sin_precios)}")
+
+        resultado = run_multiple_simulations(df_consolidado = df_consolidado,
+                                             T = escenario["anios"],
+                                             activos_seleccionados = escenario["activos"],
+                                             inversion_inicial = escenario["inversion_inicial"],
+                                             distribucion_cartera = escenario["pesos"],
+                                             num_simulaciones = opciones["num_simulaciones"],
+                                             balanceo = escenario["balanceo"],
+                                             fase = escenario["fase"],
+                                             fase_dinero = escenario["fase_dinero"],
+                                             inflacion = escenario["inflacion"],
+                                             modo = "agregado",
+                                             motor = opciones["motor"],
+                                             muestreo = opciones["muestreo"],
+                                             semilla = semilla)
+
+        fila["num_simulaciones"] = resultado.num_simulaciones
+
+        for tipo in ("real", "nominal"):
+            rentabilidad_iteracion = resultado.rentabilidad_iteracion(tipo)
+            fila[f"media_{tipo}"] = rentabilidad_iteracion.mean()
+            for percentil, valor in zip(PERCENTILES_RESUMEN, np.percentile(rentabilidad_iteracion, PERCENTILES_RESUMEN)):
+                fila[f"p{percentil}_{tipo}"] = valor
+
+        inferior, superior = resultado.intervalo_probabilidad_objetivo(escenario["rentabilidad_objetivo"], "real")
+        fila["prob_objetivo"] = resultado.probabilidad_objetivo(escenario["rentabilidad_objetivo"], "real")
+        fila["prob_objetivo_inferior"] = inferior
+        fila["prob_objetivo_superior"] = superior
+
+    except Exception as error:
+        # Un escenario erroneo no detiene el resto del lote
+        fila["error"] = f"{type(error).__name__}: {error}"
+
+    fila["tiempo"] = time.perf_counter() - inicio
+
+    return fila
+
+
+def ejecutar_escenarios(escenarios, num_simulaciones = 1000, num_procesos = None, semilla = None, motor = "eventos", muestreo = "estandar",
+                        anios_historico = ANIOS_HISTORICO, offline = False, cargador = load_data):
+
+    """
+    Simula todos los escenarios
+
+    Los precios de todos los activos se cargan en una sola llamada a cargador (que usa la cache local y
+    agrupa las descargas), y cada escenario recibe solo las columnas de sus activos.
+
+    Args:
+    - escenarios: Lista de escenarios (ver leer_escenarios)
+    - num_simulaciones: Simulaciones por escenario
+    - num_procesos: Procesos en los que se reparten los escenarios. Por defecto uno por CPU
+    - semilla (int): Semilla de la que se deriva una semilla independiente por escenario
+    - motor, muestreo: ver run_multiple_simulations
+    - anios_historico: Años de precios historicos hasta hoy
+    - offline (bool): Usar solo los precios de la cache local
+    - cargador: Funcion con la firma de load_data
+
+    Returns:
+    - resumen: Data Frame con una fila por escenario, en el orden de escenarios
+    - estadisticas (dict): tiempo total, escenarios por minuto y escenarios con error
+    """
+
+    inicio = time.perf_counter()
+
+    end_date = datetime.today()
+    start_date = end_date - timedelta(days = anios_historico * 365)
+
+    # Una sola carga de precios para todos los activos, sin repetir
+    empresas = list(dict.fromkeys(activo for escenario in escenarios for activo in escenario["activos"]))
+    precios = cargador(empresas = empresas, start_date = start_date.strftime('%Y-%m-%d'), end_date = end_date.strftime('%Y-%m-%d'), offline = offline)
+
+    tiempo_datos = time.perf_counter() - inicio
+    logger.info("Precios de %d activos cargados en %.1f s", len(empresas), tiempo_datos)
+
+    # Una semilla independiente por escenario: el resultado de cada escenario no depende del orden ni del numero de procesos
+    semillas = np.random.SeedSequence(semilla).generate_state(len(escenarios), dtype = np.uint64).tolist()
+
+    opciones = {"num_simulaciones": num_simulaciones, "motor": motor, "muestreo": muestreo}
+    datos = [precios.reindex(columns = escenario["activos"]).dropna(how = "all") for escenario in escenarios]
+
+    num_procesos = num_procesos or os.cpu_count() or 1
+    if num_procesos > 1:
+        with ProcessPoolExecutor(max_workers = num_procesos) as executor:
+            filas = list(executor.map(_simular_escenario, escenarios, datos, [opciones] * len(escenarios), semillas))
+    else:
+        filas = list(map(_simular_escenario, escenarios, datos, [opciones] * len(escenarios), semillas))
+
+    tiempo_total = time.perf_counter() - inicio
+    resumen = pd.DataFrame(filas)
+
+    estadisticas = {"escenarios": len(escenarios),
+                    "errores": int(resumen["error"].notna().sum()),
+                    "tiempo_datos": tiempo_datos,
+                    "tiempo_total": tiempo_total,
+                    "escenarios_por_minuto": 60 * len(escenarios) / tiempo_total if tiempo_total > 0 else float("inf")}
+
+    return resumen, estadisticas
+
+
+def guardar_resumen(resumen, ruta):
+
+    """
+    Guarda el resumen en Parquet (.parquet) o CSV (cualquier otra extension)
+    """
+
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok = True)
+
+    if ruta.endswith(".parquet"):
+        resumen.to_parquet(ruta, index = False)
+    else:
+        resumen.to_csv(ruta, index = False)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Proyeccion por lotes de carteras a partir de un archivo de escenarios")
+    parser.add_argument("escenarios", help = "Archivo de escenarios .csv o .json")
+    parser.add_argument("--salida", default = "resumen.parquet", help = "Archivo de resumen .parquet o .csv")
+    parser.add_argument("--simulaciones", type = int, default = 1000, help = "Simulaciones por escenario")
+    parser.add_argument("--procesos", type = int, default = None, help = "Procesos en paralelo (por defecto uno por CPU)")
+    parser.add_argument("--semilla", type = int, default = None, help = "Semilla para resultados reproducibles")
+    parser.add_argument("--motor", choices = ("diario", "eventos"), default = "eventos", help = "Motor de simulacion")
+    parser.add_argument("--muestreo", default = "estandar", help = "Esquema de muestreo de los shocks")
+    parser.add_argument("--anios-historico", type = int, default = ANIOS_HISTORICO, help = "Años de precios historicos")
+    parser.add_argument("--offline", action = "store_true", help = "Usar solo los precios de la cache local")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO, format = "%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    escenarios = leer_escenarios(args.escenarios)
+
+    resumen, estadisticas = ejecutar_escenarios(escenarios,
+                                                num_simulaciones = args.simulaciones,
+                                                num_procesos = args.procesos,
+                                                semilla = args.semilla,
+                                                motor = args.motor,
+                                                muestreo = args.muestreo,
+                                                anios_historico = args.anios_historico,
+                                                offline = args.offline)
+
+    guardar_resumen(resumen, args.salida)
+
+    logger.info("%d escenarios (%d con error) en %.1f s: %.1f escenarios/min. Resumen en %s",
+                estadisticas["escenarios"], estadisticas["errores"], estadisticas["tiempo_total"],
+                estadisticas["escenarios_por_minuto"], args.salida)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+from contextlib import closing
+import numpy as np
+import pandas as pd
+import logging
+import sqlite3
+import os
+
+logger = logging.getLogger(__name__)
+
+# Ruta por defecto de la cache de precios
+RUTA_CACHE = os.path.join("data", "cache", "precios.sqlite")
+
+# Diferencia relativa maxima entre el precio guardado y el descargado de un mismo dia
+TOLERANCIA_AJUSTE = 1e-6
+
+
+class CachePrecios:
+
+    """
+    Cache local de precios en SQLite, por empresa y fecha
+
+    Guarda, para cada empresa, los precios descargados y el rango de fechas [inicio, fin) ya cubierto.
+    Al pedir un rango solo se descargan las fechas que faltan antes o despues del rango cubierto.
+    En modo offline no se descarga nada y se devuelve lo que haya en la cache.
+
+    Los precios de cierre ajustados se recalculan hacia atras despues de cada split o dividendo, por lo que
+    cada descarga incluye tambien el dia guardado contiguo al rango que falta. Si su precio no coincide con
+    el guardado, el historico cambio de escala y se vuelve a descargar el rango completo de la empresa, para
+    no mezclar precios de dos ajustes (un split apareceria como una caida de un dia).
+
+    Args:
+    - ruta (string): Ruta del archivo SQLite
+    - descargador: Funcion (empresa, start_date, end_date) -> Serie de precios indexada por fecha. Permite
+      sustituir yfinance por un descargador local en pruebas
+    - descargador_masivo: Funcion (empresas, start_date, end_date) -> Data Frame con una columna de precios por
+      empresa. Si se indica, obtener_varias descarga juntas las empresas a las que les falta el mismo rango
+
+    """
+
+    def __init__(self, ruta = RUTA_CACHE, descargador = None, descargador_masivo = None):
+
+        self.ruta = ruta
+        self.descargador = descargador
+        self.descargador_masivo = descargador_masivo
+
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        with closing(self._conectar()) as conexion, conexion:
+            conexion.execute("CREATE TABLE IF NOT EXISTS precios (empresa TEXT, fecha TEXT, precio REAL, PRIMARY KEY (empresa, fecha)) WITHOUT ROWID")
+            conexion.execute("CREATE TABLE IF NOT EXISTS rangos (empresa TEXT PRIMARY KEY, inicio TEXT, fin TEXT)")
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def rango(self, empresa):
+
+        """
+        Rango de fechas [inicio, fin) cubierto para la empresa, o None si no hay datos
+        """
+
+        with closing(self._conectar()) as conexion:
+            fila = conexion.execute("SELECT inicio, fin FROM rangos WHERE empresa = ?", (empresa,)).fetchone()
+
+        return fila
+
+    def rangos_faltantes(self, empresa, start_date, end_date):
+
+        """
+        Rangos de fechas [inicio, fin) que faltan en la cache para cubrir [start_date, end_date)
+        """
+
+        rango = self.rango(empresa)
+
+        if rango is None:
+            return [(start_date, end_date)]
+
+        inicio, fin = rango
+        faltantes = []
+
+        if start_date < inicio:
+            faltantes.append((start_date, min(inicio, end_date)))
+        if end_date > fin:
+            faltantes.append((max(fin, start_date), end_date))
+
+        return faltantes
+
+    def con_solape(self, empresa, start_date, end_date):
+
+        """
+        Rango faltante [start_date, end_date) ampliado con el dia guardado contiguo, para comprobar al guardar
+        que el ajuste de los precios no cambio
+        """
+
+        rango = self.rango(empresa)
+        if rango is None:
+            return start_date, end_date
+
+        with closing(self._conectar()) as conexion:
+            if end_date <= rango[0]:
+                # Rango anterior al guardado: hasta el primer dia guardado, incluido
+                fecha = conexion.execute("SELECT MIN(fecha) FROM precios WHERE empresa = ?", (empresa,)).fetchone()[0]
+                if fecha is not None:
+                    end_date = max(end_date, (pd.Timestamp(fecha) + pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
+            else:
+                # Rango posterior al guardado: desde el ultimo dia guardado
+                fecha = conexion.execute("SELECT MAX(fecha) FROM precios WHERE empresa = ?", (empresa,)).fetchone()[0]
+                if fecha is not None:
+                    start_date = min(start_date, fecha)
+
+        return start_date, end_date
+
+    def guardar(self, empresa, precios, start_date, end_date):
+
+        """
+        Guarda los precios descargados para el rango [start_date, end_date) y amplia el rango cubierto
+
+        Returns:
+        - coincide (bool): False si algun dia ya guardado tiene otro precio en la descarga. En ese caso no se
+          guarda nada y hay que volver a descargar el rango completo (ver recargar)
+        """
+
+        precios = precios.dropna()
+        filas = [(empresa, fecha.strftime('%Y-%m-%d'), float(precio)) for fecha, precio in zip(pd.to_datetime(precios.index), precios.to_numpy())]
+
+        with closing(self._conectar()) as conexion, conexion:
+            # Precios ya guardados de los mismos dias: si cambiaron, el historico se ajusto de nuevo
+            guardados = dict(conexion.execute("SELECT fecha, precio FROM precios WHERE empresa = ? AND fecha >= ? AND fecha <= ?",
+                                              (empresa, min(fila[1] for fila in filas), max(fila[1] for fila in filas))).fetchall()) if filas else {}
+            for _, fecha, precio in filas:
+                if fecha in guardados and not np.isclose(precio, guardados[fecha], rtol = TOLERANCIA_AJUSTE, atol = 0):
+                    logger.info("El precio de %s el %s paso de %g a %g: se vuelve a descargar su historico", empresa, fecha, guardados[fecha], precio)
+                    return False
+
+            conexion.executemany("INSERT OR REPLACE INTO precios (empresa, fecha, precio) VALUES (?, ?, ?)", filas)
+
+            rango = conexion.execute("SELECT inicio, fin FROM rangos WHERE empresa = ?", (empresa,)).fetchone()
+            if rango is not None:
+                start_date, end_date = min(start_date, rango[0]), max(end_date, rango[1])
+
+            conexion.execute("INSERT OR REPLACE INTO rangos (empresa, inicio, fin) VALUES (?, ?, ?)", (empresa, start_date, end_date))
+
+        return True
+
+    def recargar(self, empresa, precios, start_date, end_date):
+
+        """
+        Sustituye todos los precios guardados de la empresa por los descargados para [start_date, end_date)
+        """
+
+        with closing(self._conectar()) as conexion, conexion:
+            conexion.execute("DELETE FROM precios WHERE empresa = ?", (empresa,))
+            conexion.execute("DELETE FROM rangos WHERE empresa = ?", (empresa,))
+
+        self.guardar(empresa, precios, start_date, end_date)
+
+    def _rango_completo(self, empresa, start_date, end_date):
+
+        # Union del rango guardado y el pedido, lo que hay que descargar si el ajuste cambio
+        rango = self.rango(empresa)
+        if rango is None:
+            return start_date, end_date
+
+        return min(start_date, rango[0]), max(end_date, rango[1])
+
+    def leer(self, empresa, start_date, end_date):
+
+        """
+        Precios guardados de la empresa en [start_date, end_date), Serie indexada por fecha
+        """
+
+        with closing(self._conectar()) as conexion:
+            filas = conexion.execute("SELECT fecha, precio FROM precios WHERE empresa = ? AND fecha >= ? AND fecha < ? ORDER BY fecha",
+                                     (empresa, start_date, end_date)).fetchall()
+
+        fechas = pd.DatetimeIndex([fila[0] for fila in filas], name='Date')
+
+        return pd.Series([fila[1] for fila in filas], index=fechas, name=empresa, dtype=float)
+
+    def obtener(self, empresa, start_date, end_date, offline = False):
+
+        """
+        Precios de la empresa en [start_date, end_date), descargando solo las fechas que faltan
+
+        Args:
+        - empresa (string): Empresa
+        - start_date (string): Fecha de inicio 'YYYY-MM-DD'
+        - end_date (string): Fecha final 'YYYY-MM-DD' (no incluida)
+        - offline (bool): Si es True no se descarga nada
+
+        Returns:
+        - precios: Serie de precios indexada por fecha
+        """
+
+        if not offline:
+            for inicio, fin in self.rangos_faltantes(empresa, start_date, end_date):
+                inicio, fin = self.con_solape(empresa, inicio, fin)
+                if not self.guardar(empresa, self.descargador(empresa, inicio, fin), inicio, fin):
+                    inicio, fin = self._rango_completo(empresa, start_date, end_date)
+                    self.recargar(empresa, self.descargador(empresa, inicio, fin), inicio, fin)
+                    break
+
+        elif self.rango(empresa) is None:
+            raise ValueError(f"No hay datos guardados para {empresa} y el modo offline esta activo")
+
+        return self.leer(empresa, start_date, end_date)
+
+    def obtener_varias(self, empresas, start_date, end_date, offline = False):
+
+        """
+        Precios de varias empresas en [start_date, end_date), descargando solo las fechas que faltan
+
+        Las empresas a las que les falta el mismo rango se descargan en una sola llamada a descargador_masivo.
+
+        Args:
+        - empresas (list): Lista de empresas
+        - start_date (string): Fecha de inicio 'YYYY-MM-DD'
+        - end_date (string): Fecha final 'YYYY-MM-DD' (no incluida)
+        - offline (bool): Si es True no se descarga nada
+
+        Returns:
+        - df_consolidado: Data Frame con una columna de precios por empresa
+        """
+
+        if self.descargador_masivo is None or offline:
+            return pd.DataFrame({empresa: self.obtener(empresa, start_date, end_date, offline = offline) for empresa in empresas})
+
+        # Agrupar las empresas por rango faltante, ampliado con el dia guardado contiguo
+        faltantes = {}
+        for empresa in empresas:
+            for inicio, fin in self.rangos_faltantes(empresa, start_date, end_date):
+                faltantes.setdefault(self.con_solape(empresa, inicio, fin), []).append(empresa)
+
+        # Empresas cuyo historico ajustado cambio, por rango completo a descargar
+        recargas = {}
+        recargadas = set()
+        for (inicio, fin), empresas_rango in faltantes.items():
+            datos = self.descargador_masivo(empresas_rango, inicio, fin)
+            for empresa in empresas_rango:
+                if empresa not in recargadas and not self.guardar(empresa, datos[empresa], inicio, fin):
+                    recargas.setdefault(self._rango_completo(empresa, start_date, end_date), []).append(empresa)
+                    recargadas.add(empresa)
+
+        for (inicio, fin), empresas_rango in recargas.items():
+            datos = self.descargador_masivo(empresas_rango, inicio, fin)
+            for empresa in empresas_rango:
+                self.recargar(empresa, datos[empresa], inicio, fin)
+
+        # Alinear todas las empresas por fecha en una sola pasada
+        return pd.concat([self.leer(empresa, start_date, end_date) for empresa in empresas], axis=1)
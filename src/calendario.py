@@ -0,0 +1,215 @@
+import numpy as np
+
+# Dias entre rebalanceos de cada calendario. "legacy" son los dias de get_periodo_rebalanceo (con Trimestral = 60),
+# que se conservan por defecto para no cambiar resultados; "natural" reparte el año de 365 dias en partes iguales;
+# "bursatil" cuenta dias habiles (252 al año) desde el inicio de la simulacion y lleva cada fecha a su dia natural,
+# porque los periodos de la simulacion son siempre dias naturales (dt = 1/365)
+CALENDARIOS = {"legacy": {"Mensual": 30, "Trimestral": 60, "Semestral": 180, "Anual": 365},
+               "natural": {"Mensual": 365 / 12, "Trimestral": 365 / 4, "Semestral": 365 / 2, "Anual": 365},
+               "bursatil": {"Mensual": 21, "Trimestral": 63, "Semestral": 126, "Anual": 252}}
+
+# Periodos (dias naturales) por año, para el crecimiento de los aportes
+DIAS_POR_ANIO = 365
+
+
+class CalendarioEventos:
+
+    """
+    Calendario de los eventos de una simulacion: periodos de rebalanceo y dinero que entra o sale en cada uno
+
+    Se construye una vez por simulacion y sustituye a la comprobacion periodo % periodo_rebalanceo de cada
+    dia: los motores de valoracion recorren los tramos entre eventos con los indices de periodos_rebalanceo y
+    aplican en cada evento su flujo.
+
+    En cada evento se aplica primero el crecimiento del dia, luego se rebalancea y el flujo entra o sale de
+    la cartera para el dia siguiente. El primer periodo (indice 0) nunca es un evento.
+
+    Args:
+    - num_periodos: Numero de periodos de la simulacion
+    - periodos_rebalanceo: Indices (base 0) de los periodos de rebalanceo
+    - flujos: Dinero que entra (positivo) o sale (negativo) en cada evento, o un solo valor para todos
+    - dias_por_anio: Periodos de la simulacion por año
+    - por_unidad: Flujo de cada evento por unidad de aporte, con su crecimiento, o un solo valor para todos. Es el que
+      usa la busqueda del aporte o retiro por periodo (ver src.objetivo)
+
+    Raises:
+    - ValueError: Si algun indice esta fuera de 1..num_periodos-1 o flujos o por_unidad no tienen un valor por evento
+    """
+
+    __slots__ = ("num_periodos", "periodos_rebalanceo", "flujos", "dias_por_anio", "por_unidad")
+
+    def __init__(self, num_periodos, periodos_rebalanceo, flujos = 0.0, dias_por_anio = DIAS_POR_ANIO, por_unidad = 1.0):
+
+        periodos_rebalanceo = np.asarray(periodos_rebalanceo, dtype = np.int64)
+        flujos = np.asarray(flujos, dtype = float)
+        if flujos.ndim == 0:
+            flujos = np.full(len(periodos_rebalanceo), float(flujos))
+        por_unidad = np.asarray(por_unidad, dtype = float)
+        if por_unidad.ndim == 0:
+            por_unidad = np.full(len(periodos_rebalanceo), float(por_unidad))
+
+        if len(flujos) != len(periodos_rebalanceo):
+            raise ValueError(f"Hay {len(periodos_rebalanceo)} eventos y {len(flujos)} flujos")
+        if len(por_unidad) != len(periodos_rebalanceo):
+            raise ValueError(f"Hay {len(periodos_rebalanceo)} eventos y {len(por_unidad)} flujos por unidad")
+        if len(periodos_rebalanceo) and (periodos_rebalanceo.min() < 1 or periodos_rebalanceo.max() >= num_periodos):
+            raise ValueError(f"Los periodos de rebalanceo deben estar entre 1 y {num_periodos - 1}")
+
+        # Ordenar los eventos y sumar los flujos de los que caen en el mismo periodo
+        self.periodos_rebalanceo, posiciones = np.unique(periodos_rebalanceo, return_inverse = True)
+        self.flujos = np.zeros(len(self.periodos_rebalanceo))
+        np.add.at(self.flujos, posiciones, flujos)
+        self.por_unidad = np.zeros(len(self.periodos_rebalanceo))
+        np.add.at(self.por_unidad, posiciones, por_unidad)
+
+        self.num_periodos = num_periodos
+        self.dias_por_anio = dias_por_anio
+
+    def __len__(self):
+        return len(self.periodos_rebalanceo)
+
+    def __repr__(self):
+        return f"CalendarioEventos({self.num_periodos} periodos, {len(self)} eventos, flujo total {self.flujos.sum():g})"
+
+    @classmethod
+    def desde_balanceo(cls, balanceo, num_periodos, fase = "Acumulación", fase_dinero = 0, calendario = "legacy", crecimiento = 0,
+                       inicio = None):
+
+        """
+        Calendario con un rebalanceo cada cierto numero de periodos y el mismo aporte o retiro en cada uno
+
+        Con calendario "legacy" y sin crecimiento los eventos y flujos son los de rentabilidad_cartera_rebalanceo_inflacion
+
+        Args:
+        - balanceo: Mensual, Trimestral, Semestral o Anual
+        - num_periodos: Numero de periodos de la simulacion
+        - fase: Acumulación (los flujos entran) o Distribución (salen)
+        - fase_dinero: Dinero que se invierte o retira en cada evento
+        - calendario: Clave de CALENDARIOS
+        - crecimiento: Crecimiento anual, en porcentaje, del aporte o retiro
+        - inicio: Fecha del primer periodo de la simulacion, solo para el calendario "bursatil". Por defecto, hoy
+
+        Raises:
+        - ValueError: Si el balanceo o el calendario no son validos
+        """
+
+        if calendario not in CALENDARIOS:
+            raise ValueError(f"Calendario no valido: {calendario}")
+        if balanceo not in CALENDARIOS[calendario]:
+            raise ValueError(f"Opcion de rebalanceo no valida: {balanceo}")
+
+        dias = CALENDARIOS[calendario][balanceo]
+
+        if calendario == "bursatil":
+            # Un evento cada `dias` dias habiles desde inicio, en su dia natural como con desde_fechas(dias_habiles = True).
+            # Hay menos dias habiles que naturales, asi que num_periodos // dias eventos cubren la simulacion
+            inicio = np.datetime64("today" if inicio is None else inicio, "D")
+            fechas = np.busday_offset(inicio, dias * np.arange(1, num_periodos // dias + 1), roll = "forward")
+            return cls.desde_fechas(fechas, inicio, num_periodos, fase, fase_dinero, crecimiento)
+
+        if isinstance(dias, int):
+            # El periodo i (base 0) es de rebalanceo si (i + 1) % dias == 0
+            periodos_rebalanceo = np.arange(dias - 1, num_periodos, dias)
+        else:
+            # Dias fraccionarios: el evento k cae en el periodo mas cercano a k * dias
+            periodos_rebalanceo = np.round(np.arange(dias, num_periodos + 1, dias)).astype(np.int64) - 1
+        periodos_rebalanceo = periodos_rebalanceo[(periodos_rebalanceo > 0) & (periodos_rebalanceo < num_periodos)]
+
+        flujos = _flujos(periodos_rebalanceo, fase, fase_dinero, crecimiento, DIAS_POR_ANIO)
+        por_unidad = _flujos(periodos_rebalanceo, "Acumulación", 1, crecimiento, DIAS_POR_ANIO)
+
+        return cls(num_periodos, periodos_rebalanceo, flujos, DIAS_POR_ANIO, por_unidad)
+
+    @classmethod
+    def desde_fechas(cls, fechas, inicio, num_periodos, fase = "Acumulación", fase_dinero = 0, crecimiento = 0, dias_habiles = False):
+
+        """
+        Calendario con eventos en fechas explicitas
+
+        Args:
+        - fechas: Fechas de los eventos (date, datetime64 o "YYYY-MM-DD"). Las que caen fuera de la simulacion se descartan
+        - inicio: Fecha del primer periodo de la simulacion
+        - num_periodos: Numero de periodos de la simulacion
+        - fase: Acumulación (los flujos entran) o Distribución (salen)
+        - fase_dinero: Dinero que se invierte o retira en cada fecha, uno para todas o uno por fecha
+        - crecimiento: Crecimiento anual, en porcentaje, del aporte o retiro
+        - dias_habiles (bool): Si es True las fechas que caen en fin de semana pasan al siguiente dia habil (lunes a viernes).
+          Los periodos son siempre dias naturales desde inicio, como los de la simulacion
+        """
+
+        fechas = np.asarray([np.datetime64(fecha, "D") for fecha in fechas], dtype = "datetime64[D]")
+        inicio = np.datetime64(inicio, "D")
+
+        if dias_habiles:
+            fechas = np.busday_offset(fechas, 0, roll = "forward")
+
+        periodos_rebalanceo = (fechas - inicio).astype(np.int64)
+
+        fase_dinero = np.broadcast_to(np.asarray(fase_dinero, dtype = float), periodos_rebalanceo.shape)
+        dentro = (periodos_rebalanceo > 0) & (periodos_rebalanceo < num_periodos)
+        periodos_rebalanceo, fase_dinero = periodos_rebalanceo[dentro], fase_dinero[dentro]
+
+        flujos = _flujos(periodos_rebalanceo, fase, fase_dinero, crecimiento, DIAS_POR_ANIO)
+        por_unidad = _flujos(periodos_rebalanceo, "Acumulación", 1, crecimiento, DIAS_POR_ANIO)
+
+        return cls(num_periodos, periodos_rebalanceo, flujos, DIAS_POR_ANIO, por_unidad)
+
+    def tramos(self):
+
+        """
+        Inicio y final (excluido) de cada tramo entre eventos. El tramo j > 0 empieza en el evento j - 1
+        """
+
+        inicios = np.concatenate(([0], self.periodos_rebalanceo))
+        finales = np.concatenate((self.periodos_rebalanceo, [self.num_periodos]))
+
+        return inicios, finales
+
+    def es_rebalanceo(self):
+
+        """
+        Array booleano (periodos) que indica los periodos de rebalanceo
+        """
+
+        mascara = np.zeros(self.num_periodos, dtype = bool)
+        mascara[self.periodos_rebalanceo] = True
+
+        return mascara
+
+    def flujo_por_periodo(self):
+
+        """
+        Array (periodos) con el flujo de cada periodo, cero fuera de los eventos
+        """
+
+        flujos = np.zeros(self.num_periodos)
+        flujos[self.periodos_rebalanceo] = self.flujos
+
+        return flujos
+
+
+def _flujos(periodos_rebalanceo, fase, fase_dinero, crecimiento, dias_por_anio):
+
+    # Aporte (positivo) o retiro (negativo) de cada evento, creciendo con los años transcurridos
+    signo = 1 if fase == "Acumulación" else -1
+    factor = (1 + crecimiento / 100) ** (np.asarray(periodos_rebalanceo) / dias_por_anio) if crecimiento else 1.0
+
+    return signo * np.asarray(fase_dinero, dtype = float) * factor
+
+
+def calendario_por_defecto(calendario, balanceo, num_periodos, fase, fase_dinero):
+
+    """
+    El calendario indicado o, si es None, el calendario legacy de balanceo, fase y fase_dinero
+
+    Raises:
+    - ValueError: Si calendario no tiene num_periodos periodos
+    """
+
+    if calendario is None:
+        return CalendarioEventos.desde_balanceo(balanceo, num_periodos, fase, fase_dinero)
+
+    if calendario.num_periodos != num_periodos:
+        raise ValueError(f"El calendario tiene {calendario.num_periodos} periodos y la simulacion {num_periodos}")
+
+    return calendario
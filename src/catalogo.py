@@ -0,0 +1,217 @@
+from bisect import bisect_left
+import os
+import pandas as pd
+import numpy as np
+
+# Rutas del listado de activos y de su version compilada
+RUTA_CSV = os.path.join("data", "nasdaq_screener.csv")
+RUTA_BINARIA = os.path.join("data", "cache", "catalogo.npz")
+
+# Separador de los textos guardados en un solo bloque UTF-8
+SEPARADOR = "\x1f"
+
+COLUMNAS_CATEGORICAS = {"Country": "paises", "Sector": "sectores", "Industry": "industrias"}
+
+
+def _codificar_textos(textos):
+    return np.frombuffer(SEPARADOR.join(textos).encode("utf-8"), dtype=np.uint8)
+
+
+def _decodificar_textos(bloque):
+    return bloque.tobytes().decode("utf-8").split(SEPARADOR)
+
+
+def compilar_catalogo(ruta_csv = RUTA_CSV, ruta_binaria = RUTA_BINARIA):
+
+    """
+    Compila el listado de activos en un archivo binario compacto
+
+    Los simbolos y nombres se guardan como un bloque UTF-8, el pais, sector e industria como codigos
+    enteros con su lista de categorias, y el año de IPO como entero (-1 si no hay dato).
+
+    Args:
+    - ruta_csv (string): Ruta del listado de activos (nasdaq_screener.csv)
+    - ruta_binaria (string): Ruta del archivo .npz a generar
+    """
+
+    # keep_default_na=False para que el simbolo "NA" no se lea como valor faltante
+    activos_data = pd.read_csv(ruta_csv, keep_default_na=False, dtype=str)
+
+    arrays = {"simbolos": _codificar_textos(activos_data["Symbol"].tolist()),
+              "nombres": _codificar_textos(activos_data["Name"].tolist())}
+
+    anio_ipo = pd.to_numeric(activos_data["IPO Year"], errors="coerce")
+    arrays["anio_ipo"] = anio_ipo.fillna(-1).to_numpy(dtype=np.int16)
+
+    for columna, nombre in COLUMNAS_CATEGORICAS.items():
+        codigos, categorias = pd.factorize(activos_data[columna], sort=True)
+        arrays["codigos_" + nombre] = codigos.astype(np.int16)
+        arrays[nombre] = _codificar_textos(categorias.tolist())
+
+    directorio = os.path.dirname(ruta_binaria)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+
+    np.savez(ruta_binaria, **arrays)
+
+
+def cargar_catalogo(ruta_csv = RUTA_CSV, ruta_binaria = RUTA_BINARIA):
+
+    """
+    Carga el catalogo de activos, compilandolo antes si el archivo binario no existe o es anterior al CSV
+
+    Args:
+    - ruta_csv (string): Ruta del listado de activos (nasdaq_screener.csv)
+    - ruta_binaria (string): Ruta del archivo .npz compilado
+
+    Returns:
+    - catalogo (CatalogoSimbolos)
+    """
+
+    if not os.path.exists(ruta_binaria) or os.path.getmtime(ruta_binaria) < os.path.getmtime(ruta_csv):
+        compilar_catalogo(ruta_csv, ruta_binaria)
+
+    with np.load(ruta_binaria, allow_pickle=False) as arrays:
+        return CatalogoSimbolos({nombre: arrays[nombre] for nombre in arrays.files})
+
+
+class CatalogoSimbolos:
+
+    """
+    Catalogo de activos con indices por simbolo, sector, industria y pais, y busqueda por prefijo o texto
+
+    Args:
+    - arrays (dict): Arrays del archivo compilado por compilar_catalogo
+
+    """
+
+    def __init__(self, arrays):
+
+        self.simbolos = _decodificar_textos(arrays["simbolos"])
+        self.nombres = _decodificar_textos(arrays["nombres"])
+        self.anio_ipo = arrays["anio_ipo"]
+
+        self.categorias = {}
+        self.codigos = {}
+        self.indices = {}
+
+        for columna, nombre in COLUMNAS_CATEGORICAS.items():
+            categorias = _decodificar_textos(arrays[nombre])
+            codigos = arrays["codigos_" + nombre]
+
+            self.categorias[columna] = categorias
+            self.codigos[columna] = codigos
+
+            # Filas de cada categoria, agrupadas con un solo argsort
+            orden = np.argsort(codigos, kind="stable")
+            limites = np.searchsorted(codigos[orden], np.arange(len(categorias) + 1))
+            self.indices[columna] = {categoria: orden[limites[k]:limites[k + 1]] for k, categoria in enumerate(categorias)}
+
+        self.indice_simbolos = {simbolo: fila for fila, simbolo in enumerate(self.simbolos)}
+
+        # Simbolos ordenados para la busqueda por prefijo
+        self._orden_simbolos = sorted(range(len(self.simbolos)), key=self.simbolos.__getitem__)
+        self._simbolos_ordenados = [self.simbolos[fila] for fila in self._orden_simbolos]
+
+        # Texto en minusculas para la busqueda por texto
+        self._textos_busqueda = [(simbolo + SEPARADOR + nombre).lower() for simbolo, nombre in zip(self.simbolos, self.nombres)]
+
+        self._dataframe = None
+
+    def __len__(self):
+        return len(self.simbolos)
+
+    @property
+    def sectores(self):
+        return [sector for sector in self.categorias["Sector"] if sector]
+
+    @property
+    def industrias(self):
+        return [industria for industria in self.categorias["Industry"] if industria]
+
+    @property
+    def paises(self):
+        return [pais for pais in self.categorias["Country"] if pais]
+
+    def activo(self, simbolo):
+
+        """
+        Datos del activo con ese simbolo, como diccionario, o None si no existe
+        """
+
+        fila = self.indice_simbolos.get(simbolo)
+
+        if fila is None:
+            return None
+
+        return self.a_dataframe().iloc[fila].to_dict()
+
+    def buscar_prefijo(self, prefijo):
+
+        """
+        Filas de los activos cuyo simbolo empieza por prefijo, en orden alfabetico
+        """
+
+        inicio = bisect_left(self._simbolos_ordenados, prefijo)
+        final = bisect_left(self._simbolos_ordenados, prefijo + "\U0010ffff")
+
+        return np.array(self._orden_simbolos[inicio:final], dtype=np.int64)
+
+    def buscar_texto(self, texto):
+
+        """
+        Filas de los activos cuyo simbolo o nombre contiene texto, sin distinguir mayusculas
+        """
+
+        texto = texto.lower()
+
+        return np.array([fila for fila, texto_busqueda in enumerate(self._textos_busqueda) if texto in texto_busqueda], dtype=np.int64)
+
+    def filas(self, texto = None, sector = None, industria = None, pais = None):
+
+        """
+        Filas de los activos que cumplen todos los filtros indicados
+        """
+
+        filas = np.arange(len(self.simbolos))
+
+        for columna, valor in (("Sector", sector), ("Industry", industria), ("Country", pais)):
+            if valor is not None:
+                filas = np.intersect1d(filas, self.indices[columna].get(valor, np.empty(0, dtype=np.int64)), assume_unique=True)
+
+        if texto:
+            filas = np.intersect1d(filas, self.buscar_texto(texto), assume_unique=True)
+
+        return filas
+
+    def consultar(self, texto = None, sector = None, industria = None, pais = None):
+
+        """
+        Data Frame con los activos que cumplen todos los filtros indicados, con las columnas del CSV original
+        """
+
+        return self.a_dataframe().iloc[self.filas(texto, sector, industria, pais)]
+
+    def a_dataframe(self):
+
+        """
+        Data Frame con todos los activos, con las columnas del CSV original. Se construye una sola vez
+        """
+
+        if self._dataframe is None:
+            columnas = {"Symbol": self.simbolos, "Name": self.nombres}
+
+            for columna in ("Country", "IPO Year", "Sector", "Industry"):
+                if columna == "IPO Year":
+                    columnas[columna] = np.where(self.anio_ipo >= 0, self.anio_ipo, np.nan)
+                else:
+                    categorias = np.array(self.categorias[columna] + [None], dtype=object)
+                    codigos = np.asarray(self.codigos[columna])
+                    # Las categorias vacias se muestran como valores faltantes, igual que al leer el CSV
+                    valores = categorias[codigos]
+                    valores[valores == ""] = None
+                    columnas[columna] = valores
+
+            self._dataframe = pd.DataFrame(columnas)
+
+        return self._dataframe
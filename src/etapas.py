@@ -0,0 +1,570 @@
+"""
+Cache por etapas del calculo de la app
+
+El calculo de la app se divide en etapas que se guardan en una cache LRU, cada una con una clave formada
+solo por sus entradas reales:
+
+- precios: la serie de precios de cada activo, por activo y rango de fechas. Al añadir un activo solo se
+  cargan los precios del activo nuevo
+- trayectorias: los cubos de cambios porcentuales de los activos por lote con el motor diario, o los shocks
+  de la malla de eventos con el motor por eventos. Dependen del historico de los activos, el periodo, el
+  numero de simulaciones, la semilla, el muestreo y la precision (o los periodos de rebalanceo de la malla),
+  no de la cartera
+- valoracion: el rebalanceo de la cartera sobre las trayectorias (SimulationResult), completo o agregado.
+  Cambiar la inflacion, los pesos o el dinero por periodo solo repite esta etapa
+- objetivo: el aporte necesario o el retiro sostenible buscado sobre las trayectorias (ver src.objetivo)
+- graficos: las figuras, que se construyen en la app. Cambiar el objetivo solo repite las metricas y los
+  graficos que dependen de el
+
+Las simulaciones que no se pueden separar en trayectorias y valoracion (adaptativas o que no caben en la
+cache) se guardan enteras en la etapa simulacion.
+"""
+
+from src.simulation import run_multiple_simulations, parametros_mercado, generar_cambio_porcentual, estimar_memoria
+from src.simulation import generar_shocks_eventos, simular_cartera_eventos, plan_eventos
+from src.simulation import _dividir_en_lotes, _ajustar_a_memoria, TAMANO_LOTE, PRECISIONES
+from src.rentabilidad import rentabilidad_cartera_rebalanceo_inflacion_vectorizada
+from src.resultados import SimulationResult, AcumuladorPorPeriodo, CONFIANZA, NUM_TRAYECTORIAS_MUESTRA
+from src.objetivo import buscar_fase_dinero
+from src.calendario import CalendarioEventos, calendario_por_defecto
+from src.instrumentacion import medir_etapa
+from src.load_data import load_data
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+import threading
+import hashlib
+import pickle
+import sys
+
+# Entradas y bytes maximos de la cache, al superarlos se eliminan las entradas usadas hace mas tiempo
+MAX_ENTRADAS = 64
+MAX_BYTES = 2**30
+
+
+class CacheEtapas:
+
+    """
+    Cache LRU de los resultados de cada etapa, acotada por numero de entradas y por bytes
+
+    Cada entrada se identifica por el nombre de su etapa y una clave (ver clave_etapa). Al consultar una
+    entrada pasa a ser la mas reciente. Un valor mayor que max_bytes no se guarda. Es segura entre hilos,
+    para compartirla entre las sesiones de la app con st.cache_resource.
+
+    Args:
+    - max_entradas: Numero maximo de entradas
+    - max_bytes: Tamaño maximo estimado de todas las entradas (ver _tamano)
+    """
+
+    def __init__(self, max_entradas = MAX_ENTRADAS, max_bytes = MAX_BYTES):
+
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.bytes = 0
+
+        # Aciertos y calculos de cada etapa desde que se creo la cache
+        self.aciertos = {}
+        self.fallos = {}
+
+        self._entradas = OrderedDict()
+        self._bloqueo = threading.Lock()
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def consultar(self, etapa, clave):
+
+        """
+        Valor guardado de la etapa, o None si no esta en la cache
+        """
+
+        with self._bloqueo:
+            entrada = self._entradas.get((etapa, clave))
+            if entrada is None:
+                self.fallos[etapa] = self.fallos.get(etapa, 0) + 1
+                return None
+
+            self._entradas.move_to_end((etapa, clave))
+            self.aciertos[etapa] = self.aciertos.get(etapa, 0) + 1
+            return entrada[0]
+
+    def guardar(self, etapa, clave, valor):
+
+        """
+        Guarda el valor de la etapa y elimina las entradas menos recientes hasta volver a los limites
+        """
+
+        tamano = _tamano(valor)
+        if tamano > self.max_bytes:
+            return
+
+        with self._bloqueo:
+            anterior = self._entradas.pop((etapa, clave), None)
+            if anterior is not None:
+                self.bytes -= anterior[1]
+
+            self._entradas[(etapa, clave)] = (valor, tamano)
+            self.bytes += tamano
+
+            while len(self._entradas) > self.max_entradas or self.bytes > self.max_bytes:
+                _, (_, tamano_eliminado) = self._entradas.popitem(last = False)
+                self.bytes -= tamano_eliminado
+
+    def obtener(self, etapa, clave, calcular):
+
+        """
+        Valor de la etapa: el guardado o, si no esta, el que devuelve calcular(), que se guarda
+
+        El calculo se hace fuera del bloqueo, por lo que dos sesiones pueden calcular a la vez la misma entrada
+        """
+
+        valor = self.consultar(etapa, clave)
+        if valor is None:
+            valor = calcular()
+            self.guardar(etapa, clave, valor)
+
+        return valor
+
+    def limpiar(self):
+
+        with self._bloqueo:
+            self._entradas.clear()
+            self.bytes = 0
+
+
+def clave_etapa(*partes):
+
+    """
+    Clave de una entrada de la cache: resumen SHA-1 de sus entradas
+
+    Los Data Frames y arrays se resumen por su contenido, por lo que la clave cambia si cambian los precios
+    aunque no cambien los activos
+    """
+
+    resumen = hashlib.sha1()
+    for parte in partes:
+        resumen.update(_huella(parte))
+        resumen.update(b"|")
+
+    return resumen.hexdigest()
+
+
+def _huella(valor):
+
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return pickle.dumps((list(np.atleast_1d(valor.columns if isinstance(valor, pd.DataFrame) else valor.name)),
+                             pd.util.hash_pandas_object(valor, index = True).to_numpy().tobytes()))
+    if isinstance(valor, CalendarioEventos):
+        return _huella((valor.num_periodos, valor.periodos_rebalanceo, valor.flujos, valor.por_unidad))
+    if isinstance(valor, np.ndarray):
+        return pickle.dumps((valor.dtype.str, valor.shape, np.ascontiguousarray(valor).tobytes()))
+    if isinstance(valor, (list, tuple)):
+        return b"(" + b",".join(_huella(elemento) for elemento in valor) + b")"
+
+    return repr(valor).encode()
+
+
+def _tamano(valor):
+
+    """
+    Bytes aproximados de un valor de la cache. Las figuras y otros objetos solo cuentan su tamaño superficial
+    y quedan acotados por el numero de entradas
+    """
+
+    if isinstance(valor, np.ndarray):
+        return valor.nbytes
+    if isinstance(valor, SimulationResult):
+        return valor.nbytes
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return int(np.sum(valor.memory_usage(index = True)))
+    if isinstance(valor, (list, tuple)):
+        return sum(_tamano(elemento) for elemento in valor)
+    if isinstance(valor, dict):
+        return sum(_tamano(elemento) for elemento in valor.values())
+
+    return sys.getsizeof(valor)
+
+
+def cargar_precios(cache, empresas, start_date, end_date, offline = False, cargador = load_data, instrumentacion = None):
+
+    """
+    Etapa precios: precios de las empresas, cargando con cargador solo los de las que no estan en la cache
+
+    Args:
+    - cache (CacheEtapas)
+    - empresas, start_date, end_date, offline: ver load_data
+    - cargador: Funcion con la firma de load_data
+    - instrumentacion (Instrumentacion): Registro donde se mide la carga como etapa carga_datos
+
+    Returns:
+    - df_consolidado: Data Frame con una columna por empresa, en el orden de empresas
+    """
+
+    claves = {empresa: clave_etapa(empresa, start_date, end_date, offline) for empresa in empresas}
+    precios = {empresa: cache.consultar("precios", claves[empresa]) for empresa in empresas}
+
+    faltantes = [empresa for empresa in empresas if precios[empresa] is None]
+    if faltantes:
+        with medir_etapa(instrumentacion, "carga_datos"):
+            nuevos = cargador(empresas = faltantes, start_date = start_date, end_date = end_date, offline = offline).reindex(columns = faltantes)
+
+        for empresa in faltantes:
+            precios[empresa] = nuevos[empresa]
+            cache.guardar("precios", claves[empresa], nuevos[empresa])
+
+    # Alinear por fecha y quitar las fechas que solo tenian precios otras empresas
+    return pd.concat([precios[empresa].rename(empresa) for empresa in empresas], axis = 1).dropna(how = "all")
+
+
+def simular(cache, df_consolidado, T, activos_seleccionados, inversion_inicial, distribucion_cartera, num_simulaciones, balanceo, fase,
+            fase_dinero, inflacion, semilla, modo = "completo", motor = "diario", tamano_lote = TAMANO_LOTE, muestreo = "estandar",
+            correlacion = True, precision = "float64", memoria_maxima = None, calendario = None, instrumentacion = None,
+            progreso = None, cancelar = None, **opciones):
+
+    """
+    Etapas trayectorias y valoracion, o simulacion, con el resultado de run_multiple_simulations
+
+    Sin opciones adaptativas, las trayectorias se guardan por separado de la valoracion, que es la unica etapa
+    que se repite al cambiar la cartera, la inflacion o el dinero por periodo. Con el motor diario las
+    trayectorias son los cubos de cambios porcentuales y con el motor por eventos los shocks de la malla de
+    eventos (ver generar_shocks_eventos). Con la misma semilla el resultado es el mismo que el de
+    run_multiple_simulations. Cualquier otra simulacion se guarda entera, con una clave que incluye todos sus
+    argumentos salvo instrumentacion, progreso y cancelar.
+
+    Se necesita una semilla: sin ella cada ejecucion seria distinta y no se podria reutilizar. Una simulacion
+    cancelada devuelve las simulaciones hechas pero no se guarda en la cache.
+
+    Args:
+    - cache (CacheEtapas)
+    - progreso, cancelar: ver run_multiple_simulations. Si el resultado ya esta en la cache se informa de una vez
+    - resto: ver run_multiple_simulations. En opciones van los argumentos de la simulacion adaptativa y los demas
+      que no afectan a la division en etapas
+
+    Returns:
+    - clave: Clave de la valoracion o de la simulacion, para las etapas que dependen del resultado
+    - resultado (SimulationResult)
+    """
+
+    num_assets = len(activos_seleccionados)
+    num_periodos = int(T / (1/365)) + 1
+
+    opciones_activas = {nombre: valor for nombre, valor in opciones.items() if valor is not None}
+    por_etapas = not opciones_activas
+
+    if por_etapas:
+        # El mismo modo y tamano de lote que usaria run_multiple_simulations, para simular los mismos lotes
+        if memoria_maxima is not None:
+            modo, tamano_lote = _ajustar_a_memoria(memoria_maxima, "agregado", num_simulaciones, num_assets, num_periodos, modo, tamano_lote,
+                                                   precision, motor, balanceo, 1, NUM_TRAYECTORIAS_MUESTRA)
+
+        # Las trayectorias tienen que caber en la cache y la simulacion completa en la memoria maxima
+        eventos = calendario_por_defecto(calendario, balanceo, num_periodos, fase, fase_dinero)
+        memoria = estimar_memoria(num_simulaciones, num_assets, num_periodos, modo, tamano_lote, precision, motor, balanceo)
+        bytes_trayectorias = _bytes_trayectorias(num_simulaciones, num_assets, num_periodos, precision, motor, eventos)
+        por_etapas = bytes_trayectorias <= cache.max_bytes and (memoria_maxima is None or memoria["total"] + bytes_trayectorias <= memoria_maxima)
+
+    if not por_etapas:
+        clave = clave_etapa("simulacion", df_consolidado[activos_seleccionados], T, activos_seleccionados, inversion_inicial,
+                            distribucion_cartera, num_simulaciones, balanceo, fase, fase_dinero, inflacion, semilla, modo, motor,
+                            tamano_lote, muestreo, correlacion, precision, memoria_maxima, calendario, sorted(opciones_activas.items()))
+
+        resultado = _consultar(cache, "simulacion", clave, progreso)
+        if resultado is None:
+            resultado = run_multiple_simulations(df_consolidado = df_consolidado, T = T, activos_seleccionados = activos_seleccionados,
+                                                 inversion_inicial = inversion_inicial, distribucion_cartera = distribucion_cartera,
+                                                 num_simulaciones = num_simulaciones, balanceo = balanceo, fase = fase,
+                                                 fase_dinero = fase_dinero, inflacion = inflacion, modo = modo, motor = motor,
+                                                 tamano_lote = tamano_lote, semilla = semilla, muestreo = muestreo,
+                                                 correlacion = correlacion, precision = precision, memoria_maxima = memoria_maxima,
+                                                 calendario = calendario, instrumentacion = instrumentacion, progreso = progreso,
+                                                 cancelar = cancelar, **opciones_activas)
+            if not _cancelada(cancelar):
+                cache.guardar("simulacion", clave, resultado)
+
+        return clave, resultado
+
+    clave_trayectorias = _clave_trayectorias(df_consolidado[activos_seleccionados], T, num_simulaciones, semilla, tamano_lote, muestreo,
+                                             correlacion, precision, motor, eventos)
+    clave_valoracion = clave_etapa("valoracion", clave_trayectorias, inversion_inicial, distribucion_cartera, balanceo, fase, fase_dinero, inflacion,
+                                   eventos, modo)
+
+    resultado = _consultar(cache, "valoracion", clave_valoracion, progreso)
+    if resultado is not None:
+        return clave_valoracion, resultado
+
+    # El motor por eventos necesita los parametros del mercado tambien para valorar los shocks
+    cubos = cache.consultar("trayectorias", clave_trayectorias)
+    parametros = None
+    if cubos is None or motor == "eventos":
+        with medir_etapa(instrumentacion, "metricas"):
+            parametros = parametros_mercado(df_consolidado[activos_seleccionados], T, num_assets, correlacion, muestreo, precision)
+
+    # Sin trayectorias en la cache, cada lote se genera y se valora antes de generar el siguiente, para poder
+    # mostrar resultados parciales y cancelar entre lotes
+    nuevos = None
+    if cubos is None:
+        nuevos = []
+        cubos = _iterar(parametros, num_simulaciones, semilla, tamano_lote, motor, eventos, instrumentacion, nuevos)
+
+    resultado = valorar_trayectorias(cubos, activos_seleccionados, inversion_inicial, distribucion_cartera, balanceo, fase, fase_dinero,
+                                     inflacion, instrumentacion, eventos, num_simulaciones, progreso, cancelar, modo = modo,
+                                     parametros = parametros if motor == "eventos" else None)
+
+    if not _cancelada(cancelar):
+        if nuevos is not None:
+            cache.guardar("trayectorias", clave_trayectorias, nuevos)
+        cache.guardar("valoracion", clave_valoracion, resultado)
+
+    return clave_valoracion, resultado
+
+
+def _bytes_trayectorias(num_simulaciones, num_assets, num_periodos, precision, motor, calendario):
+
+    # Bytes de la etapa trayectorias: los cubos diarios en la precision de la simulacion o los shocks de la malla en float64
+    if motor == "eventos":
+        return num_simulaciones * num_assets * len(plan_eventos(num_periodos, None, calendario)[1]) * np.dtype(np.float64).itemsize
+    return num_simulaciones * num_assets * num_periodos * np.dtype(PRECISIONES[precision]).itemsize
+
+
+def _consultar(cache, etapa, clave, progreso):
+
+    # Resultado guardado de la etapa. Si esta, se informa del progreso completo de una vez
+    resultado = cache.consultar(etapa, clave)
+    if resultado is not None and progreso is not None:
+        progreso(resultado.num_simulaciones, resultado.num_simulaciones, lambda: resultado)
+
+    return resultado
+
+
+def _cancelada(cancelar):
+    return cancelar is not None and cancelar.is_set()
+
+
+def buscar_objetivo(cache, df_consolidado, T, activos_seleccionados, inversion_inicial, distribucion_cartera, num_simulaciones, balanceo, fase,
+                    inflacion, semilla, rentabilidad_objetivo = None, probabilidad = 80, riesgo_ruina = 10, modo = "completo", motor = "diario",
+                    tamano_lote = TAMANO_LOTE, muestreo = "estandar", correlacion = True, precision = "float64", memoria_maxima = None,
+                    calendario = None, confianza = CONFIANZA, instrumentacion = None):
+
+    """
+    Etapa objetivo: aporte necesario o retiro sostenible (ver src.objetivo.buscar_fase_dinero) sobre las
+    trayectorias que usa simular con los mismos argumentos: los cubos diarios o, con el motor por eventos, los
+    shocks de la malla que muestra el grafico de abanico
+
+    Si las trayectorias no estan en la cache se generan lote a lote sin guardarlas, y de cada lote solo se
+    conservan los umbrales, por lo que la memoria es la de un lote de la simulacion.
+
+    Args:
+    - modo, motor, memoria_maxima: los de la simulacion, que fijan el tamano de lote y las trayectorias
+    - calendario (CalendarioEventos): El de la simulacion. Sus flujos se sustituyen por el aporte o retiro buscado,
+      con el crecimiento de por_unidad
+    - resto: ver simular y buscar_fase_dinero
+
+    Returns:
+    - solucion (dict): ver buscar_fase_dinero
+
+    Raises:
+    - MemoryError: Si la simulacion no cabe en memoria_maxima
+    """
+
+    num_assets = len(activos_seleccionados)
+    num_periodos = int(T / (1/365)) + 1
+
+    # El mismo tamano de lote que la simulacion, comprobado antes de generar nada
+    if memoria_maxima is not None:
+        tamano_lote = _ajustar_a_memoria(memoria_maxima, "agregado", num_simulaciones, num_assets, num_periodos, modo, tamano_lote,
+                                         precision, motor, balanceo, 1, NUM_TRAYECTORIAS_MUESTRA)[1]
+
+    eventos = calendario_por_defecto(calendario, balanceo, num_periodos, fase, 0)
+    clave_trayectorias = _clave_trayectorias(df_consolidado[activos_seleccionados], T, num_simulaciones, semilla, tamano_lote, muestreo,
+                                             correlacion, precision, motor, eventos)
+    clave = clave_etapa("objetivo", clave_trayectorias, inversion_inicial, distribucion_cartera, balanceo, fase, inflacion,
+                        rentabilidad_objetivo, probabilidad, riesgo_ruina, confianza, eventos.periodos_rebalanceo, eventos.por_unidad)
+
+    def buscar():
+        with medir_etapa(instrumentacion, "objetivo", num_simulaciones):
+            cubos = cache.consultar("trayectorias", clave_trayectorias)
+
+            parametros = None
+            if cubos is None or motor == "eventos":
+                parametros = parametros_mercado(df_consolidado[activos_seleccionados], T, num_assets, correlacion, muestreo, precision)
+            if cubos is None:
+                cubos = _iterar(parametros, num_simulaciones, semilla, tamano_lote, motor, eventos, None, None)
+
+            return buscar_fase_dinero(cubos, inversion_inicial, distribucion_cartera, balanceo, fase, inflacion,
+                                      rentabilidad_objetivo = rentabilidad_objetivo, probabilidad = probabilidad,
+                                      riesgo_ruina = riesgo_ruina, confianza = confianza,
+                                      parametros = parametros if motor == "eventos" else None, calendario = eventos)
+
+    return cache.obtener("objetivo", clave, buscar)
+
+
+def _clave_trayectorias(df_consolidado, T, num_simulaciones, semilla, tamano_lote, muestreo, correlacion, precision, motor = "diario",
+                        calendario = None):
+
+    # Los shocks de la malla de eventos no dependen de la precision, pero si de los periodos de rebalanceo
+    if motor == "eventos":
+        return clave_etapa("trayectorias_eventos", df_consolidado, T, num_simulaciones, semilla, tamano_lote, muestreo, correlacion,
+                           calendario.periodos_rebalanceo)
+    return clave_etapa("trayectorias", df_consolidado, T, num_simulaciones, semilla, tamano_lote, muestreo, correlacion, precision)
+
+
+def iterar_trayectorias(df_consolidado, T, num_simulaciones, semilla, tamano_lote = TAMANO_LOTE, muestreo = "estandar", correlacion = True,
+                        precision = "float64", instrumentacion = None, cubos = None, motor = "diario", calendario = None):
+
+    """
+    Etapa trayectorias lote a lote, con los mismos generadores por lote que run_multiple_simulations para la
+    misma semilla: el cubo de cambios porcentuales de cada lote con el motor diario, o los shocks de la malla
+    de eventos con el motor por eventos (ver generar_shocks_eventos)
+
+    Args:
+    - cubos (list): Si no es None, cada cubo generado se añade tambien a esta lista
+    - motor: "diario" o "eventos"
+    - calendario (CalendarioEventos): Periodos de rebalanceo de la malla, necesario con el motor por eventos
+
+    Yields:
+    - cubo: array (simulaciones del lote x activos x periodos o pasos de la malla)
+    """
+
+    if motor == "eventos" and calendario is None:
+        raise ValueError("El motor por eventos necesita el calendario de la malla")
+
+    with medir_etapa(instrumentacion, "metricas"):
+        parametros = parametros_mercado(df_consolidado, T, df_consolidado.shape[1], correlacion, muestreo, precision)
+
+    yield from _iterar(parametros, num_simulaciones, semilla, tamano_lote, motor, calendario, instrumentacion, cubos)
+
+
+def _iterar(parametros, num_simulaciones, semilla, tamano_lote, motor, calendario, instrumentacion, cubos):
+
+    lotes = _dividir_en_lotes(num_simulaciones, tamano_lote)
+    semillas = np.random.SeedSequence(semilla).spawn(len(lotes))
+
+    for tamano, semilla_lote in zip(lotes, semillas):
+        with medir_etapa(instrumentacion, "generacion", tamano):
+            if motor == "eventos":
+                cubo = generar_shocks_eventos(parametros, tamano, calendario, np.random.default_rng(semilla_lote))
+            else:
+                cubo = generar_cambio_porcentual(parametros, tamano, np.random.default_rng(semilla_lote))
+
+        if cubos is not None:
+            cubos.append(cubo)
+        yield cubo
+
+        # Sin lista, el cubo se libera antes de generar el siguiente
+        del cubo
+
+
+def generar_trayectorias(df_consolidado, T, num_simulaciones, semilla, tamano_lote = TAMANO_LOTE, muestreo = "estandar", correlacion = True,
+                         precision = "float64", instrumentacion = None, motor = "diario", calendario = None):
+
+    """
+    Etapa trayectorias: cubos de todos los lotes (ver iterar_trayectorias)
+
+    Returns:
+    - cubos: lista de arrays (simulaciones del lote x activos x periodos o pasos de la malla)
+    """
+
+    return list(iterar_trayectorias(df_consolidado, T, num_simulaciones, semilla, tamano_lote, muestreo, correlacion, precision, instrumentacion,
+                                    motor = motor, calendario = calendario))
+
+
+def valorar_trayectorias(cubos, activos_seleccionados, inversion_inicial, distribucion_cartera, balanceo, fase, fase_dinero, inflacion,
+                         instrumentacion = None, calendario = None, num_simulaciones = None, progreso = None, cancelar = None,
+                         modo = "completo", parametros = None):
+
+    """
+    Etapa valoracion: rentabilidad real y nominal de la cartera sobre los cubos de generar_trayectorias o
+    iterar_trayectorias. El calendario, si se indica, sustituye a balanceo, fase y fase_dinero
+
+    Args:
+    - num_simulaciones: Total de simulaciones de los cubos, para informar del progreso. Por defecto el de la lista cubos
+    - modo: "completo" o "agregado", como en run_multiple_simulations
+    - parametros (dict): Parametros del mercado (ver parametros_mercado). Si se indican, los cubos son shocks de la
+      malla de eventos y se valoran con simular_cartera_eventos
+    - progreso, cancelar, resto: ver run_multiple_simulations
+
+    Returns:
+    - resultado (SimulationResult), solo con los lotes valorados si se cancelo
+    """
+
+    if num_simulaciones is None:
+        num_simulaciones = sum(len(cubo) for cubo in cubos)
+
+    if parametros is not None:
+        calendario = calendario_por_defecto(calendario, balanceo, int(parametros["T"] / parametros["dt"]) + 1, fase, fase_dinero)
+        periodos = plan_eventos(calendario.num_periodos, balanceo, calendario)[0]
+    else:
+        periodos = None
+
+    lotes = {"total": [], "por_periodo": [], "total_nominal": [], "por_periodo_nominal": []}
+    acumuladores = None
+    completadas = 0
+
+    for cubo in cubos:
+        if parametros is None:
+            with medir_etapa(instrumentacion, "rebalanceo", len(cubo)):
+                valores = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(inversion_inicial = inversion_inicial,
+                                                                                tasa_de_cambio = cubo,
+                                                                                pesos = distribucion_cartera,
+                                                                                balanceo = balanceo,
+                                                                                fase = fase,
+                                                                                fase_dinero = fase_dinero,
+                                                                                inflacion = inflacion,
+                                                                                tipo_rentabilidad = "ambas",
+                                                                                calendario = calendario)
+        else:
+            with medir_etapa(instrumentacion, "simulacion_eventos", len(cubo)):
+                valores = simular_cartera_eventos(parametros["T"], parametros["mu"], parametros["sigma"], parametros["dt"], len(cubo),
+                                                  inversion_inicial, distribucion_cartera, balanceo, fase, fase_dinero, inflacion,
+                                                  cholesky = parametros["cholesky"], calendario = calendario, shocks = cubo)
+            if modo == "completo":
+                # Misma precision que la rentabilidad por periodo guardada por run_multiple_simulations
+                valores = (valores[0], valores[1].astype(parametros["dtype"], copy = False),
+                           valores[2], valores[3].astype(parametros["dtype"], copy = False))
+
+        if periodos is None:
+            periodos = np.arange(1, valores[1].shape[1] + 1)
+
+        lotes["total"].append(valores[0])
+        lotes["total_nominal"].append(valores[2])
+        if modo == "completo":
+            lotes["por_periodo"].append(valores[1])
+            lotes["por_periodo_nominal"].append(valores[3])
+        else:
+            if acumuladores is None:
+                acumuladores = [AcumuladorPorPeriodo(len(periodos), periodos = periodos) for _ in range(2)]
+            acumuladores[0].agregar(valores[1])
+            acumuladores[1].agregar(valores[3])
+        completadas += len(cubo)
+
+        if progreso is not None:
+            progreso(completadas, num_simulaciones,
+                     lambda num_lotes = len(lotes["total"]): _unir_lotes(activos_seleccionados, lotes, num_lotes, acumuladores, periodos))
+
+        if _cancelada(cancelar):
+            break
+
+    with medir_etapa(instrumentacion, "agregacion", completadas):
+        return _unir_lotes(activos_seleccionados, lotes, len(lotes["total"]), acumuladores, periodos)
+
+
+def _unir_lotes(activos_seleccionados, lotes, num_lotes, acumuladores = None, periodos = None):
+
+    # SimulationResult de los primeros num_lotes lotes valorados. En modo agregado, los acumuladores ya tienen todos los lotes
+    # valorados, que son los num_lotes primeros al construirse el resultado parcial
+    if acumuladores is None:
+        return SimulationResult(activos = activos_seleccionados,
+                                rentabilidad_total = np.concatenate(lotes["total"][:num_lotes]),
+                                rentabilidad_por_periodo = np.concatenate(lotes["por_periodo"][:num_lotes]),
+                                rentabilidad_total_nominal = np.concatenate(lotes["total_nominal"][:num_lotes]),
+                                rentabilidad_por_periodo_nominal = np.concatenate(lotes["por_periodo_nominal"][:num_lotes]),
+                                periodos = periodos)
+
+    return SimulationResult(activos = activos_seleccionados,
+                            rentabilidad_total = np.concatenate(lotes["total"][:num_lotes]),
+                            rentabilidad_por_periodo = None,
+                            rentabilidad_total_nominal = np.concatenate(lotes["total_nominal"][:num_lotes]),
+                            rentabilidad_por_periodo_nominal = None,
+                            agregado_por_periodo = acumuladores[0].resultado(),
+                            agregado_por_periodo_nominal = acumuladores[1].resultado(),
+                            periodos = periodos)
@@ -0,0 +1,165 @@
+from contextlib import contextmanager, nullcontext
+import pandas as pd
+import tracemalloc
+import threading
+import logging
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+# tracemalloc es global al proceso: solo una etapa a la vez mide la memoria, para que el reset_peak o el
+# stop de una etapa no corrompan la medicion de otra que se ejecute en otro hilo (otra sesion de la app)
+_BLOQUEO_MEMORIA = threading.Lock()
+
+
+class Instrumentacion:
+
+    """
+    Registro del tiempo, las trayectorias por segundo y la memoria pico de cada etapa del calculo
+
+    Cada etapa se mide con el gestor de contexto etapa(). Si una etapa se repite (por ejemplo una vez por lote)
+    los tiempos y las trayectorias se suman y la memoria pico es la mayor. Cada medicion se emite ademas como
+    un log estructurado (JSON) en el logger src.instrumentacion.
+
+    La memoria pico se mide con tracemalloc, que es global al proceso, por lo que las etapas no se deben anidar.
+    Si otra etapa ya esta midiendo la memoria, por ejemplo la simulacion de otra sesion en otro hilo, la etapa
+    solo mide el tiempo y su memoria pico queda sin medir. La memoria pico incluye las reservas de todos los
+    hilos durante la etapa.
+    """
+
+    __slots__ = ("medir_memoria", "etapas")
+
+    def __init__(self, medir_memoria = True):
+
+        """
+        Args:
+        - medir_memoria (bool): Medir la memoria pico de cada etapa con tracemalloc. Ralentiza las reservas de memoria
+        """
+
+        self.medir_memoria = medir_memoria
+        self.etapas = {}
+
+    @contextmanager
+    def etapa(self, nombre, num_trayectorias = None):
+
+        """
+        Mide el bloque de codigo como la etapa nombre
+
+        Args:
+        - nombre: Nombre de la etapa
+        - num_trayectorias: Numero de trayectorias procesadas en el bloque, para calcular trayectorias por segundo
+        """
+
+        medir_memoria = self.medir_memoria and _BLOQUEO_MEMORIA.acquire(blocking = False)
+        if self.medir_memoria and not medir_memoria:
+            logger.debug("La etapa %s no mide la memoria: otra etapa la esta midiendo", nombre)
+
+        iniciar_tracemalloc = medir_memoria and not tracemalloc.is_tracing()
+
+        if iniciar_tracemalloc:
+            tracemalloc.start()
+        if medir_memoria:
+            tracemalloc.reset_peak()
+            memoria_inicio = tracemalloc.get_traced_memory()[0]
+
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            tiempo = time.perf_counter() - inicio
+
+            memoria_pico = None
+            if medir_memoria:
+                memoria_pico = max(0, tracemalloc.get_traced_memory()[1] - memoria_inicio)
+                if iniciar_tracemalloc:
+                    tracemalloc.stop()
+                _BLOQUEO_MEMORIA.release()
+
+            self.registrar(nombre, tiempo, num_trayectorias, memoria_pico)
+
+    def registrar(self, nombre, tiempo, num_trayectorias = None, memoria_pico = None):
+
+        """
+        Añade una medicion a la etapa nombre y la emite como log
+
+        Args:
+        - nombre: Nombre de la etapa
+        - tiempo: Segundos
+        - num_trayectorias: Numero de trayectorias procesadas, o None si la etapa no procesa trayectorias
+        - memoria_pico: Bytes reservados como maximo por encima de la memoria al inicio de la etapa, o None si no se midio
+        """
+
+        logger.info(json.dumps({"etapa": nombre,
+                                "tiempo": round(tiempo, 6),
+                                "trayectorias": num_trayectorias,
+                                "memoria_pico": memoria_pico}))
+
+        self._acumular(nombre, tiempo, num_trayectorias, memoria_pico)
+
+    def _acumular(self, nombre, tiempo, num_trayectorias, memoria_pico, llamadas = 1):
+
+        registro = self.etapas.setdefault(nombre, {"tiempo": 0.0, "trayectorias": None, "memoria_pico": None, "llamadas": 0})
+
+        registro["tiempo"] += tiempo
+        registro["llamadas"] += llamadas
+        if num_trayectorias is not None:
+            registro["trayectorias"] = (registro["trayectorias"] or 0) + num_trayectorias
+        if memoria_pico is not None:
+            registro["memoria_pico"] = max(registro["memoria_pico"] or 0, memoria_pico)
+
+    def combinar(self, etapas):
+
+        """
+        Añade las mediciones de otra Instrumentacion, por ejemplo la de un lote simulado en otro proceso. No se
+        vuelven a emitir como log, ya se emitieron al medirlas
+
+        Args:
+        - etapas (dict): Atributo etapas de la otra Instrumentacion
+        """
+
+        for nombre, registro in etapas.items():
+            self._acumular(nombre, registro["tiempo"], registro["trayectorias"], registro["memoria_pico"], registro["llamadas"])
+
+    @property
+    def tiempo_total(self):
+        return sum(registro["tiempo"] for registro in self.etapas.values())
+
+    def a_dataframe(self):
+
+        """
+        Data Frame con una fila por etapa: tiempo, porcentaje del total, trayectorias por segundo y memoria pico en MiB
+        """
+
+        tiempo_total = self.tiempo_total
+
+        filas = []
+        for nombre, registro in self.etapas.items():
+            trayectorias = registro["trayectorias"]
+            memoria_pico = registro["memoria_pico"]
+
+            filas.append({"Etapa": nombre,
+                          "Tiempo (s)": registro["tiempo"],
+                          "% del total": 100 * registro["tiempo"] / tiempo_total if tiempo_total > 0 else 0.0,
+                          "Trayectorias/s": trayectorias / registro["tiempo"] if trayectorias and registro["tiempo"] > 0 else None,
+                          "Memoria pico (MiB)": memoria_pico / 2**20 if memoria_pico is not None else None,
+                          "Llamadas": registro["llamadas"]})
+
+        return pd.DataFrame(filas).set_index("Etapa") if filas else pd.DataFrame()
+
+
+def medir_etapa(instrumentacion, nombre, num_trayectorias = None):
+
+    """
+    Gestor de contexto de la etapa nombre, o uno vacio si instrumentacion es None
+
+    Args:
+    - instrumentacion (Instrumentacion): Registro de etapas, o None para no medir
+    - nombre: Nombre de la etapa
+    - num_trayectorias: Numero de trayectorias procesadas en el bloque
+    """
+
+    if instrumentacion is None:
+        return nullcontext()
+
+    return instrumentacion.etapa(nombre, num_trayectorias)
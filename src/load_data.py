@@ -1,31 +1,156 @@
-
-import yfinance as yf
+from src.cache_precios import CachePrecios, RUTA_CACHE
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import time
+
+# Descargas concurrentes maximas y reintentos por empresa cuando falla la descarga conjunta
+MAX_DESCARGAS = 8
+REINTENTOS = 3
+ESPERA = 1.0
+
+
+def descargar_precios(empresa, start_date, end_date):
+
+    """
+    Descargar de yfinance los precios de cierre ajustados de una empresa
+
+    Args:
+        empresa (string): Empresa para la que se quiere data
+        start_date (string): String con la fecha de inicio para la que se quiere la data
+        end_date (string): String con la fecha final para la que se quiere la data
+
+    Returns:
+        precios: Serie con el Adj Close indexada por fecha
+    """
+
+    # yfinance solo se importa al descargar: la simulacion y la cache funcionan sin el
+    import yfinance as yf
+
+    datos = yf.download(empresa, start=start_date, end=end_date)
+
+    return datos['Adj Close']
+
+
+def descargar_precios_masivo(empresas, start_date, end_date):
+
+    """
+    Descargar de yfinance los precios de cierre ajustados de varias empresas en una sola peticion
+
+    Args:
+        empresas (list): Lista de empresas para las que se quiere data
+        start_date (string): String con la fecha de inicio para la que se quiere la data
+        end_date (string): String con la fecha final para la que se quiere la data
+
+    Returns:
+        precios: Data Frame con el Adj Close de cada empresa indexado por fecha
+    """
+
+    import yfinance as yf
+
+    datos = yf.download(list(empresas), start=start_date, end=end_date, group_by='column', progress=False)
+    precios = datos['Adj Close']
+
+    if isinstance(precios, pd.Series):
+        precios = precios.to_frame(empresas[0])
+
+    return precios
+
 
-def load_data(empresas, start_date, end_date):
+def descargar_con_reintentos(descargador, empresa, start_date, end_date, reintentos = REINTENTOS, espera = ESPERA):
+
+    """
+    Llama al descargador reintentando con espera exponencial si falla
+
+    Args:
+        descargador: Funcion (empresa, start_date, end_date) -> Serie de precios
+        empresa (string): Empresa para la que se quiere data
+        start_date (string): String con la fecha de inicio para la que se quiere la data
+        end_date (string): String con la fecha final para la que se quiere la data
+        reintentos (int): Numero de intentos
+        espera (float): Segundos de espera antes del segundo intento, se duplica en cada intento
+
+    Returns:
+        precios: Serie de precios indexada por fecha
+    """
+
+    for intento in range(reintentos):
+        try:
+            return descargador(empresa, start_date, end_date)
+        except Exception:
+            if intento == reintentos - 1:
+                raise
+            time.sleep(espera * 2 ** intento)
+
+
+def descargar_precios_varias(empresas, start_date, end_date, descargador_masivo = descargar_precios_masivo, descargador = descargar_precios,
+                             max_descargas = MAX_DESCARGAS, reintentos = REINTENTOS, espera = ESPERA):
+
+    """
+    Descargar los precios de varias empresas
+
+    Primero intenta una sola peticion con todas las empresas. Las empresas que no vienen en esa peticion
+    (o todas, si falla) se descargan en paralelo con un numero acotado de hilos y reintentos. Los
+    descargadores se pueden sustituir, por ejemplo por uno local en pruebas.
+
+    Args:
+        empresas (list): Lista de empresas para las que se quiere data
+        start_date (string): String con la fecha de inicio para la que se quiere la data
+        end_date (string): String con la fecha final para la que se quiere la data
+        descargador_masivo: Funcion (empresas, start_date, end_date) -> Data Frame, o None para no usarla
+        descargador: Funcion (empresa, start_date, end_date) -> Serie de precios
+        max_descargas (int): Numero maximo de descargas en paralelo
+        reintentos (int): Numero de intentos por empresa
+        espera (float): Segundos de espera antes del segundo intento, se duplica en cada intento
+
+    Returns:
+        precios: Data Frame con los precios de cada empresa indexado por fecha
+    """
+
+    precios = {}
+
+    if descargador_masivo is not None and len(empresas) > 1:
+        try:
+            datos = descargador_masivo(empresas, start_date, end_date)
+            precios = {empresa: datos[empresa] for empresa in empresas if empresa in datos.columns and datos[empresa].notna().any()}
+        except Exception:
+            precios = {}
+
+    faltantes = [empresa for empresa in empresas if empresa not in precios]
+
+    if faltantes:
+        with ThreadPoolExecutor(max_workers = min(max_descargas, len(faltantes))) as executor:
+            descargas = [executor.submit(descargar_con_reintentos, descargador, empresa, start_date, end_date, reintentos, espera) for empresa in faltantes]
+            for empresa, descarga in zip(faltantes, descargas):
+                precios[empresa] = descarga.result()
+
+    # Alinear todas las empresas por fecha en una sola pasada
+    return pd.concat([precios[empresa].rename(empresa) for empresa in empresas], axis=1)
+
+
+def load_data(empresas, start_date, end_date, cache = None, offline = False):
     
     """
     Cargar datos de yfinance 
+
+    Los precios se guardan en una cache local y en cada carga solo se descargan las fechas que faltan,
+    juntas para todas las empresas a las que les falta el mismo rango.
  
     Args:
         empresas (list): Lista de empresas para las que se quiere data
         start_date (string): String con la fecha de inicio para la que se quiere la data
         end_date (string): String con la fecha final para la que se quiere la data
+        cache (CachePrecios): Cache de precios. Por defecto la cache en RUTA_CACHE que descarga de yfinance
+        offline (bool): Si es True solo se usan los datos de la cache
  
     Returns:
         base_data: Data de yfinance para las empresas seleccionadas
     """
 
-    #diccionario para almacenar datos individuales
-    datos_empresas = {}
-
-    # Descargar datos para cada empresa y almacenar en el diccionario
-    for empresa in empresas:
-        datos = yf.download(empresa, start=start_date, end=end_date)
-        datos_empresas[empresa] = datos[['Adj Close']].reset_index().set_index('Date')
+    if cache is None:
+        cache = CachePrecios(RUTA_CACHE, descargador = descargar_precios, descargador_masivo = descargar_precios_varias)
 
     # Crear un DataFrame consolidado con las columnas de fecha y Adj Close para cada empresa
-    df_consolidado = pd.DataFrame({empresa: datos['Adj Close'] for empresa, datos in datos_empresas.items()})
+    df_consolidado = cache.obtener_varias(empresas, start_date, end_date, offline = offline)
 
     return df_consolidado
 
@@ -0,0 +1,186 @@
+from functools import lru_cache
+from scipy.special import ndtri
+from scipy.stats import qmc
+import warnings
+import numpy as np
+
+# Esquemas de muestreo de los shocks del GBM
+MUESTREOS = ("estandar", "antitetico", "sobol", "estratificado")
+
+# Puntos del puente browniano por activo que se toman de la secuencia de Sobol, el resto son pseudoaleatorios
+DIMENSIONES_SOBOL = 64
+
+# Valores float64 maximos de cada bloque al generar normales de menor precision
+VALORES_POR_BLOQUE = 2**22
+
+
+@lru_cache(maxsize=8)
+def _plan_puente_browniano(num_pasos):
+
+    """
+    Orden de construccion del puente browniano para num_pasos pasos
+
+    Primero el punto final y despues, nivel a nivel, el punto medio de cada intervalo. 
+
+    Args:
+    - num_pasos: Numero de pasos de la trayectoria
+
+    Returns:
+    - niveles: lista de (medios, izquierdos, derechos, primer_shock) con los indices de cada nivel
+    """
+
+    niveles = []
+    intervalos = [(0, num_pasos)]
+    primer_shock = 1
+
+    while intervalos:
+        medios, izquierdos, derechos, siguientes = [], [], [], []
+
+        for izquierdo, derecho in intervalos:
+            if derecho - izquierdo > 1:
+                medio = (izquierdo + derecho) // 2
+                medios.append(medio)
+                izquierdos.append(izquierdo)
+                derechos.append(derecho)
+                siguientes += [(izquierdo, medio), (medio, derecho)]
+
+        if not medios:
+            break
+
+        niveles.append((np.array(medios), np.array(izquierdos), np.array(derechos), primer_shock))
+        primer_shock += len(medios)
+        intervalos = siguientes
+
+    return niveles
+
+
+def puente_browniano(Z, duraciones = None):
+
+    """
+    Convierte shocks normales en orden de puente browniano en shocks normales por paso
+
+    El primer shock fija el valor final del movimiento browniano y los siguientes, nivel a nivel, los puntos
+    medios. Asi los primeros shocks son los que mas influyen en la trayectoria, que es donde los esquemas
+    de Sobol y estratificado concentran su precision.
+
+    Con pasos de distinta duracion (la malla de eventos) el puente se construye sobre los tiempos acumulados:
+    cada punto medio se interpola segun el tiempo a cada extremo y su varianza es la del puente en ese tiempo.
+    Cada incremento se divide por la raiz de su duracion, por lo que los shocks siguen siendo normales estandar.
+
+    Args:
+    - Z: array (simulaciones x activos x pasos) de normales estandar en orden de puente browniano
+    - duraciones: Duracion de cada paso. Si es None todos los pasos duran lo mismo
+
+    Returns:
+    - dW: array (simulaciones x activos x pasos) de incrementos normales estandar por paso
+    """
+
+    num_pasos = Z.shape[-1]
+    tiempos = np.arange(num_pasos + 1.0) if duraciones is None else np.concatenate(([0.0], np.cumsum(duraciones, dtype=float)))
+
+    W = np.empty(Z.shape[:-1] + (num_pasos + 1,))
+    W[..., 0] = 0
+    W[..., num_pasos] = np.sqrt(tiempos[num_pasos]) * Z[..., 0]
+
+    for medios, izquierdos, derechos, primer_shock in _plan_puente_browniano(num_pasos):
+        t_medio, t_izquierdo, t_derecho = tiempos[medios], tiempos[izquierdos], tiempos[derechos]
+        peso_izquierdo = (t_derecho - t_medio) / (t_derecho - t_izquierdo)
+        peso_derecho = (t_medio - t_izquierdo) / (t_derecho - t_izquierdo)
+        desviacion = np.sqrt((t_medio - t_izquierdo) * (t_derecho - t_medio) / (t_derecho - t_izquierdo))
+
+        W[..., medios] = (peso_izquierdo * W[..., izquierdos] + peso_derecho * W[..., derechos]
+                          + desviacion * Z[..., primer_shock:primer_shock + len(medios)])
+
+    dW = np.diff(W, axis=-1)
+
+    return dW if duraciones is None else dW / np.sqrt(np.diff(tiempos))
+
+
+def _normales(aleatorio, forma, dtype):
+
+    """
+    Normales estandar del tipo dtype, siempre de la secuencia float64 del generador
+
+    Generator.standard_normal con dtype float32 usa otro algoritmo y daria otra muestra para la misma semilla.
+    Las normales se generan en float64 por bloques de simulaciones y se convierten, por lo que una simulacion
+    float32 es la misma muestra que la float64 con menos precision, sin tener el cubo entero en float64.
+    """
+
+    if np.dtype(dtype) == np.float64:
+        return aleatorio.standard_normal(size=forma)
+
+    # Bloques consecutivos de simulaciones dan la misma secuencia que una sola llamada
+    Z = np.empty(forma, dtype=dtype)
+    por_simulacion = int(np.prod(forma[1:]))
+    tamano_bloque = max(1, VALORES_POR_BLOQUE // max(por_simulacion, 1))
+
+    for inicio in range(0, forma[0], tamano_bloque):
+        final = min(inicio + tamano_bloque, forma[0])
+        Z[inicio:final] = aleatorio.standard_normal(size=(final - inicio,) + tuple(forma[1:]))
+
+    return Z
+
+
+def generar_shocks(num_simulaciones, num_assets, num_pasos, muestreo = "estandar", generador = None, dtype = np.float64,
+                   duraciones = None):
+
+    """
+    Genera los shocks normales estandar del GBM con el esquema de muestreo indicado
+
+    - estandar: normales pseudoaleatorias, las mismas que usa geometric_brownian_motion_batch
+    - antitetico: la segunda mitad de las simulaciones usa los shocks de la primera mitad cambiados de signo
+    - sobol: Sobol aleatorizado (scrambled) para los primeros DIMENSIONES_SOBOL puntos del puente browniano de cada activo
+    - estratificado: el valor final del movimiento browniano de cada activo se estratifica en num_simulaciones estratos
+      equiprobables y el resto de la trayectoria se construye con el puente browniano
+
+    Args:
+    - num_simulaciones: Numero de simulaciones
+    - num_assets: Numero de activos
+    - num_pasos: Numero de pasos de cada trayectoria
+    - muestreo: Esquema de muestreo, uno de MUESTREOS
+    - generador (np.random.Generator): generador de numeros aleatorios. Si es None se usa el estado global de np.random
+    - dtype: Tipo de los shocks, np.float64 o np.float32. Con la misma semilla los shocks float32 son los float64 redondeados
+    - duraciones: Duracion de cada paso, para el puente browniano de sobol y estratificado. Si es None todos duran lo mismo
+
+    Returns:
+    - Z: array (simulaciones x activos x pasos) de shocks normales estandar
+    """
+
+    aleatorio = generador if generador is not None else np.random
+    forma = (num_simulaciones, num_assets, num_pasos)
+
+    if muestreo == "estandar":
+        return _normales(aleatorio, forma, dtype)
+
+    if muestreo == "antitetico":
+        mitad = _normales(aleatorio, ((num_simulaciones + 1) // 2, num_assets, num_pasos), dtype)
+        return np.concatenate((mitad, -mitad))[:num_simulaciones]
+
+    if muestreo == "sobol":
+        dimensiones = min(DIMENSIONES_SOBOL, num_pasos)
+        semilla_sobol = generador if generador is not None else np.random.randint(2**31)
+        sobol = qmc.Sobol(d = num_assets * dimensiones, scramble = True, seed = semilla_sobol)
+
+        with warnings.catch_warnings():
+            # El balance de Sobol es optimo con potencias de 2, pero cualquier numero de puntos es valido
+            warnings.simplefilter("ignore", UserWarning)
+            uniformes = sobol.random(num_simulaciones)
+
+        Z = np.empty(forma)
+        Z[..., :dimensiones] = ndtri(np.clip(uniformes, 1e-12, 1 - 1e-12)).reshape(num_simulaciones, num_assets, dimensiones)
+        Z[..., dimensiones:] = aleatorio.standard_normal(size=(num_simulaciones, num_assets, num_pasos - dimensiones))
+
+        return puente_browniano(Z, duraciones).astype(dtype, copy = False)
+
+    if muestreo == "estratificado":
+        Z = np.empty(forma)
+
+        # Un estrato por simulacion, asignados en orden aleatorio e independiente para cada activo
+        estratos = np.argsort(aleatorio.random(size=(num_assets, num_simulaciones)), axis=1).T
+        uniformes = (estratos + aleatorio.random(size=(num_simulaciones, num_assets))) / num_simulaciones
+        Z[..., 0] = ndtri(uniformes)
+        Z[..., 1:] = aleatorio.standard_normal(size=(num_simulaciones, num_assets, num_pasos - 1))
+
+        return puente_browniano(Z, duraciones).astype(dtype, copy = False)
+
+    raise ValueError(f"Esquema de muestreo no valido: {muestreo}")
@@ -0,0 +1,255 @@
+"""
+Busqueda del dinero por periodo que cumple un objetivo de probabilidad
+
+En Acumulación se busca el menor aporte por periodo de rebalanceo con el que la probabilidad de superar
+rentabilidad_objetivo llega a probabilidad. En Distribución, el mayor retiro por periodo con el que la
+probabilidad de ruina (que la cartera llegue a cero en algun periodo) no pasa de riesgo_ruina.
+
+La busqueda se hace por biseccion sobre un conjunto fijo de trayectorias simuladas. Con las trayectorias
+fijas los pesos de cada periodo no dependen del dinero que entra o sale, por lo que el valor de la cartera
+en cada periodo es afin en el flujo: valor = base + flujo * por_unidad, donde base es el valor sin flujos y
+por_unidad el valor de aportar 1 en cada periodo de rebalanceo (o, con un calendario de eventos, el flujo por
+unidad de cada evento, con su crecimiento). Las dos partes se calculan con dos pasadas
+del rebalanceo, y de ellas el umbral de cada simulacion: el aporte a partir del cual supera el objetivo o el
+retiro a partir del cual se arruina. Cada iteracion de la biseccion solo compara el dinero con los umbrales,
+sin volver a rebalancear. Lo mismo vale para los shocks de la malla de eventos (ver
+src.simulation.generar_shocks_eventos), valorados con simular_cartera_eventos.
+
+Las trayectorias se recorren lote a lote y de cada lote solo se conservan los umbrales.
+"""
+
+from src.rentabilidad import rentabilidad_cartera_rebalanceo_inflacion_vectorizada
+from src.simulation import simular_cartera_eventos
+from src.calendario import CalendarioEventos
+from src.resultados import intervalo_probabilidad, CONFIANZA
+import numpy as np
+
+# Diferencia maxima, en unidades monetarias, entre los extremos de la biseccion al terminar
+TOLERANCIA = 0.01
+
+# Iteraciones maximas de la biseccion y duplicaciones maximas del extremo superior al acotar la solucion
+MAX_ITERACIONES = 100
+MAX_DUPLICACIONES = 60
+
+
+def descomponer_flujo(cubo, inversion_inicial, distribucion_cartera, balanceo, inflacion, tipo_rentabilidad = "real", parametros = None,
+                      calendario = None):
+
+    """
+    Valor de la cartera sin flujos y valor de aportar 1 en cada periodo de rebalanceo
+
+    Args:
+    - cubo: array (simulaciones x activos x periodos) con los cambios porcentuales de los activos, o con los shocks de
+      la malla de eventos si se indican parametros
+    - inversion_inicial, distribucion_cartera, balanceo, inflacion: ver run_multiple_simulations
+    - tipo_rentabilidad: "real" o "nominal"
+    - parametros (dict): Parametros del mercado (ver parametros_mercado), para valorar los shocks con simular_cartera_eventos
+    - calendario (CalendarioEventos): Periodos de rebalanceo y flujo por unidad de cada evento. Si es None, los de balanceo
+
+    Returns:
+    - base, por_unidad: arrays (simulaciones x periodos) en float64. El valor con un flujo por periodo es base + flujo * por_unidad
+    """
+
+    # Los mismos eventos sin flujos y con el flujo de aportar 1
+    calendarios = (None, None)
+    if calendario is not None:
+        calendarios = (CalendarioEventos(calendario.num_periodos, calendario.periodos_rebalanceo, 0.0, calendario.dias_por_anio),
+                       CalendarioEventos(calendario.num_periodos, calendario.periodos_rebalanceo, calendario.por_unidad, calendario.dias_por_anio))
+
+    if parametros is not None:
+        # Rentabilidad por periodo real o nominal de simular_cartera_eventos, en los periodos de plan_eventos
+        indice = 1 if tipo_rentabilidad == "real" else 3
+        argumentos = dict(T = parametros["T"], mu = parametros["mu"], sigma = parametros["sigma"], dt = parametros["dt"],
+                          num_simulaciones = len(cubo), pesos = distribucion_cartera, balanceo = balanceo, fase = "Acumulación",
+                          inflacion = inflacion, cholesky = parametros["cholesky"], shocks = cubo)
+
+        base = simular_cartera_eventos(inversion_inicial = inversion_inicial, fase_dinero = 0, calendario = calendarios[0], **argumentos)[indice]
+        por_unidad = simular_cartera_eventos(inversion_inicial = 0, fase_dinero = 1, calendario = calendarios[1], **argumentos)[indice]
+
+        return base, por_unidad
+
+    _, base = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(inversion_inicial, cubo, distribucion_cartera, balanceo,
+                                                                    "Acumulación", 0, inflacion, tipo_rentabilidad, dtype = np.float64,
+                                                                    calendario = calendarios[0])
+    _, por_unidad = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(0, cubo, distribucion_cartera, balanceo,
+                                                                          "Acumulación", 1, inflacion, tipo_rentabilidad, dtype = np.float64,
+                                                                          calendario = calendarios[1])
+
+    return base, por_unidad
+
+
+def umbrales_fase_dinero(cubos, inversion_inicial, distribucion_cartera, balanceo, fase, inflacion, rentabilidad_objetivo = None,
+                         tipo_rentabilidad = "real", parametros = None, calendario = None):
+
+    """
+    Umbral de dinero por periodo de cada simulacion
+
+    En Acumulación, la simulacion supera rentabilidad_objetivo si el aporte es mayor que su umbral. En
+    Distribución, la cartera no llega a cero en ningun periodo si el retiro es menor que su umbral.
+
+    Args:
+    - cubos: Lista o iterador de arrays (simulaciones x activos x periodos) con los cambios porcentuales de cada lote
+    - resto: ver buscar_fase_dinero
+
+    Returns:
+    - umbrales: array (simulaciones). Es inf si ningun flujo alcanza el criterio (no hay periodos de rebalanceo)
+    """
+
+    umbrales = []
+
+    for cubo in cubos:
+        base, por_unidad = descomponer_flujo(cubo, inversion_inicial, distribucion_cartera, balanceo, inflacion, tipo_rentabilidad, parametros,
+                                             calendario)
+
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            if fase == "Acumulación":
+                # base + aporte * por_unidad > objetivo en el ultimo periodo
+                umbral = np.where(por_unidad[:, -1] > 0, (rentabilidad_objetivo - base[:, -1]) / por_unidad[:, -1],
+                                  np.where(base[:, -1] > rentabilidad_objetivo, -np.inf, np.inf))
+            else:
+                # base - retiro * por_unidad > 0 en todos los periodos en los que ya hubo retiros
+                umbral = np.where(por_unidad > 0, base / por_unidad, np.inf).min(axis=1)
+
+        # Con un iterador, el lote se libera antes de generar el siguiente
+        umbrales.append(umbral)
+        del cubo, base, por_unidad
+
+    return np.concatenate(umbrales)
+
+
+def _biseccion(cumple, inferior, superior, tolerancia, max_iteraciones):
+
+    """
+    Frontera de un criterio monotono: cumple(inferior) y cumple(superior) son distintos y se devuelve el
+    extremo del intervalo final en el que se cumple
+    """
+
+    cumple_inferior = cumple(inferior)
+
+    for _ in range(max_iteraciones):
+        if superior - inferior <= tolerancia:
+            break
+
+        medio = (inferior + superior) / 2
+        if cumple(medio) == cumple_inferior:
+            inferior = medio
+        else:
+            superior = medio
+
+    return inferior if cumple_inferior else superior
+
+
+def _frontera(cumple, inicial, creciente, tolerancia, max_iteraciones):
+
+    """
+    Dinero por periodo en la frontera de cumple, o None si no se puede acotar con estas trayectorias
+
+    Si creciente, cumple pasa de falso a verdadero al aumentar el dinero y se busca el menor valor que
+    cumple; si no, pasa de verdadero a falso y se busca el mayor valor que cumple.
+    """
+
+    if cumple(0.0) == creciente:
+        return 0.0 if creciente else None
+
+    # Acotar la frontera duplicando el extremo superior
+    superior = inicial
+    for _ in range(MAX_DUPLICACIONES):
+        if cumple(superior) == creciente:
+            return _biseccion(cumple, 0.0, superior, tolerancia, max_iteraciones)
+        superior *= 2
+
+    return None
+
+
+def buscar_fase_dinero(cubos, inversion_inicial, distribucion_cartera, balanceo, fase, inflacion, rentabilidad_objetivo = None,
+                       probabilidad = 80, riesgo_ruina = 10, tipo_rentabilidad = "real", confianza = CONFIANZA,
+                       tolerancia = TOLERANCIA, max_iteraciones = MAX_ITERACIONES, parametros = None, calendario = None):
+
+    """
+    Aporte necesario (Acumulación) o retiro sostenible (Distribución) por periodo de rebalanceo
+
+    El intervalo de confianza de la solucion es el conjunto de aportes o retiros para los que el objetivo de
+    probabilidad cae dentro del intervalo de confianza de Wilson de la probabilidad estimada: sus extremos son
+    las fronteras del criterio evaluado con el limite inferior y con el limite superior del intervalo.
+
+    Args:
+    - cubos: Lista o iterador de arrays (simulaciones x activos x periodos) con los cambios porcentuales de cada lote,
+      por ejemplo los de src.etapas.iterar_trayectorias, o con los shocks de la malla de eventos si se indican parametros
+    - inversion_inicial, distribucion_cartera, balanceo, fase, inflacion: ver run_multiple_simulations
+    - rentabilidad_objetivo: Monto final objetivo, solo en Acumulación
+    - probabilidad: Probabilidad minima, en porcentaje, de superar rentabilidad_objetivo en Acumulación
+    - riesgo_ruina: Probabilidad maxima de ruina, en porcentaje, en Distribución
+    - tipo_rentabilidad: "real" o "nominal"
+    - confianza: Nivel de confianza del intervalo
+    - tolerancia: Precision de la solucion en unidades monetarias
+    - max_iteraciones: Iteraciones maximas de cada biseccion
+    - parametros (dict): Parametros del mercado (ver parametros_mercado) con los que valorar los shocks de la malla de eventos
+    - calendario (CalendarioEventos): Eventos de la simulacion. El aporte o retiro buscado es el de un evento con
+      por_unidad 1, y en los demas se multiplica por su por_unidad
+
+    Returns:
+    - solucion (dict):
+        - fase_dinero: aporte o retiro por periodo, o None si no se alcanza el objetivo con estas trayectorias
+        - intervalo: (inferior, superior) del aporte o retiro. Un extremo es None si no se puede acotar
+        - probabilidad: probabilidad estimada con fase_dinero, en porcentaje (de superar el objetivo o de ruina)
+        - intervalo_probabilidad: su intervalo de confianza en porcentaje
+        - num_simulaciones, iteraciones: simulaciones usadas y evaluaciones del criterio
+
+    Raises:
+    - ValueError: Si falta rentabilidad_objetivo en Acumulación o el balanceo no tiene periodos de rebalanceo en el horizonte
+    """
+
+    acumulacion = fase == "Acumulación"
+    if acumulacion and rentabilidad_objetivo is None:
+        raise ValueError("En Acumulación se necesita la rentabilidad objetivo")
+
+    umbrales = umbrales_fase_dinero(cubos, inversion_inicial, distribucion_cartera, balanceo, fase, inflacion, rentabilidad_objetivo,
+                                    tipo_rentabilidad, parametros, calendario)
+    num_simulaciones = len(umbrales)
+
+    # Sin periodos de rebalanceo ningun aporte o retiro cambia el resultado
+    if np.isposinf(umbrales).all():
+        raise ValueError(f"Con balanceo {balanceo} no hay periodos de rebalanceo en el horizonte simulado")
+
+    # Fraccion minima de simulaciones que deben cumplir: superar el objetivo o no arruinarse
+    fraccion = probabilidad / 100 if acumulacion else 1 - riesgo_ruina / 100
+    iteraciones = 0
+
+    def exitos(fase_dinero):
+
+        nonlocal iteraciones
+        iteraciones += 1
+
+        if acumulacion:
+            return int((fase_dinero > umbrales).sum())
+
+        return int((fase_dinero < umbrales).sum())
+
+    # Criterios con la probabilidad estimada y con cada limite de su intervalo de confianza
+    def criterio(indice):
+        return lambda fase_dinero: intervalo_probabilidad(exitos(fase_dinero), num_simulaciones, confianza)[indice] >= fraccion
+
+    # Escala inicial para acotar la frontera: la mediana de los umbrales finitos
+    finitos = np.abs(umbrales[np.isfinite(umbrales)])
+    escala = max(float(np.median(finitos)) if len(finitos) else 1.0, tolerancia)
+
+    fase_dinero, inferior, superior = (_frontera(criterio(indice), escala, acumulacion, tolerancia, max_iteraciones) for indice in range(3))
+
+    # En Acumulación el limite superior de la probabilidad da el aporte mas bajo; en Distribución, el retiro mas alto
+    intervalo = (superior, inferior) if acumulacion else (inferior, superior)
+
+    if fase_dinero is None:
+        probabilidad_final, intervalo_final = None, (None, None)
+    else:
+        estimada, limite_inferior, limite_superior = intervalo_probabilidad(exitos(fase_dinero), num_simulaciones, confianza)
+        if acumulacion:
+            probabilidad_final, intervalo_final = 100 * estimada, (100 * limite_inferior, 100 * limite_superior)
+        else:
+            probabilidad_final, intervalo_final = 100 * (1 - estimada), (100 * (1 - limite_superior), 100 * (1 - limite_inferior))
+
+    return {"fase_dinero": fase_dinero,
+            "intervalo": intervalo,
+            "probabilidad": probabilidad_final,
+            "intervalo_probabilidad": intervalo_final,
+            "num_simulaciones": num_simulaciones,
+            "iteraciones": iteraciones}
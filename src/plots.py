@@ -1,4 +1,54 @@
 import plotly.graph_objects as go
+import numpy as np
+
+# Limites del grafico de abanico: puntos por trazo y trayectorias de muestra
+MAX_PUNTOS_ABANICO = 1000
+MAX_TRAYECTORIAS_ABANICO = 5
+
+
+def _lttb(y, num_puntos):
+
+        """
+        Selecciona num_puntos indices de la serie y con Largest-Triangle-Three-Buckets, que conserva la forma de la serie
+
+        Args:
+            y (array): Serie a reducir
+            num_puntos (int): Numero de puntos a conservar
+
+        Returns:
+            indices: array con los indices seleccionados, incluyendo el primero y el ultimo
+        """
+
+        num_valores = len(y)
+
+        if num_puntos >= num_valores or num_puntos < 3:
+            return np.arange(num_valores)
+
+        x = np.arange(num_valores, dtype=float)
+        tamano_bucket = (num_valores - 2) / (num_puntos - 2)
+
+        indices = np.empty(num_puntos, dtype=np.int64)
+        indices[0] = 0
+        indices[-1] = num_valores - 1
+        anterior = 0
+
+        for i in range(num_puntos - 2):
+
+                # Punto medio del siguiente bucket
+                inicio_siguiente = int(np.floor((i + 1) * tamano_bucket)) + 1
+                final_siguiente = min(int(np.floor((i + 2) * tamano_bucket)) + 1, num_valores)
+                media_x = x[inicio_siguiente:final_siguiente].mean()
+                media_y = y[inicio_siguiente:final_siguiente].mean()
+
+                # Punto del bucket actual que forma el triangulo de mayor area
+                inicio = int(np.floor(i * tamano_bucket)) + 1
+                final = int(np.floor((i + 1) * tamano_bucket)) + 1
+                areas = np.abs((x[anterior] - media_x) * (y[inicio:final] - y[anterior]) - (x[anterior] - x[inicio:final]) * (media_y - y[anterior]))
+
+                anterior = inicio + int(np.argmax(areas))
+                indices[i + 1] = anterior
+
+        return indices
 
 def create_plot_rentabilidad_por_periodo_por_simulacion(rentabilidad_por_periodo_por_simulacion):
         
@@ -111,4 +161,89 @@ def create_plot_rentabilidad_por_simulacion(inversion_inicial, rentabilidad_fina
             yaxis = dict(gridcolor = 'rgba(255,255,255,0.5)')
             )
       
-        return(fig)
\ No newline at end of file
+        return(fig)
+
+
+def create_plot_abanico_rentabilidad_por_periodo(agregado_por_periodo, num_trayectorias = MAX_TRAYECTORIAS_ABANICO, max_puntos = MAX_PUNTOS_ABANICO):
+        
+        """
+        Crear el grafico de abanico de Rentabilidad por periodo
+
+        Dibuja bandas entre percentiles simetricos, la mediana, la media y unas pocas trayectorias de muestra.
+        Todas las series se reducen a max_puntos con LTTB y se dibujan con trazos WebGL, por lo que el tamaño
+        del grafico no depende del numero de simulaciones ni del horizonte.
+ 
+        Args:
+            agregado_por_periodo (AgregadoPorPeriodo): Estadisticos por periodo de la rentabilidad
+            num_trayectorias (int): Numero maximo de trayectorias de muestra a dibujar
+            max_puntos (int): Numero maximo de puntos por trazo
+ 
+        Returns:
+            fig: Grafico
+        """
+
+        periodos = agregado_por_periodo.periodos
+        percentiles = sorted(agregado_por_periodo.percentiles)
+
+        # Los mismos indices para todas las bandas, elegidos sobre la serie central
+        serie_central = agregado_por_periodo.percentil(50) if 50 in percentiles else agregado_por_periodo.media
+        indices = _lttb(serie_central, max_puntos)
+        x = periodos[indices]
+
+        traces = []
+
+        # Bandas entre percentiles simetricos, de la mas ancha a la mas estrecha
+        for k in range(len(percentiles) // 2):
+
+                inferior, superior = percentiles[k], percentiles[-1 - k]
+                opacidad = 0.15 + 0.15 * k
+
+                traces.append(go.Scattergl(x = x,
+                                           y = agregado_por_periodo.percentil(superior)[indices],
+                                           mode = 'lines',
+                                           line = dict(width = 0),
+                                           showlegend = False,
+                                           hoverinfo = 'skip'))
+                traces.append(go.Scattergl(x = x,
+                                           y = agregado_por_periodo.percentil(inferior)[indices],
+                                           mode = 'lines',
+                                           line = dict(width = 0),
+                                           fill = 'tonexty',
+                                           fillcolor = f'rgba(31,119,180,{opacidad:.2f})',
+                                           name = f'Percentiles {inferior}-{superior}'))
+
+        if 50 in percentiles:
+                traces.append(go.Scattergl(x = x,
+                                           y = agregado_por_periodo.percentil(50)[indices],
+                                           mode = 'lines',
+                                           line = dict(color = 'rgb(31,119,180)'),
+                                           name = 'Mediana'))
+
+        traces.append(go.Scattergl(x = x,
+                                   y = agregado_por_periodo.media[indices],
+                                   mode = 'lines',
+                                   line = dict(color = 'black', dash = 'dash'),
+                                   name = 'Media'))
+
+        # Trayectorias de muestra, cada una reducida con sus propios indices
+        for i, trayectoria in enumerate(agregado_por_periodo.muestras[:num_trayectorias]):
+
+                indices_trayectoria = _lttb(trayectoria, max_puntos)
+
+                traces.append(go.Scattergl(x = periodos[indices_trayectoria],
+                                           y = trayectoria[indices_trayectoria],
+                                           mode = 'lines',
+                                           line = dict(width = 1),
+                                           opacity = 0.6,
+                                           name = f'Simulacion {i + 1}'))
+
+        layout = go.Layout(
+            title='Rentabilidad por Simulacion',
+            xaxis=dict(title='Period'),
+            yaxis=dict(title='Rentabilidad'),
+            plot_bgcolor='rgba(255,255,255,0)'  # Setting plot background color to transparent
+        )
+
+        fig = go.Figure(data=traces, layout=layout)
+
+        return(fig)
@@ -1,3 +1,4 @@
+from src.calendario import CalendarioEventos, calendario_por_defecto
 import pandas as pd
 import numpy as np
 
@@ -37,29 +38,63 @@ def compute_cambio_porcentual_por_activo(S):
     return percentage_changes
 
 
-def clean_rentabilidad_por_periodo(rentabilidad_por_periodo):
+def compute_cambio_porcentual_cubo(S):
+
+    """
+    Calcula el cambio porcentual de todos los activos en todas las simulaciones a la vez
+
+    Args:
+    - S: array (simulaciones x activos x periodos) con el precio generado mediante GBM
+
+    Returns:
+    - percentage_changes: array con la misma forma y el mismo tipo (float32 o float64) que S, con el cambio porcentual de cada periodo y 0 en el primero
+
+    """
+
+    percentage_changes = np.empty_like(S, dtype=S.dtype if np.issubdtype(S.dtype, np.floating) else float)
+
+    # El primer periodo no tiene cambio, igual que pct_change().fillna(0)
+    percentage_changes[..., 0] = 0
+    np.divide(S[..., 1:], S[..., :-1], out=percentage_changes[..., 1:])
+    percentage_changes[..., 1:] -= 1
+
+    return percentage_changes
+
+
+def clean_rentabilidad_por_periodo(rentabilidad_por_periodo, formato = "largo", periodos = None):
 
     """
     Limpia el objeto Rentabilidad por Periodo. 
+
+    Construye el Data Frame en una sola reserva de memoria a partir del array de rentabilidades, en lugar de
+    concatenar un Data Frame por simulacion.
     
     Args:
-    - rentabilidad_por_periodo: Lista de simulaciones, donde cada lista interna son los valores de rentabilidad en cada periodo
+    - rentabilidad_por_periodo: Lista de simulaciones o array (simulaciones x periodos), donde cada lista interna son los valores de rentabilidad en cada periodo
+    - formato: "largo" para un Data Frame con las columnas period, rentabilidad y simulation, o "ancho" para un Data Frame
+      (periodos x simulaciones) que comparte memoria con rentabilidad_por_periodo cuando este ya es un array
+    - periodos: Periodo (base 1) de cada columna. Por defecto 1, 2, ..., num_periodos
     
     Returns:
     - rentabilidad_por_periodo_por_simulacion: dataframe con los valores de la rentabilidad en cada periodo para cada simulacion
 
     """
 
-    # Initialize an empty DataFrame
-    rentabilidad_por_periodo_por_simulacion = pd.DataFrame()
+    rentabilidad_por_periodo = np.asarray(rentabilidad_por_periodo)
+    if not np.issubdtype(rentabilidad_por_periodo.dtype, np.floating):
+        rentabilidad_por_periodo = rentabilidad_por_periodo.astype(float)
+    num_simulaciones, num_periodos = rentabilidad_por_periodo.shape
+
+    periodos = np.arange(1, num_periodos + 1) if periodos is None else np.asarray(periodos)
+    simulaciones = np.arange(1, num_simulaciones + 1)
 
-    for i, rentabilidad in enumerate(rentabilidad_por_periodo):
-        # Create a temporary DataFrame for the current simulation
-        temp_df = pd.DataFrame({'period': range(1, len(rentabilidad) + 1),
-                            'rentabilidad': rentabilidad,
-                            'simulation': i + 1})
-        # Append the temporary DataFrame to the main DataFrame
-        rentabilidad_por_periodo_por_simulacion = pd.concat([rentabilidad_por_periodo_por_simulacion, temp_df], ignore_index=True)
+    if formato == "ancho":
+        # La transpuesta es una vista, el Data Frame no copia los datos
+        return pd.DataFrame(rentabilidad_por_periodo.T, index = periodos, columns = simulaciones, copy = False)
+
+    rentabilidad_por_periodo_por_simulacion = pd.DataFrame({'period': np.tile(periodos, num_simulaciones),
+                                                            'rentabilidad': rentabilidad_por_periodo.ravel(),
+                                                            'simulation': np.repeat(simulaciones, num_periodos)})
 
     return rentabilidad_por_periodo_por_simulacion
 
@@ -90,7 +125,7 @@ def get_periodo_rebalanceo(balanceo):
     
     return dias_rebalanceo
 
-def rentabilidad_cartera_rebalanceo(inversion_disponible, tasa_de_cambio, pesos, num_periodos, num_assets, balanceo, fase, fase_dinero):
+def rentabilidad_cartera_rebalanceo(inversion_disponible, tasa_de_cambio, pesos, num_periodos, num_assets, balanceo, fase, fase_dinero, calendario = None):
     
     """
     Calcula la rentabilidad de la cartera con rebalanceo
@@ -104,6 +139,7 @@ def rentabilidad_cartera_rebalanceo(inversion_disponible, tasa_de_cambio, pesos,
     - balanceo: Cada cuanto aplicar rebalanceo
     - fase: Fase en la que se encuentra, Acumulacion o Distribucion
     - fase_dinero: Dinero que desea retirar o invertir en cada periodo
+    - calendario (CalendarioEventos): Periodos de rebalanceo y flujo de cada uno. Si es None se construye a partir de balanceo, fase y fase_dinero
     
     Returns:
     - rentabilidad: Rentabilidad de Cartera al final del periodo. Una lista con la rentabilidad de cada activo al final del periodo
@@ -115,21 +151,18 @@ def rentabilidad_cartera_rebalanceo(inversion_disponible, tasa_de_cambio, pesos,
     rentabilidad_total_periodo = [] # Almacena la rentabilidad total en cada periodo
     
     pesos = pesos.copy()
-    
-    periodo = 0 # Variable creada para controlar el rebalanceo
-
-    # Definir el periodo de rebalanceo
 
-    periodo_rebalanceo = get_periodo_rebalanceo(balanceo)
+    # Definir los periodos de rebalanceo y el dinero que entra o sale en cada uno
+    calendario = calendario_por_defecto(calendario, balanceo, num_periodos, fase, fase_dinero)
+    es_rebalanceo = calendario.es_rebalanceo()
+    flujos = calendario.flujo_por_periodo()
 
     for i in range(0, num_periodos): # For Loop periods
-        
-        periodo +=1
     
         rentabilidad_periodo = []
     
-        # Logica Rebalanceo
-        if i != 0 and (periodo % periodo_rebalanceo == 0): # Si es el periodo 1, no hacer rebalanceo
+        # Logica Rebalanceo (el periodo 1 nunca es de rebalanceo)
+        if es_rebalanceo[i]:
             
             iteracion_anterior = i - 1
             
@@ -163,11 +196,8 @@ def rentabilidad_cartera_rebalanceo(inversion_disponible, tasa_de_cambio, pesos,
 
         # Calcular inversion disponible para la proxima iteracion
         # Si es periodo de rebalanceo, hacer retiro e ingreso de dinero correspondiente
-        if i != 0 and (periodo % periodo_rebalanceo == 0):
-            if fase == "Acumulación":
-                inversion_disponible = [sum(rentabilidad_periodo) + (fase_dinero)]
-            else:
-                inversion_disponible = [sum(rentabilidad_periodo) - (fase_dinero)]
+        if es_rebalanceo[i]:
+            inversion_disponible = [sum(rentabilidad_periodo) + flujos[i]]
         else:
             inversion_disponible = [sum(rentabilidad_periodo)]
     
@@ -177,7 +207,8 @@ def rentabilidad_cartera_rebalanceo(inversion_disponible, tasa_de_cambio, pesos,
     
 
 
-def rentabilidad_cartera_rebalanceo_inflacion(inversion_disponible, tasa_de_cambio, pesos, num_periodos, num_assets, balanceo, fase, fase_dinero, inflacion, tipo_rentabilidad):
+def rentabilidad_cartera_rebalanceo_inflacion(inversion_disponible, tasa_de_cambio, pesos, num_periodos, num_assets, balanceo, fase, fase_dinero, inflacion, tipo_rentabilidad,
+                                              calendario = None):
     
     """
     Calcula la rentabilidad de la cartera con rebalanceo
@@ -193,6 +224,7 @@ def rentabilidad_cartera_rebalanceo_inflacion(inversion_disponible, tasa_de_camb
     - fase_dinero: Dinero que desea retirar o invertir en cada periodo
     - inflacion: Inflacion anual
     - tipo_rentabilidad: nominal (Sin Inflacion) o real (Con Inflacion)
+    - calendario (CalendarioEventos): Periodos de rebalanceo y flujo de cada uno. Si es None se construye a partir de balanceo, fase y fase_dinero
     
     Returns:
     - rentabilidad: Rentabilidad de Cartera al final del periodo. Una lista con la rentabilidad de cada activo al final del periodo
@@ -204,24 +236,21 @@ def rentabilidad_cartera_rebalanceo_inflacion(inversion_disponible, tasa_de_camb
     rentabilidad_total_periodo = [] # Almacena la rentabilidad total en cada periodo
     
     pesos = pesos.copy()
-    
-    periodo = 0 # Variable creada para controlar el rebalanceo
-
-    # Definir el periodo de rebalanceo
 
-    periodo_rebalanceo = get_periodo_rebalanceo(balanceo)
+    # Definir los periodos de rebalanceo y el dinero que entra o sale en cada uno
+    calendario = calendario_por_defecto(calendario, balanceo, num_periodos, fase, fase_dinero)
+    es_rebalanceo = calendario.es_rebalanceo()
+    flujos = calendario.flujo_por_periodo()
 
     # Calcular la inflacion diaria
     inflacion_diaria = (inflacion/365)/100
 
     for i in range(0, num_periodos): # For Loop periods
-        
-        periodo +=1
     
         rentabilidad_periodo = []
     
-        # Logica Rebalanceo
-        if i != 0 and (periodo % periodo_rebalanceo == 0): # Si es el periodo 1, no hacer rebalanceo
+        # Logica Rebalanceo (el periodo 1 nunca es de rebalanceo)
+        if es_rebalanceo[i]:
             
             iteracion_anterior = i - 1
             
@@ -261,14 +290,137 @@ def rentabilidad_cartera_rebalanceo_inflacion(inversion_disponible, tasa_de_camb
 
         # Calcular inversion disponible para la proxima iteracion
         # Si es periodo de rebalanceo, hacer retiro e ingreso de dinero correspondiente
-        if i != 0 and (periodo % periodo_rebalanceo == 0):
-            if fase == "Acumulación":
-                inversion_disponible = [sum(rentabilidad_periodo) + (fase_dinero)]
-            else:
-                inversion_disponible = [sum(rentabilidad_periodo) - (fase_dinero)]
+        if es_rebalanceo[i]:
+            inversion_disponible = [sum(rentabilidad_periodo) + flujos[i]]
         else:
             inversion_disponible = [sum(rentabilidad_periodo)]
     
     rentabilidad_cartera = rentabilidad_total[-1]
     
-    return rentabilidad_cartera, rentabilidad_total_periodo
\ No newline at end of file
+    return rentabilidad_cartera, rentabilidad_total_periodo
+
+
+def get_periodos_rebalanceo(balanceo, num_periodos):
+
+    """
+    Calcula los indices de los periodos en los que se hace rebalanceo y entrada o salida de dinero
+
+    Args:
+    - balanceo(str): String indicando cada cuanto hacer el rebalanceo
+    - num_periodos: Numero de periodos para los que se tiene una simulacion
+
+    Returns:
+    - periodos_rebalanceo: array de indices (base 0) de los periodos de rebalanceo. Mismo criterio que rentabilidad_cartera_rebalanceo_inflacion
+
+    """
+
+    periodos_rebalanceo = CalendarioEventos.desde_balanceo(balanceo, num_periodos).periodos_rebalanceo
+
+    return periodos_rebalanceo
+
+
+def rentabilidad_cartera_rebalanceo_inflacion_vectorizada(inversion_inicial, tasa_de_cambio, pesos, balanceo, fase, fase_dinero, inflacion, tipo_rentabilidad, dtype = None,
+                                                          calendario = None):
+
+    """
+    Calcula la rentabilidad de la cartera con rebalanceo para todas las simulaciones a la vez
+
+    Version vectorizada de rentabilidad_cartera_rebalanceo_inflacion. En lugar de recorrer cada periodo
+    y cada activo, recorre solo los tramos entre periodos de rebalanceo: dentro de cada tramo los pesos
+    son constantes y el valor de la cartera se obtiene con un producto acumulado del crecimiento diario.
+    En cada periodo de rebalanceo se recalculan los pesos y se aplica la entrada o salida de dinero.
+
+    Los pesos no dependen de la inflacion (es un factor comun a todos los activos), por lo que con
+    tipo_rentabilidad = "ambas" se calcula la rentabilidad real y la nominal en un solo recorrido.
+
+    El valor de la cartera se acumula en float64 tramo a tramo aunque tasa_de_cambio sea float32; solo la
+    rentabilidad por periodo que se devuelve se guarda en dtype.
+
+    Args:
+    - inversion_inicial: Inversion Inicial
+    - tasa_de_cambio: array (simulaciones x activos x periodos) con la tasa de cambio de cada activo a traves del tiempo
+    - pesos: lista de pesos iniciales para cada Activo
+    - balanceo: Cada cuanto aplicar rebalanceo
+    - fase: Fase en la que se encuentra, Acumulacion o Distribucion
+    - fase_dinero: Dinero que desea retirar o invertir en cada periodo
+    - inflacion: Inflacion anual
+    - tipo_rentabilidad: nominal (Sin Inflacion), real (Con Inflacion) o ambas
+    - dtype: Tipo de la rentabilidad por periodo. Por defecto el de tasa_de_cambio
+    - calendario (CalendarioEventos): Periodos de rebalanceo y flujo de cada uno. Si es None se construye a partir de balanceo, fase y fase_dinero
+
+    Returns:
+    - rentabilidad_cartera: array (simulaciones x activos) con la rentabilidad de cada activo al final del periodo
+    - rentabilidad_total_periodo: array (simulaciones x periodos) con la rentabilidad de la cartera en todos los periodos
+    Con tipo_rentabilidad = "ambas" devuelve los dos objetos de la rentabilidad real seguidos de los dos de la nominal
+
+    """
+
+    num_simulaciones, num_assets, num_periodos = tasa_de_cambio.shape
+
+    # Calcular la inflacion diaria
+    inflacion_diaria = (inflacion/365)/100
+
+    if tipo_rentabilidad == "ambas":
+        factores_inflacion = [1 - inflacion_diaria, 1.0]
+    elif tipo_rentabilidad == "real":
+        factores_inflacion = [1 - inflacion_diaria]
+    else:
+        factores_inflacion = [1.0]
+
+    # Tramos entre periodos de rebalanceo y dinero que entra o sale de la cartera al empezar cada uno
+    calendario = calendario_por_defecto(calendario, balanceo, num_periodos, fase, fase_dinero)
+    inicios, finales = calendario.tramos()
+    flujos = np.concatenate(([0.0], calendario.flujos))
+
+    pesos = np.broadcast_to(np.asarray(pesos, dtype=float), (num_simulaciones, num_assets)).copy()
+    inversion_disponible = [np.full(num_simulaciones, float(inversion_inicial)) for _ in factores_inflacion]
+    dtype = tasa_de_cambio.dtype if dtype is None else np.dtype(dtype)
+    rentabilidad_total_periodo = [np.empty((num_simulaciones, num_periodos), dtype=dtype) for _ in factores_inflacion]
+
+    for inicio, final, flujo in zip(inicios, finales, flujos):
+
+        crecimiento = tasa_de_cambio[:, :, inicio:final] + 1
+
+        if inicio != 0:
+            # Modificar Pesos: (Cambio % activo + 1) * Rentabilidad Activo periodo anterior / Suma de todos los activos.
+            # La rentabilidad del periodo anterior es proporcional a (Cambio % anterior + 1) * Pesos, la escala se cancela
+            pesos = crecimiento[:, :, 0] * crecimiento_anterior * pesos
+            pesos /= pesos.sum(axis=1, keepdims=True)
+
+        # Crecimiento de la cartera en cada periodo del tramo, comun a la rentabilidad real y nominal
+        crecimiento_cartera = np.einsum('sat,sa->st', crecimiento, pesos)
+
+        for k, factor_inflacion in enumerate(factores_inflacion):
+
+            crecimiento_tipo = crecimiento_cartera * factor_inflacion if factor_inflacion != 1.0 else crecimiento_cartera
+            total = rentabilidad_total_periodo[k]
+
+            # El tramo se calcula en float64 y se copia a la rentabilidad por periodo si esta es de menor precision
+            en_sitio = dtype == np.float64
+            tramo = total[:, inicio:final] if en_sitio else np.empty((num_simulaciones, final - inicio))
+
+            if inicio != 0:
+                # En el periodo de rebalanceo se aplica el crecimiento y luego el retiro o ingreso de dinero
+                tramo[:, 0] = inversion_disponible[k] * crecimiento_tipo[:, 0]
+                disponible = tramo[:, 0] + flujo
+                tramo[:, 1:] = disponible[:, None] * np.cumprod(crecimiento_tipo[:, 1:], axis=1)
+            else:
+                tramo[:] = inversion_disponible[k][:, None] * np.cumprod(crecimiento_tipo, axis=1)
+
+            if not en_sitio:
+                total[:, inicio:final] = tramo
+
+            inversion_disponible[k] = tramo[:, -1].copy()
+
+        crecimiento_anterior = crecimiento[:, :, -1]
+
+    # Repartir el valor final de la cartera entre activos segun (Cambio % + 1) * Pesos del ultimo periodo
+    proporcion_final = crecimiento_anterior * pesos
+    proporcion_final /= proporcion_final.sum(axis=1, keepdims=True)
+
+    resultados = []
+    for total, disponible in zip(rentabilidad_total_periodo, inversion_disponible):
+        resultados.append(proporcion_final * disponible[:, None])
+        resultados.append(total)
+
+    return tuple(resultados)
@@ -0,0 +1,467 @@
+from scipy.special import ndtri
+import pandas as pd
+import numpy as np
+
+TIPOS_RENTABILIDAD = ("real", "nominal")
+
+# Percentiles por periodo y trayectorias de muestra por defecto en modo agregado
+PERCENTILES = (5, 25, 50, 75, 95)
+NUM_TRAYECTORIAS_MUESTRA = 10
+
+# Numero de intervalos del histograma por periodo del acumulador
+NUM_INTERVALOS = 256
+
+# Nivel de confianza por defecto de los intervalos
+CONFIANZA = 0.95
+
+
+def intervalo_probabilidad(exitos, num_simulaciones, confianza = CONFIANZA):
+
+    """
+    Intervalo de confianza de Wilson de una probabilidad estimada con num_simulaciones simulaciones
+
+    A diferencia del intervalo normal, no tiene amplitud cero cuando ninguna o todas las simulaciones son exitos.
+    Con muestreos de reduccion de varianza (src.muestreo) el intervalo es conservador.
+
+    Args:
+    - exitos: Numero de simulaciones favorables
+    - num_simulaciones: Numero de simulaciones
+    - confianza: Nivel de confianza
+
+    Returns:
+    - probabilidad, inferior, superior: estimacion y limites del intervalo, entre 0 y 1
+    """
+
+    z = ndtri((1 + confianza) / 2)
+    probabilidad = exitos / num_simulaciones
+
+    centro = (probabilidad + z**2 / (2 * num_simulaciones)) / (1 + z**2 / num_simulaciones)
+    semiamplitud = z * np.sqrt(probabilidad * (1 - probabilidad) / num_simulaciones + z**2 / (4 * num_simulaciones**2)) / (1 + z**2 / num_simulaciones)
+
+    return probabilidad, float(max(centro - semiamplitud, 0.0)), float(min(centro + semiamplitud, 1.0))
+
+
+def intervalo_media(valores, confianza = CONFIANZA):
+
+    """
+    Intervalo de confianza normal de la media de valores
+
+    Args:
+    - valores: array de valores
+    - confianza: Nivel de confianza
+
+    Returns:
+    - media, inferior, superior
+    """
+
+    varianza = float(np.var(valores, ddof=1)) if len(valores) > 1 else np.inf
+
+    return intervalo_media_momentos(len(valores), float(np.mean(valores)), varianza, confianza)
+
+
+def intervalo_media_momentos(num_simulaciones, media, varianza, confianza = CONFIANZA):
+
+    """
+    Intervalo de confianza normal de la media a partir del numero de valores, su media y su varianza muestral,
+    para intervalos sobre conteos acumulados sin guardar los valores
+
+    Returns:
+    - media, inferior, superior
+    """
+
+    z = ndtri((1 + confianza) / 2)
+    error = float(np.sqrt(varianza / num_simulaciones)) if num_simulaciones > 1 else np.inf
+
+    return media, media - z * error, media + z * error
+
+
+class AgregadoPorPeriodo:
+
+    """
+    Estadisticos por periodo de la rentabilidad de la cartera sobre todas las simulaciones
+
+    Args:
+    - num_simulaciones: Numero de simulaciones agregadas
+    - percentiles: Percentiles calculados
+    - media: array (periodos) con la media de cada periodo
+    - valores_percentiles: array (percentiles x periodos) con el valor de cada percentil en cada periodo
+    - minimo: array (periodos) con el minimo de cada periodo
+    - maximo: array (periodos) con el maximo de cada periodo
+    - muestras: array (trayectorias x periodos) con algunas trayectorias completas
+    - periodos: array con el periodo (base 1) de cada columna. Por defecto 1, 2, ..., num_periodos
+
+    """
+
+    __slots__ = ("num_simulaciones", "percentiles", "media", "valores_percentiles", "minimo", "maximo", "muestras", "periodos")
+
+    def __init__(self, num_simulaciones, percentiles, media, valores_percentiles, minimo, maximo, muestras, periodos = None):
+
+        self.num_simulaciones = num_simulaciones
+        self.percentiles = tuple(percentiles)
+        self.media = media
+        self.valores_percentiles = valores_percentiles
+        self.minimo = minimo
+        self.maximo = maximo
+        self.muestras = muestras
+        self.periodos = np.arange(1, media.shape[0] + 1) if periodos is None else np.asarray(periodos)
+
+    @property
+    def num_periodos(self):
+        return self.media.shape[0]
+
+    def percentil(self, percentil):
+
+        """
+        Valor del percentil en cada periodo, array (periodos)
+        """
+
+        return self.valores_percentiles[self.percentiles.index(percentil)]
+
+
+def agregar_por_periodo(rentabilidad_por_periodo, percentiles = PERCENTILES, num_trayectorias_muestra = NUM_TRAYECTORIAS_MUESTRA, periodos = None):
+
+    """
+    Calcula los estadisticos exactos por periodo a partir de todas las trayectorias
+
+    Args:
+    - rentabilidad_por_periodo: array (simulaciones x periodos) con la rentabilidad de la cartera en cada periodo
+    - percentiles: Percentiles a calcular
+    - num_trayectorias_muestra: Numero de trayectorias completas a guardar
+    - periodos: array con el periodo (base 1) de cada columna
+
+    Returns:
+    - agregado (AgregadoPorPeriodo)
+    """
+
+    return AgregadoPorPeriodo(num_simulaciones = rentabilidad_por_periodo.shape[0],
+                              percentiles = percentiles,
+                              media = rentabilidad_por_periodo.mean(axis=0),
+                              valores_percentiles = np.percentile(rentabilidad_por_periodo, percentiles, axis=0),
+                              minimo = rentabilidad_por_periodo.min(axis=0),
+                              maximo = rentabilidad_por_periodo.max(axis=0),
+                              muestras = rentabilidad_por_periodo[:num_trayectorias_muestra].copy(),
+                              periodos = periodos)
+
+
+class AcumuladorPorPeriodo:
+
+    """
+    Acumula los estadisticos por periodo lote a lote sin guardar todas las trayectorias
+
+    La media, el minimo y el maximo son exactos. Los percentiles se calculan a partir de un histograma por
+    periodo de NUM_INTERVALOS intervalos, cuyo rango inicial es el del primer lote (ampliado por un margen).
+    Si un lote posterior tiene valores fuera del rango, el histograma de ese periodo duplica el ancho de sus
+    intervalos sumando los conteos de cada par, hasta cubrirlos: ningun valor se recorta y el error de cada
+    percentil es del orden del ancho de un intervalo, aunque el primer lote tenga una sola simulacion. La
+    memoria es proporcional a periodos x NUM_INTERVALOS.
+
+    Args:
+    - num_periodos: Numero de periodos de cada trayectoria
+    - percentiles: Percentiles a calcular
+    - num_trayectorias_muestra: Numero de trayectorias completas a guardar (las primeras que llegan)
+    - num_intervalos: Numero de intervalos del histograma de cada periodo, par
+    - periodos: array con el periodo (base 1) de cada columna
+
+    Raises:
+    - ValueError: Si num_intervalos no es par
+
+    """
+
+    __slots__ = ("num_periodos", "percentiles", "num_trayectorias_muestra", "num_intervalos", "periodos",
+                 "num_simulaciones", "_suma", "_minimo", "_maximo", "_inferior", "_ancho", "_conteos", "_muestras")
+
+    def __init__(self, num_periodos, percentiles = PERCENTILES, num_trayectorias_muestra = NUM_TRAYECTORIAS_MUESTRA, num_intervalos = NUM_INTERVALOS, periodos = None):
+
+        if num_intervalos < 2 or num_intervalos % 2:
+            raise ValueError(f"El numero de intervalos debe ser par: {num_intervalos}")
+
+        self.num_periodos = num_periodos
+        self.periodos = periodos
+        self.percentiles = tuple(percentiles)
+        self.num_trayectorias_muestra = num_trayectorias_muestra
+        self.num_intervalos = num_intervalos
+
+        self.num_simulaciones = 0
+        self._suma = np.zeros(num_periodos)
+        self._minimo = np.full(num_periodos, np.inf)
+        self._maximo = np.full(num_periodos, -np.inf)
+        self._inferior = None
+        self._ancho = None
+        self._conteos = np.zeros(num_periodos * num_intervalos, dtype=np.int64)
+        self._muestras = []
+
+    def agregar(self, lote):
+
+        """
+        Agrega un lote de trayectorias, array (simulaciones x periodos)
+        """
+
+        lote = np.asarray(lote, dtype=float)
+
+        if self._inferior is None:
+            # Rango del histograma de cada periodo a partir del primer lote, con margen para los siguientes
+            minimo, maximo = lote.min(axis=0), lote.max(axis=0)
+            margen = 0.5 * (maximo - minimo) + 1e-9 * np.maximum(np.abs(maximo), 1.0)
+            self._inferior = minimo - margen
+            self._ancho = (maximo - minimo + 2 * margen) / self.num_intervalos
+
+        minimo, maximo = lote.min(axis=0), lote.max(axis=0)
+        self._ampliar(minimo, maximo)
+
+        self.num_simulaciones += lote.shape[0]
+        self._suma += lote.sum(axis=0)
+        np.minimum(self._minimo, minimo, out=self._minimo)
+        np.maximum(self._maximo, maximo, out=self._maximo)
+
+        # Intervalo de cada valor, desplazado por periodo para contar todos los periodos con un solo bincount.
+        # Despues de _ampliar solo se recortan los valores del borde superior del rango y los no finitos
+        intervalos = np.floor((lote - self._inferior) / self._ancho)
+        np.clip(intervalos, 0, self.num_intervalos - 1, out=intervalos)
+        intervalos = intervalos.astype(np.int64)
+        intervalos += np.arange(self.num_periodos) * self.num_intervalos
+        self._conteos += np.bincount(intervalos.ravel(), minlength=self._conteos.shape[0])
+
+        faltan = self.num_trayectorias_muestra - sum(len(m) for m in self._muestras)
+        if faltan > 0:
+            self._muestras.append(lote[:faltan].copy())
+
+    def _ampliar(self, minimo, maximo):
+
+        """
+        Duplica el ancho de los intervalos de los periodos cuyo rango no cubre [minimo, maximo] hasta cubrirlo
+
+        Cada duplicacion suma los conteos de cada par de intervalos consecutivos, por lo que no cambia en que
+        intervalo cae ningun valor ya contado. El rango crece hacia abajo si hay valores por debajo y si no
+        hacia arriba.
+        """
+
+        mitad = self.num_intervalos // 2
+        conteos = self._conteos.reshape(self.num_periodos, self.num_intervalos)
+
+        while True:
+            superior = self._inferior + self._ancho * self.num_intervalos
+            abajo = np.isfinite(minimo) & (minimo < self._inferior)
+            arriba = np.isfinite(maximo) & (maximo > superior)
+            filas = np.flatnonzero(abajo | arriba)
+            if not len(filas):
+                return
+
+            hacia_abajo = abajo[filas]
+            pares = conteos[filas].reshape(len(filas), mitad, 2).sum(axis=2)
+
+            # Hacia abajo los intervalos antiguos pasan a la mitad superior del nuevo rango, hacia arriba a la inferior
+            nuevos = np.zeros((len(filas), self.num_intervalos), dtype=np.int64)
+            nuevos[hacia_abajo, mitad:] = pares[hacia_abajo]
+            nuevos[~hacia_abajo, :mitad] = pares[~hacia_abajo]
+            conteos[filas] = nuevos
+
+            self._inferior[filas] -= np.where(hacia_abajo, self._ancho[filas] * self.num_intervalos, 0.0)
+            self._ancho[filas] *= 2
+
+    def resultado(self):
+
+        """
+        Estadisticos acumulados hasta el momento
+
+        Returns:
+        - agregado (AgregadoPorPeriodo)
+        """
+
+        conteos = self._conteos.reshape(self.num_periodos, self.num_intervalos)
+        acumulado = np.cumsum(conteos, axis=1)
+
+        valores_percentiles = np.empty((len(self.percentiles), self.num_periodos))
+        periodos = np.arange(self.num_periodos)
+
+        for k, percentil in enumerate(self.percentiles):
+            # Intervalo donde la frecuencia acumulada alcanza el percentil e interpolacion lineal dentro de el
+            objetivo = percentil / 100 * self.num_simulaciones
+            intervalo = np.minimum((acumulado < objetivo).sum(axis=1), self.num_intervalos - 1)
+            anterior = np.where(intervalo > 0, acumulado[periodos, np.maximum(intervalo - 1, 0)], 0)
+            fraccion = (objetivo - anterior) / np.maximum(conteos[periodos, intervalo], 1)
+            valores = self._inferior + (intervalo + fraccion) * self._ancho
+            valores_percentiles[k] = np.clip(valores, self._minimo, self._maximo)
+
+        if self._muestras:
+            muestras = np.concatenate(self._muestras)
+        else:
+            muestras = np.empty((0, self.num_periodos))
+
+        return AgregadoPorPeriodo(num_simulaciones = self.num_simulaciones,
+                                  percentiles = self.percentiles,
+                                  media = self._suma / max(self.num_simulaciones, 1),
+                                  valores_percentiles = valores_percentiles,
+                                  minimo = self._minimo.copy(),
+                                  maximo = self._maximo.copy(),
+                                  muestras = muestras,
+                                  periodos = self.periodos)
+
+
+def _array_float(valores):
+
+    """
+    Array contiguo de valores en float32 si ya lo es, o en float64 en otro caso. None se mantiene
+    """
+
+    if valores is None:
+        return None
+
+    dtype = np.float32 if getattr(valores, "dtype", None) == np.float32 else float
+
+    return np.ascontiguousarray(valores, dtype=dtype)
+
+
+class SimulationResult:
+
+    """
+    Resultado de run_multiple_simulations respaldado por arrays contiguos de NumPy
+
+    Guarda un float por valor, sin objetos de Python por elemento. Los metodos devuelven vistas de los
+    arrays guardados (sin copiar) salvo los que construyen un DataFrame para mostrar o exportar.
+
+    En modo agregado no se guarda la rentabilidad por periodo de cada simulacion, solo sus estadisticos
+    por periodo (AgregadoPorPeriodo).
+
+    Args:
+    - activos: Lista de activos de la cartera
+    - rentabilidad_total: array (simulaciones x activos) con la rentabilidad real de cada activo al final del periodo
+    - rentabilidad_por_periodo: array (simulaciones x periodos) con la rentabilidad real de la cartera en cada periodo
+    - rentabilidad_total_nominal: igual que rentabilidad_total, sin considerar la inflacion
+    - rentabilidad_por_periodo_nominal: igual que rentabilidad_por_periodo, sin considerar la inflacion
+    - agregado_por_periodo: AgregadoPorPeriodo de la rentabilidad real, si no se guarda rentabilidad_por_periodo
+    - agregado_por_periodo_nominal: AgregadoPorPeriodo de la rentabilidad nominal, si no se guarda rentabilidad_por_periodo_nominal
+    - convergencia (dict): En simulaciones adaptativas, simulaciones usadas, intervalos alcanzados y motivo de parada
+    - periodos: array con el periodo (base 1) de cada columna de la rentabilidad por periodo. Por defecto 1, 2, ..., num_periodos
+
+    """
+
+    __slots__ = ("activos", "_rentabilidad_total", "_rentabilidad_por_periodo", "_agregado_por_periodo", "convergencia", "periodos")
+
+    def __init__(self, activos, rentabilidad_total, rentabilidad_por_periodo, rentabilidad_total_nominal, rentabilidad_por_periodo_nominal,
+                 agregado_por_periodo = None, agregado_por_periodo_nominal = None, convergencia = None, periodos = None):
+
+        self.activos = list(activos)
+
+        # Solo se copia si el array no es contiguo o no es float. La rentabilidad por periodo conserva float32
+        self._rentabilidad_total = {"real": np.ascontiguousarray(rentabilidad_total, dtype=float),
+                                    "nominal": np.ascontiguousarray(rentabilidad_total_nominal, dtype=float)}
+        self._rentabilidad_por_periodo = {"real": _array_float(rentabilidad_por_periodo),
+                                          "nominal": _array_float(rentabilidad_por_periodo_nominal)}
+        self._agregado_por_periodo = {"real": agregado_por_periodo,
+                                      "nominal": agregado_por_periodo_nominal}
+        self.convergencia = convergencia
+
+        if periodos is None:
+            num_periodos = agregado_por_periodo.num_periodos if rentabilidad_por_periodo is None else np.shape(rentabilidad_por_periodo)[1]
+            periodos = np.arange(1, num_periodos + 1)
+        self.periodos = np.asarray(periodos)
+
+    def __iter__(self):
+
+        # Permite desempaquetar el resultado como las cuatro listas que devolvia run_multiple_simulations
+        yield self._rentabilidad_total["real"]
+        yield self._rentabilidad_por_periodo["real"]
+        yield self._rentabilidad_total["nominal"]
+        yield self._rentabilidad_por_periodo["nominal"]
+
+    @property
+    def num_simulaciones(self):
+        return self._rentabilidad_total["real"].shape[0]
+
+    @property
+    def agregado(self):
+        return self._rentabilidad_por_periodo["real"] is None
+
+    @property
+    def num_periodos(self):
+        return len(self.periodos)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self._rentabilidad_total.values()) + sum(a.nbytes for a in self._rentabilidad_por_periodo.values() if a is not None)
+
+    def rentabilidad_final(self, tipo_rentabilidad = "real"):
+
+        """
+        Rentabilidad de cada activo al final del periodo, array (simulaciones x activos). Vista sin copia
+        """
+
+        return self._rentabilidad_total[tipo_rentabilidad]
+
+    def rentabilidad_por_periodo(self, tipo_rentabilidad = "real"):
+
+        """
+        Rentabilidad de la cartera en cada periodo, array (simulaciones x periodos). Vista sin copia.
+        None en modo agregado
+        """
+
+        return self._rentabilidad_por_periodo[tipo_rentabilidad]
+
+    def agregado_por_periodo(self, tipo_rentabilidad = "real", percentiles = PERCENTILES, num_trayectorias_muestra = NUM_TRAYECTORIAS_MUESTRA):
+
+        """
+        Estadisticos por periodo de la rentabilidad de la cartera (AgregadoPorPeriodo). En modo completo se
+        calculan de forma exacta a partir de todas las trayectorias
+        """
+
+        if self.agregado:
+            return self._agregado_por_periodo[tipo_rentabilidad]
+
+        return agregar_por_periodo(self._rentabilidad_por_periodo[tipo_rentabilidad], percentiles, num_trayectorias_muestra, self.periodos)
+
+    def rentabilidad_iteracion(self, tipo_rentabilidad = "real"):
+
+        """
+        Rentabilidad total de la cartera al final del periodo en cada simulacion, array (simulaciones)
+        """
+
+        return self._rentabilidad_total[tipo_rentabilidad].sum(axis=1)
+
+    def probabilidad_objetivo(self, rentabilidad_objetivo, tipo_rentabilidad = "real"):
+
+        """
+        Porcentaje de simulaciones en las que la rentabilidad total supera la rentabilidad objetivo
+        """
+
+        return (self.rentabilidad_iteracion(tipo_rentabilidad) > rentabilidad_objetivo).mean() * 100
+
+    def intervalo_probabilidad_objetivo(self, rentabilidad_objetivo, tipo_rentabilidad = "real", confianza = CONFIANZA):
+
+        """
+        Intervalo de confianza, en porcentaje, de la probabilidad de superar la rentabilidad objetivo
+        """
+
+        exitos = int((self.rentabilidad_iteracion(tipo_rentabilidad) > rentabilidad_objetivo).sum())
+        probabilidad, inferior, superior = intervalo_probabilidad(exitos, self.num_simulaciones, confianza)
+
+        return inferior * 100, superior * 100
+
+    def rentabilidad_final_por_activo_por_simulacion(self, tipo_rentabilidad = "real"):
+
+        """
+        Data Frame con la rentabilidad final de cada activo por simulacion y la columna rentabilidad_iteracion
+        con la rentabilidad total, en el formato que esperan los graficos de src.plots
+        """
+
+        rentabilidad_final_por_activo_por_simulacion = pd.DataFrame(self._rentabilidad_total[tipo_rentabilidad], columns = self.activos)
+        rentabilidad_final_por_activo_por_simulacion['rentabilidad_iteracion'] = self.rentabilidad_iteracion(tipo_rentabilidad)
+
+        return rentabilidad_final_por_activo_por_simulacion
+
+    def resumen(self, tipo_rentabilidad = "real"):
+
+        """
+        Data Frame con la media, desviacion, mejor y peor iteracion de cada activo y de la rentabilidad total
+        """
+
+        rentabilidad_final = self._rentabilidad_total[tipo_rentabilidad]
+        rentabilidad_iteracion = self.rentabilidad_iteracion(tipo_rentabilidad)
+
+        valores = np.column_stack((rentabilidad_final, rentabilidad_iteracion))
+
+        return pd.DataFrame({
+            'Rent. Media': valores.mean(axis=0),
+            'Desv.': valores.std(axis=0, ddof=1),
+            'Mejor Iter.': valores.max(axis=0),
+            'Peor Iter.': valores.min(axis=0)
+            }, index = self.activos + ["Rentabilidad Total"])
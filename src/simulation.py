@@ -1,8 +1,34 @@
-from src.rentabilidad import rentabilidad_cartera_rebalanceo_inflacion
-from src.rentabilidad import compute_cambio_porcentual_por_activo
+from src.rentabilidad import rentabilidad_cartera_rebalanceo_inflacion_vectorizada
+from src.rentabilidad import compute_cambio_porcentual_cubo
+from src.rentabilidad import get_periodos_rebalanceo
+from src.calendario import calendario_por_defecto
+from src.muestreo import generar_shocks, MUESTREOS
+from src.resultados import SimulationResult, AcumuladorPorPeriodo, PERCENTILES, NUM_TRAYECTORIAS_MUESTRA, NUM_INTERVALOS
+from src.resultados import intervalo_probabilidad, intervalo_media_momentos, CONFIANZA
+from src.instrumentacion import Instrumentacion, medir_etapa
+from src.almacen import AlmacenResultados, semilla_guardada
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import pandas as pd
 import numpy as np
+import logging
 import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Simulaciones por lote. Cada lote es la unidad de trabajo de un proceso y recibe su propio generador
+TAMANO_LOTE = 1000
+
+# Tipo de los cubos de trayectorias y de la rentabilidad por periodo. Las rentabilidades finales siempre son float64
+PRECISIONES = {"float64": np.float64, "float32": np.float32}
+
+# Cubos (simulaciones x activos x periodos) vivos a la vez en el peor momento de un lote del motor diario:
+# shocks, incrementos, factores de crecimiento y trayectorias
+CUBOS_POR_LOTE = 4
+
+# Memoria maxima por defecto de una simulacion en la app
+MEMORIA_MAXIMA = 2 * 2**30
 
 def metricas_para_simulacion(df_consolidado):
     
@@ -36,6 +62,55 @@ def metricas_para_simulacion(df_consolidado):
     
     return metricas
 
+
+def cholesky_para_simulacion(df_consolidado):
+
+    """
+    Calcula el factor de Cholesky de la correlacion de los rendimientos diarios de los activos
+
+    Args:
+        df_cosolidado (data.frane): Data Frame con la serie temportal de los precios de las acciones
+
+    Returns:
+        cholesky: array (activos x activos) triangular inferior L con L @ L.T igual a la matriz de correlacion
+    """
+
+    rendimiento_diario = df_consolidado.pct_change()
+    correlacion = rendimiento_diario.corr().to_numpy()
+
+    # Activos sin suficientes datos: sin correlacion con el resto
+    correlacion = np.nan_to_num(correlacion, nan=0.0)
+    np.fill_diagonal(correlacion, 1.0)
+
+    # La correlacion por pares puede no ser definida positiva si hay datos faltantes: se recortan los autovalores
+    autovalores, autovectores = np.linalg.eigh(correlacion)
+    if autovalores.min() <= 1e-10:
+        correlacion = autovectores @ np.diag(np.maximum(autovalores, 1e-10)) @ autovectores.T
+        escala = np.sqrt(np.diag(correlacion))
+        correlacion = correlacion / np.outer(escala, escala)
+
+    return np.linalg.cholesky(correlacion)
+
+
+def correlacionar_shocks(shocks, cholesky):
+
+    """
+    Aplica la correlacion entre activos a los shocks con una sola multiplicacion matricial sobre todo el cubo
+
+    Args:
+    - shocks: array (simulaciones x activos x pasos) de normales estandar independientes
+    - cholesky: array (activos x activos) con el factor de Cholesky de la correlacion, o None para no correlacionar
+
+    Returns:
+    - shocks: array (simulaciones x activos x pasos) de normales estandar con la correlacion indicada
+    """
+
+    if cholesky is None:
+        return shocks
+
+    # En el tipo de los shocks, para no convertir un cubo float32 en float64
+    return np.matmul(cholesky.astype(shocks.dtype, copy = False), shocks)
+
 def geometric_brownian_motion(T, mu, sigma, S0, dt, num_assets):
     """
     Genera una trayectoria de Geometric Brownian Motion.
@@ -68,10 +143,595 @@ def geometric_brownian_motion(T, mu, sigma, S0, dt, num_assets):
     return t, S
 
 
-def run_multiple_simulations(df_consolidado, T, activos_seleccionados, inversion_inicial, distribucion_cartera, num_simulaciones, balanceo, fase, fase_dinero, inflacion):
+def geometric_brownian_motion_batch(T, mu, sigma, S0, dt, num_assets, num_simulaciones, generador = None, shocks = None, dtype = np.float64):
+    """
+    Genera todas las trayectorias de Geometric Brownian Motion en una sola llamada vectorizada.
+
+    Usa el mismo esquema de Euler que geometric_brownian_motion, pero sustituye el loop por
+    paso de tiempo por un producto acumulado de los factores de crecimiento diarios. Con el
+    mismo estado de np.random produce las mismas trayectorias que llamar a
+    geometric_brownian_motion num_simulaciones veces seguidas.
+
+    Args:
+    - T: tiempo total de simulación
+    - mu: tasa de rendimiento esperada (escalar o un valor por activo)
+    - sigma: volatilidad (escalar o un valor por activo)
+    - S0: precio inicial de cada activo
+    - dt: paso de tiempo
+    - num_assets: numero de activos
+    - num_simulaciones: numero de simulaciones
+    - generador (np.random.Generator): generador de numeros aleatorios. Si es None se usa el estado global de np.random
+    - shocks: array (simulaciones x activos x pasos - 1) de normales estandar ya generadas (ver src.muestreo). Si es None se generan
+    - dtype: Tipo de las trayectorias, np.float64 o np.float32 (la mitad de memoria)
+
+    Returns:
+    - t: array de tiempos
+    - S: array (simulaciones x activos x pasos) con el precio generado mediante GBM
+    """
+    num_steps = int(T / dt) + 1
+    t = np.linspace(0, T, num_steps)
+
+    # Mismo orden de extraccion que el loop: simulacion, activo, paso
+    if shocks is None:
+        W = (generador if generador is not None else np.random).standard_normal(size=(num_simulaciones, num_assets, num_steps - 1))
+    else:
+        W = shocks
+    dW = W.astype(dtype, copy = False) * dtype(np.sqrt(dt))
+
+    # Los parametros se convierten al tipo de las trayectorias para que los cubos no pasen a float64
+    mu = np.reshape(np.asarray(mu, dtype=dtype), (1, -1, 1)) if np.ndim(mu) else dtype(mu)
+    sigma = np.reshape(np.asarray(sigma, dtype=dtype), (1, -1, 1)) if np.ndim(sigma) else dtype(sigma)
+    S0 = np.broadcast_to(np.asarray(S0, dtype=dtype), (num_assets,))
+
+    # S_i = S_{i-1} * (1 + mu*dt + sigma*dW_i)  =>  S_i = S0 * prod(factores)
+    factores = 1 + mu * dtype(dt) + sigma * dW
+
+    S = np.empty((num_simulaciones, num_assets, num_steps), dtype=dtype)
+    S[:, :, 0] = S0
+    np.cumprod(factores, axis=2, out=S[:, :, 1:])
+    S[:, :, 1:] *= S0[None, :, None]
+
+    return t, S
+
+
+def plan_eventos(num_periodos, balanceo, calendario = None):
+
+    """
+    Calcula los pasos de la simulacion sobre la malla de eventos
+
+    Solo se simulan dia a dia los periodos de rebalanceo, el periodo anterior a cada uno (sus cambios
+    porcentuales definen los nuevos pesos) y el ultimo periodo (reparte el valor final entre activos).
+    Los dias entre ellos se agrupan en un solo paso.
+
+    Args:
+    - num_periodos: Numero de periodos de la simulacion diaria
+    - balanceo: Cada cuanto aplicar rebalanceo
+    - calendario (CalendarioEventos): Periodos de rebalanceo. Si es None se usan los de balanceo
+
+    Returns:
+    - periodos: array con los periodos (base 1) en los que se registra la rentabilidad: el primero y cada dia simulado
+    - pasos: lista de (dias, es_dia, es_rebalanceo) con cada paso de la malla
+    """
+
+    if calendario is None:
+        periodos_rebalanceo = set(get_periodos_rebalanceo(balanceo, num_periodos).tolist())
+    else:
+        periodos_rebalanceo = set(calendario.periodos_rebalanceo.tolist())
+
+    dias = set(periodos_rebalanceo) | {i - 1 for i in periodos_rebalanceo} | {num_periodos - 1}
+    dias = sorted(dias - {0})
+
+    pasos = []
+    anterior = 0
+    for dia in dias:
+        if dia - anterior > 1:
+            pasos.append((dia - anterior - 1, False, False))
+        pasos.append((1, True, dia in periodos_rebalanceo))
+        anterior = dia
+
+    periodos = np.array([0] + dias) + 1
+
+    return periodos, pasos
+
+
+def generar_shocks_eventos(parametros, num_simulaciones, calendario, generador = None):
+
+    """
+    Genera los shocks correlacionados de cada paso de la malla de eventos (ver plan_eventos)
+
+    Solo dependen de los parametros del mercado y de los periodos de rebalanceo, no de la cartera, la
+    inflacion ni los flujos: se pueden generar una vez y valorar sobre ellos varias carteras con
+    simular_cartera_eventos. Con el mismo generador son los que genera simular_cartera_eventos sin shocks.
+
+    Args:
+    - parametros (dict): Parametros del mercado (ver parametros_mercado)
+    - num_simulaciones: Numero de simulaciones
+    - calendario (CalendarioEventos): Periodos de rebalanceo
+    - generador (np.random.Generator): Generador de numeros aleatorios. Si es None se usa el estado global de np.random
+
+    Returns:
+    - shocks: array (simulaciones x activos x pasos de la malla) en float64
+    """
+
+    pasos = plan_eventos(calendario.num_periodos, None, calendario)[1]
+    shocks = generar_shocks(num_simulaciones, parametros["num_assets"], len(pasos), muestreo = parametros["muestreo"], generador = generador,
+                            duraciones = [dias for dias, _, _ in pasos])
+
+    return correlacionar_shocks(shocks, parametros["cholesky"])
+
+
+def simular_cartera_eventos(T, mu, sigma, dt, num_simulaciones, inversion_inicial, pesos, balanceo, fase, fase_dinero, inflacion,
+                            generador = None, muestreo = "estandar", cholesky = None, calendario = None, shocks = None):
+
+    """
+    Simula la cartera saltando directamente entre fechas de rebalanceo con la transicion exacta del GBM
+
+    Reproduce la logica de rentabilidad_cartera_rebalanceo_inflacion sin generar cada dia: entre eventos la
+    cartera mantiene pesos constantes, por lo que su valor es a su vez un GBM con tendencia pesos·mu y
+    varianza (pesos*sigma)' C (pesos*sigma), con C la correlacion, y se avanza con un solo paso lognormal exacto. Solo los dias cuyo
+    cambio porcentual por activo hace falta (rebalanceo, dia anterior y ultimo dia) se simulan por activo.
+    El numero de shocks pasa de un por dia a unos tres por rebalanceo.
+
+    Args:
+    - T: tiempo total de simulación
+    - mu: tasa de rendimiento esperada (escalar o un valor por activo)
+    - sigma: volatilidad (escalar o un valor por activo)
+    - dt: paso de tiempo de un dia
+    - num_simulaciones: numero de simulaciones
+    - inversion_inicial: Inversion Inicial
+    - pesos: lista de pesos iniciales para cada Activo
+    - balanceo: Cada cuanto aplicar rebalanceo
+    - fase: Fase en la que se encuentra, Acumulacion o Distribucion
+    - fase_dinero: Dinero que desea retirar o invertir en cada periodo
+    - inflacion: Inflacion anual
+    - generador (np.random.Generator): generador de numeros aleatorios. Si es None se usa el estado global de np.random
+    - muestreo: Esquema de muestreo de los shocks de cada paso (ver src.muestreo.generar_shocks)
+    - cholesky: Factor de Cholesky de la correlacion entre activos (ver cholesky_para_simulacion), o None para activos independientes
+    - calendario (CalendarioEventos): Periodos de rebalanceo y flujo de cada uno. Si es None se construye a partir de balanceo, fase y fase_dinero
+    - shocks: array (simulaciones x activos x pasos) con los shocks ya correlacionados de generar_shocks_eventos. Si es None
+      se generan con generador, muestreo y cholesky
+
+    Returns:
+    - rentabilidad_total, rentabilidad_por_periodo, rentabilidad_total_nominal, rentabilidad_por_periodo_nominal, con la
+      rentabilidad por periodo solo en los periodos de plan_eventos
+    """
+
+    num_assets = len(pesos)
+    num_periodos = int(T / dt) + 1
+    calendario = calendario_por_defecto(calendario, balanceo, num_periodos, fase, fase_dinero)
+    periodos, pasos = plan_eventos(num_periodos, balanceo, calendario)
+
+    mu = np.broadcast_to(np.asarray(mu, dtype=float), (num_assets,))
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), (num_assets,))
+
+    # Inflacion diaria y dinero que entra o sale en cada rebalanceo, igual que en la valoracion diaria
+    inflacion_diaria = (inflacion/365)/100
+    factores_inflacion = [1 - inflacion_diaria, 1.0]
+    flujos = iter(calendario.flujos)
+
+    if shocks is None:
+        shocks = generar_shocks(num_simulaciones, num_assets, len(pasos), muestreo = muestreo, generador = generador,
+                                duraciones = [dias for dias, _, _ in pasos])
+        shocks = correlacionar_shocks(shocks, cholesky)
+    cholesky = np.eye(num_assets) if cholesky is None else cholesky
+
+    pesos = np.broadcast_to(np.asarray(pesos, dtype=float), (num_simulaciones, num_assets)).copy()
+    crecimiento_anterior = np.ones((num_simulaciones, num_assets))
+
+    # El primer periodo no tiene cambio porcentual
+    rentabilidad_por_periodo = [np.empty((num_simulaciones, len(periodos))) for _ in factores_inflacion]
+    inversion_disponible = []
+    for k, factor_inflacion in enumerate(factores_inflacion):
+        rentabilidad_por_periodo[k][:, 0] = inversion_inicial * pesos.sum(axis=1) * factor_inflacion
+        inversion_disponible.append(rentabilidad_por_periodo[k][:, 0].copy())
+
+    columna = 1
+    for paso, (dias, es_dia, es_rebalanceo) in enumerate(pasos):
+
+        Z = shocks[:, :, paso]
+
+        if not es_dia:
+            # Varios dias con pesos constantes: un solo paso lognormal de la cartera
+            volatilidad_cartera = pesos * sigma
+            tendencia = (pesos * mu).sum(axis=1) - 0.5 * ((volatilidad_cartera @ cholesky) ** 2).sum(axis=1)
+            crecimiento_cartera = np.exp(tendencia * dias * dt + np.sqrt(dias * dt) * (volatilidad_cartera * Z).sum(axis=1))
+
+            for k, factor_inflacion in enumerate(factores_inflacion):
+                inversion_disponible[k] *= crecimiento_cartera * factor_inflacion ** dias
+            continue
+
+        # Un dia simulado por activo
+        crecimiento = np.exp((mu - 0.5 * sigma ** 2) * dt + sigma * np.sqrt(dt) * Z)
+
+        if es_rebalanceo:
+            pesos = crecimiento * crecimiento_anterior * pesos
+            pesos /= pesos.sum(axis=1, keepdims=True)
+
+        crecimiento_cartera = (crecimiento * pesos).sum(axis=1)
+        flujo = next(flujos) if es_rebalanceo else 0.0
+
+        for k, factor_inflacion in enumerate(factores_inflacion):
+            total = inversion_disponible[k] * crecimiento_cartera * factor_inflacion
+            rentabilidad_por_periodo[k][:, columna] = total
+            inversion_disponible[k] = total + flujo if es_rebalanceo else total
+
+        crecimiento_anterior = crecimiento
+        columna += 1
+
+    # Repartir el valor final de la cartera entre activos segun (Cambio % + 1) * Pesos del ultimo periodo
+    proporcion_final = crecimiento_anterior * pesos
+    proporcion_final /= proporcion_final.sum(axis=1, keepdims=True)
+
+    return (proporcion_final * rentabilidad_por_periodo[0][:, -1][:, None], rentabilidad_por_periodo[0],
+            proporcion_final * rentabilidad_por_periodo[1][:, -1][:, None], rentabilidad_por_periodo[1])
+
+
+def estimar_memoria(num_simulaciones, num_assets, num_periodos, modo = "completo", tamano_lote = TAMANO_LOTE, precision = "float64",
+                    motor = "diario", balanceo = None, num_procesos = 1, num_trayectorias_muestra = NUM_TRAYECTORIAS_MUESTRA):
+
+    """
+    Estima la memoria que necesita run_multiple_simulations antes de ejecutarla
+
+    Args:
+    - num_simulaciones, num_assets, modo, tamano_lote, precision, motor, balanceo, num_procesos, num_trayectorias_muestra: ver run_multiple_simulations
+    - num_periodos: Numero de periodos de la simulacion diaria, int(T / dt) + 1
+
+    Returns:
+    - memoria (dict): bytes de los lotes en curso ("lote"), del resultado ("resultado") y su suma ("total")
+    """
+
+    bytes_valor = np.dtype(PRECISIONES[precision]).itemsize
+    tamano_lote = min(tamano_lote, num_simulaciones)
+
+    if motor == "eventos":
+        periodos, pasos = plan_eventos(num_periodos, balanceo)
+        num_registrados = len(periodos)
+        # Shocks y crecimiento de cada paso de la malla, en float64
+        por_simulacion = 2 * num_assets * len(pasos) * 8 + 2 * num_registrados * 8
+    else:
+        num_registrados = num_periodos
+        # Cubos de la generacion y rentabilidad real y nominal por periodo del lote
+        por_simulacion = CUBOS_POR_LOTE * num_assets * num_periodos * bytes_valor + 2 * num_periodos * bytes_valor
+
+    # Cada proceso tiene un lote en curso
+    memoria_lote = por_simulacion * tamano_lote * max(1, num_procesos)
+
+    # Rentabilidad final real y nominal de cada activo, siempre en float64
+    memoria_resultado = 2 * num_simulaciones * num_assets * 8
+
+    if modo == "completo":
+        memoria_resultado += 2 * num_simulaciones * num_registrados * bytes_valor
+    else:
+        memoria_resultado += 2 * num_registrados * (NUM_INTERVALOS + num_trayectorias_muestra + 3) * 8
+
+    return {"lote": memoria_lote, "resultado": memoria_resultado, "total": memoria_lote + memoria_resultado}
+
+
+def _ajustar_a_memoria(memoria_maxima, si_excede_memoria, num_simulaciones, num_assets, num_periodos, modo, tamano_lote, precision, motor,
+                       balanceo, num_procesos, num_trayectorias_muestra):
+
+    """
+    Comprueba que la simulacion cabe en memoria_maxima y, si no cabe y si_excede_memoria es "agregado", pasa a modo
+    agregado y reduce el tamano de lote hasta que quepa
+
+    Returns:
+    - modo, tamano_lote con los que se debe simular
+
+    Raises:
+    - MemoryError: Si la simulacion no cabe en memoria_maxima
+    """
+
+    argumentos = dict(num_simulaciones = num_simulaciones, num_assets = num_assets, num_periodos = num_periodos, precision = precision,
+                      motor = motor, balanceo = balanceo, num_procesos = num_procesos, num_trayectorias_muestra = num_trayectorias_muestra)
+
+    memoria = estimar_memoria(modo = modo, tamano_lote = tamano_lote, **argumentos)["total"]
+
+    if memoria > memoria_maxima and si_excede_memoria == "agregado":
+
+        if modo == "completo":
+            logger.warning("La simulacion necesita %.0f MiB, mas que el maximo de %.0f MiB: se pasa a modo agregado",
+                           memoria / 2**20, memoria_maxima / 2**20)
+            modo = "agregado"
+            memoria = estimar_memoria(modo = modo, tamano_lote = tamano_lote, **argumentos)["total"]
+
+        if memoria > memoria_maxima:
+            # Lote mas grande que quepa junto al resultado
+            estimacion = estimar_memoria(modo = modo, tamano_lote = 1, **argumentos)
+            tamano_maximo = int((memoria_maxima - estimacion["resultado"]) // estimacion["lote"])
+
+            if tamano_maximo >= 1:
+                logger.warning("Se reduce el tamano de lote de %d a %d simulaciones para no superar %.0f MiB",
+                               tamano_lote, tamano_maximo, memoria_maxima / 2**20)
+                tamano_lote = tamano_maximo
+                memoria = estimar_memoria(modo = modo, tamano_lote = tamano_lote, **argumentos)["total"]
+
+    if memoria > memoria_maxima:
+        raise MemoryError(f"La simulacion necesita unos {memoria / 2**20:,.0f} MiB y el maximo es {memoria_maxima / 2**20:,.0f} MiB. "
+                          "Reduzca el numero de simulaciones, de activos o el periodo de simulacion")
+
+    return modo, tamano_lote
+
+
+def parametros_mercado(df_consolidado, T, num_assets, correlacion = True, muestreo = "estandar", precision = "float64"):
+
+    """
+    Parametros del GBM de los activos estimados de su historico, comunes a cualquier cartera sobre ellos
+
+    Args:
+    - df_cosolidado (data.frane): Data Frame con la serie temportal de los precios de las acciones
+    - T, correlacion, muestreo, precision: ver run_multiple_simulations
+    - num_assets: Numero de activos
+
+    Returns:
+    - parametros (dict): T, dt, mu y sigma anuales de cada activo, cholesky de la correlacion, S0, num_assets, muestreo y dtype
+    """
+
+    metricas = metricas_para_simulacion(df_consolidado)
+
+    return {"T": T,
+            # Rendimiento y volatilidad anuales de cada activo
+            "mu": (1 + np.asarray(metricas[0])) ** 365 - 1,
+            "sigma": np.asarray(metricas[1]) * math.sqrt(365),
+            "cholesky": cholesky_para_simulacion(df_consolidado) if correlacion and num_assets > 1 else None,
+            "S0": metricas[2],
+            "dt": 1/365,
+            "num_assets": num_assets,
+            "muestreo": muestreo,
+            "dtype": PRECISIONES[precision]}
+
+
+def generar_cambio_porcentual(parametros, num_simulaciones, generador = None):
+
+    """
+    Genera el cubo de cambios porcentuales diarios de los activos con el motor diario
+
+    Args:
+    - parametros (dict): Parametros del mercado (ver parametros_mercado)
+    - num_simulaciones: Numero de simulaciones
+    - generador (np.random.Generator): Generador de numeros aleatorios. Si es None se usa el estado global de np.random
+
+    Returns:
+    - cambio_porcentual_por_activo: array (simulaciones x activos x periodos) en el tipo parametros["dtype"]
+    """
+
+    num_pasos = int(parametros["T"] / parametros["dt"])
+
+    # Shocks del GBM segun el esquema de muestreo
+    shocks = generar_shocks(num_simulaciones = num_simulaciones,
+                            num_assets = parametros["num_assets"],
+                            num_pasos = num_pasos,
+                            muestreo = parametros["muestreo"],
+                            generador = generador,
+                            dtype = parametros["dtype"])
+
+    # Correlacion entre activos con una sola multiplicacion sobre todo el cubo de shocks
+    shocks = correlacionar_shocks(shocks, parametros["cholesky"])
+
+    t, S = geometric_brownian_motion_batch(T = parametros["T"],
+                                           mu = parametros["mu"],
+                                           sigma = parametros["sigma"],
+                                           S0 = parametros["S0"],
+                                           dt = parametros["dt"],
+                                           num_assets = parametros["num_assets"],
+                                           num_simulaciones = num_simulaciones,
+                                           shocks = shocks,
+                                           dtype = parametros["dtype"])
+    del shocks
+
+    # Calcular el cambio porcentual
+    return compute_cambio_porcentual_cubo(S = S)
+
+
+def _simular_lote(parametros, num_simulaciones, semilla = None, medir_memoria = None):
+
+    """
+    Simula un lote de trayectorias y calcula su rentabilidad real y nominal
+
+    Args:
+    - parametros (dict): Parametros de la simulacion calculados por run_multiple_simulations
+    - num_simulaciones: Numero de simulaciones del lote
+    - semilla (np.random.SeedSequence): Semilla del lote. Si es None se usa el estado global de np.random
+    - medir_memoria (bool): Si no es None se miden las etapas del lote (con o sin memoria pico) y se devuelven sus mediciones
+
+    Returns:
+    - rentabilidad_total, rentabilidad_por_periodo, rentabilidad_total_nominal, rentabilidad_por_periodo_nominal del lote
+    - etapas: Mediciones de las etapas del lote (ver Instrumentacion.etapas), solo si medir_memoria no es None
+    """
+
+    # Las mediciones se hacen en el proceso que simula el lote y se devuelven para combinarlas en el principal
+    instrumentacion = None if medir_memoria is None else Instrumentacion(medir_memoria)
+
+    resultado = _simular_lote_etapas(parametros, num_simulaciones, semilla, instrumentacion)
+
+    if instrumentacion is None:
+        return resultado
+
+    return resultado, instrumentacion.etapas
+
+
+def _simular_lote_etapas(parametros, num_simulaciones, semilla, instrumentacion):
+
+    """
+    Cuerpo de _simular_lote, con cada etapa medida en instrumentacion (si no es None)
+    """
+
+    generador = None if semilla is None else np.random.default_rng(semilla)
+
+    if parametros["motor"] == "eventos":
+        # Generacion y valoracion van juntas en el motor por eventos
+        with medir_etapa(instrumentacion, "simulacion_eventos", num_simulaciones):
+            return simular_cartera_eventos(T = parametros["T"],
+                                           mu = parametros["mu"],
+                                           sigma = parametros["sigma"],
+                                           dt = parametros["dt"],
+                                           num_simulaciones = num_simulaciones,
+                                           inversion_inicial = parametros["inversion_inicial"],
+                                           pesos = parametros["distribucion_cartera"],
+                                           balanceo = parametros["balanceo"],
+                                           fase = parametros["fase"],
+                                           fase_dinero = parametros["fase_dinero"],
+                                           inflacion = parametros["inflacion"],
+                                           generador = generador,
+                                           muestreo = parametros["muestreo"],
+                                           cholesky = parametros["cholesky"],
+                                           calendario = parametros["calendario"])
+
+    with medir_etapa(instrumentacion, "generacion", num_simulaciones):
+        cambio_porcentual_por_activo = generar_cambio_porcentual(parametros, num_simulaciones, generador)
+
+    # Calcular rentabilidad real y nominal en un solo recorrido
+    with medir_etapa(instrumentacion, "rebalanceo", num_simulaciones):
+        return rentabilidad_cartera_rebalanceo_inflacion_vectorizada(inversion_inicial = parametros["inversion_inicial"],
+                                                                     tasa_de_cambio = cambio_porcentual_por_activo,
+                                                                     pesos = parametros["distribucion_cartera"],
+                                                                     balanceo = parametros["balanceo"],
+                                                                     fase = parametros["fase"],
+                                                                     fase_dinero = parametros["fase_dinero"],
+                                                                     inflacion = parametros["inflacion"],
+                                                                     tipo_rentabilidad = "ambas",
+                                                                     calendario = parametros["calendario"])
+
+
+def _dividir_en_lotes(num_simulaciones, tamano_lote):
+
+    """
+    Divide num_simulaciones en lotes de como maximo tamano_lote simulaciones
+    """
+
+    tamano_lote = max(1, int(tamano_lote))
+    lotes = [tamano_lote] * (num_simulaciones // tamano_lote)
+
+    if num_simulaciones % tamano_lote:
+        lotes.append(num_simulaciones % tamano_lote)
+
+    return lotes
+
+
+def _acumular_convergencia(acumulado, rentabilidad_iteracion, rentabilidad_objetivo):
+
+    """
+    Suma un lote a los conteos de la rentabilidad total final de las simulaciones hechas hasta ahora
+
+    Cada lote solo recorre sus simulaciones: la media y la suma de cuadrados de las desviaciones se combinan
+    con las acumuladas (formula de Chan para varianzas por grupos).
+
+    Args:
+    - acumulado (dict): Conteos hasta ahora, o None si no hay ninguno
+    - rentabilidad_iteracion: array con la rentabilidad total final de cada simulacion del lote
+    - rentabilidad_objetivo: ver run_multiple_simulations
+
+    Returns:
+    - acumulado (dict): num_simulaciones, media, suma_cuadrados y exitos (simulaciones que superan rentabilidad_objetivo)
+    """
+
+    if acumulado is None:
+        acumulado = {"num_simulaciones": 0, "media": 0.0, "suma_cuadrados": 0.0, "exitos": 0}
+
+    num_lote = len(rentabilidad_iteracion)
+    if num_lote == 0:
+        return acumulado
+
+    media_lote = float(np.mean(rentabilidad_iteracion))
+    suma_cuadrados_lote = float(np.sum((rentabilidad_iteracion - media_lote) ** 2))
+    exitos_lote = int((rentabilidad_iteracion > rentabilidad_objetivo).sum()) if rentabilidad_objetivo is not None else 0
+
+    num_anterior = acumulado["num_simulaciones"]
+    num_simulaciones = num_anterior + num_lote
+    delta = media_lote - acumulado["media"]
+
+    return {"num_simulaciones": num_simulaciones,
+            "media": acumulado["media"] + delta * num_lote / num_simulaciones,
+            "suma_cuadrados": acumulado["suma_cuadrados"] + suma_cuadrados_lote + delta ** 2 * num_anterior * num_lote / num_simulaciones,
+            "exitos": acumulado["exitos"] + exitos_lote}
+
+
+def _evaluar_convergencia(acumulado, rentabilidad_objetivo, tolerancia, tolerancia_media, tiempo_maximo, tiempo, confianza):
+
+    """
+    Calcula los intervalos de confianza de las simulaciones hechas hasta ahora y si se debe parar
+
+    Args:
+    - acumulado (dict): Conteos de la rentabilidad total final de las simulaciones realizadas (ver _acumular_convergencia)
+    - rentabilidad_objetivo, tolerancia, tolerancia_media, tiempo_maximo, confianza: ver run_multiple_simulations
+    - tiempo: Segundos transcurridos
+
+    Returns:
+    - convergencia (dict): simulaciones, intervalos, tiempo y motivo de parada ("tolerancia", "tiempo" o None si se debe seguir)
+    """
+
+    num_simulaciones = acumulado["num_simulaciones"]
+    varianza = acumulado["suma_cuadrados"] / (num_simulaciones - 1) if num_simulaciones > 1 else np.inf
+
+    media, inferior_media, superior_media = intervalo_media_momentos(num_simulaciones, acumulado["media"], varianza, confianza)
+    semiamplitud_media = (superior_media - inferior_media) / 2
+
+    convergencia = {"num_simulaciones": num_simulaciones,
+                    "confianza": confianza,
+                    "media": media,
+                    "intervalo_media": (inferior_media, superior_media),
+                    "tiempo": tiempo,
+                    "motivo": None}
+
+    convergido = True
+
+    if tolerancia_media is not None:
+        convergido &= bool(semiamplitud_media <= tolerancia_media * abs(media))
+
+    if rentabilidad_objetivo is not None:
+        probabilidad, inferior, superior = intervalo_probabilidad(acumulado["exitos"], num_simulaciones, confianza)
+        convergencia["probabilidad"] = probabilidad * 100
+        convergencia["intervalo_probabilidad"] = (inferior * 100, superior * 100)
+
+        if tolerancia is not None:
+            convergido &= bool((superior - inferior) / 2 * 100 <= tolerancia)
+
+    if (tolerancia is not None and rentabilidad_objetivo is not None) or tolerancia_media is not None:
+        if convergido:
+            convergencia["motivo"] = "tolerancia"
+
+    if convergencia["motivo"] is None and tiempo_maximo is not None and tiempo >= tiempo_maximo:
+        convergencia["motivo"] = "tiempo"
+
+    return convergencia
+
+
+def run_multiple_simulations(df_consolidado, T, activos_seleccionados, inversion_inicial, distribucion_cartera, num_simulaciones, balanceo, fase, fase_dinero, inflacion,
+                             modo = "completo", tamano_lote = TAMANO_LOTE, percentiles = PERCENTILES, num_trayectorias_muestra = NUM_TRAYECTORIAS_MUESTRA,
+                             semilla = None, num_procesos = 1, muestreo = "estandar",
+                             rentabilidad_objetivo = None, tolerancia = None, tolerancia_media = None, tiempo_maximo = None, confianza = CONFIANZA,
+                             motor = "diario", correlacion = True, instrumentacion = None,
+                             precision = "float64", memoria_maxima = None, si_excede_memoria = "agregado", almacen = None, calendario = None,
+                             progreso = None, cancelar = None):
 
     """
     Corre multiples simulaciones y calcula la rentabilidad
+
+    Las simulaciones se procesan por lotes. En modo "completo" se guarda la rentabilidad de cada periodo de
+    cada simulacion. En modo "agregado" solo se guardan, para cada periodo, la media, los percentiles, el
+    minimo, el maximo y unas pocas trayectorias de muestra, por lo que la memoria no crece con el numero
+    de simulaciones.
+
+    Con una semilla, cada lote recibe un generador independiente derivado de ella, por lo que el resultado
+    es el mismo para una semilla, un numero de simulaciones y un tamano de lote dados, sin importar en
+    cuantos procesos se repartan los lotes.
+
+    Con tolerancia, tolerancia_media o tiempo_maximo la simulacion es adaptativa: num_simulaciones pasa a ser
+    el maximo y, despues de cada lote, se para si el intervalo de confianza de la probabilidad de superar
+    rentabilidad_objetivo y el de la rentabilidad media final ya son suficientemente estrechos, o si se
+    agoto el tiempo. El resultado incluye cuantas simulaciones se usaron y los intervalos alcanzados.
+
+    Con memoria_maxima, antes de simular se estima la memoria necesaria (ver estimar_memoria). Si no cabe, segun
+    si_excede_memoria se lanza MemoryError o se pasa a modo agregado y, si hace falta, se reducen los lotes
+    (lo que cambia el resultado para una semilla dada). resultado.agregado indica el modo usado.
+
+    Con almacen, el resultado se escribe lote a lote en un directorio en disco con memoria mapeada (ver
+    src.almacen.AlmacenResultados) en lugar de en memoria. Si el directorio ya contiene la misma simulacion
+    interrumpida, se continua desde el primer lote que falta: cada lote tiene su propia semilla, por lo que el
+    resultado es el mismo que sin interrupcion. Sin semilla se genera una y se guarda con los parametros.
+
+    Con progreso, despues de cada lote se llama a progreso(simulaciones_completadas, num_simulaciones, parcial), donde
+    parcial() construye el SimulationResult de los lotes ya terminados (sin copiar en modo completo). Con cancelar
+    (threading.Event), si se activa la simulacion se detiene antes del siguiente lote y devuelve las simulaciones hechas.
     
     Args:
     - df_consolidado:df_cosolidado (data.frane): Data Frame con la serie temportal de los precios de las acciones
@@ -84,68 +744,263 @@ def run_multiple_simulations(df_consolidado, T, activos_seleccionados, inversion
     - fase: Fase en la que se encuentra, Acumulacion o Distribucion
     - fase_dinero: Dinero que desea retirar o invertir en cada periodo
     - inflacion: inflacion anual
+    - modo: "completo" o "agregado"
+    - tamano_lote: Numero de simulaciones por lote
+    - percentiles: Percentiles por periodo que se calculan en modo agregado
+    - num_trayectorias_muestra: Numero de trayectorias completas que se guardan en modo agregado
+    - semilla (int): Semilla de los generadores de cada lote. Si es None y num_procesos es 1 se usa el estado global de np.random
+    - num_procesos (int): Numero de procesos entre los que se reparten los lotes
+    - muestreo: Esquema de muestreo de los shocks: estandar, antitetico, sobol o estratificado (ver src.muestreo.generar_shocks)
+    - rentabilidad_objetivo: Monto final objetivo para el criterio de parada de la probabilidad
+    - tolerancia: Semiamplitud maxima, en puntos porcentuales, del intervalo de confianza de la probabilidad de superar rentabilidad_objetivo,
+      que es obligatoria con tolerancia
+    - tolerancia_media: Semiamplitud maxima, relativa a la media, del intervalo de confianza de la rentabilidad media final
+    - tiempo_maximo: Segundos maximos de simulacion
+    - confianza: Nivel de confianza de los intervalos
+    - motor: "diario" simula cada dia con el esquema de Euler. "eventos" salta entre fechas de rebalanceo con la transicion
+      exacta del GBM (ver simular_cartera_eventos) y solo registra la rentabilidad en esas fechas
+    - correlacion (bool): Si es True los shocks de los activos tienen la correlacion de sus rendimientos historicos
+    - instrumentacion (Instrumentacion): Registro donde se miden las etapas metricas, generacion, rebalanceo (o simulacion_eventos)
+      y agregacion. Si es None no se mide nada
+    - precision: "float64" o "float32". Tipo de los cubos de trayectorias del motor diario y de la rentabilidad por periodo.
+      El valor de la cartera se acumula y las rentabilidades finales se guardan siempre en float64. Con la misma semilla
+      las dos precisiones simulan la misma muestra (ver src.muestreo._normales)
+    - memoria_maxima: Bytes maximos estimados de la simulacion, o None para no comprobarlo
+    - si_excede_memoria: "agregado" para pasar a modo agregado y reducir los lotes si no cabe, o "error" para lanzar MemoryError
+    - almacen (string): Directorio donde guardar o continuar la simulacion. Solo en modo completo. Sin semilla, una
+      simulacion guardada se continua con la semilla que tiene guardada
+    - calendario (CalendarioEventos): Periodos de rebalanceo y aporte o retiro de cada uno (ver src.calendario), por ejemplo
+      con fechas explicitas o aportes crecientes. Si es None se construye a partir de balanceo, fase y fase_dinero
+    - progreso: Funcion (simulaciones_completadas, num_simulaciones, parcial) que se llama despues de cada lote
+    - cancelar (threading.Event): Evento que detiene la simulacion entre lotes
 
     Returns:
-    - 
+    - resultado (SimulationResult): rentabilidad real y nominal de cada activo al final del periodo y de la cartera en cada periodo
 
     """
 
-    metricas = metricas_para_simulacion(df_consolidado)
-    print(metricas[0])
-    print(((1 + metricas[0][0]) ** 365 - 1))
+    if modo not in ("completo", "agregado"):
+        raise ValueError(f"Modo de simulacion no valido: {modo}")
+    if muestreo not in MUESTREOS:
+        raise ValueError(f"Esquema de muestreo no valido: {muestreo}")
+    if motor not in ("diario", "eventos"):
+        raise ValueError(f"Motor de simulacion no valido: {motor}")
+    if precision not in PRECISIONES:
+        raise ValueError(f"Precision no valida: {precision}")
+    if si_excede_memoria not in ("agregado", "error"):
+        raise ValueError(f"Opcion no valida si se excede la memoria: {si_excede_memoria}")
+    if almacen is not None and modo != "completo":
+        raise ValueError("Solo se puede guardar en disco una simulacion en modo completo")
+    if tolerancia is not None and rentabilidad_objetivo is None:
+        raise ValueError("La tolerancia de la probabilidad necesita rentabilidad_objetivo")
+
+    num_assets = len(activos_seleccionados)
+    dt = 1/365
+    num_periodos = int(T / dt) + 1
+
+    if memoria_maxima is not None:
+        # Con almacen la rentabilidad por periodo esta en disco: en memoria solo se cuentan los lotes, como en modo agregado
+        modo_memoria, tamano_lote = _ajustar_a_memoria(memoria_maxima, si_excede_memoria, num_simulaciones, num_assets, num_periodos,
+                                                       "agregado" if almacen is not None else modo, tamano_lote, precision, motor,
+                                                       balanceo, num_procesos, num_trayectorias_muestra)
+        if almacen is None:
+            modo = modo_memoria
+
+    # Calendario de eventos, construido una sola vez para todos los lotes
+    calendario = calendario_por_defecto(calendario, balanceo, num_periodos, fase, fase_dinero)
+
+    # Periodos (base 1) en los que se registra la rentabilidad
+    if motor == "eventos":
+        periodos = plan_eventos(num_periodos, balanceo, calendario)[0]
+    else:
+        periodos = np.arange(1, num_periodos + 1)
+
+    with medir_etapa(instrumentacion, "metricas"):
+        parametros = parametros_mercado(df_consolidado, T, num_assets, correlacion, muestreo, precision)
+
+    parametros.update({"inversion_inicial": inversion_inicial,
+                       "distribucion_cartera": distribucion_cartera,
+                       "balanceo": balanceo,
+                       "fase": fase,
+                       "fase_dinero": fase_dinero,
+                       "inflacion": inflacion,
+                       "motor": motor,
+                       "calendario": calendario})
+
+    lotes = _dividir_en_lotes(num_simulaciones, tamano_lote)
+
+    if almacen is not None:
+        # Semilla explicita para que la simulacion se pueda continuar con los mismos generadores por lote. Sin
+        # semilla se continua la simulacion guardada con la suya, o se genera una para una simulacion nueva
+        if semilla is None:
+            semilla = semilla_guardada(almacen)
+        if semilla is None:
+            semilla = np.random.SeedSequence().entropy
+
+        firma = {"T": T, "inversion_inicial": inversion_inicial, "distribucion_cartera": list(distribucion_cartera),
+                 "balanceo": balanceo, "fase": fase, "fase_dinero": fase_dinero, "inflacion": inflacion,
+                 "muestreo": muestreo, "motor": motor, "precision": precision, "correlacion": correlacion,
+                 "tamano_lote": tamano_lote, "semilla": semilla,
+                 "mu": parametros["mu"].tolist(), "sigma": parametros["sigma"].tolist(), "S0": list(parametros["S0"]),
+                 "periodos_rebalanceo": calendario.periodos_rebalanceo.tolist(), "flujos": calendario.flujos.tolist()}
+
+        almacen = AlmacenResultados.abrir_o_crear(almacen, firma, activos_seleccionados, num_simulaciones, periodos,
+                                                  dtype = PRECISIONES[precision])
+        lotes_completados = almacen.progreso["lotes_completados"]
+    else:
+        lotes_completados = 0
+
+    # Un generador independiente por lote, derivado de la semilla. Con varios procesos tambien sin semilla,
+    # para que los procesos no compartan el estado global de np.random
+    if semilla is not None or num_procesos > 1:
+        semillas = np.random.SeedSequence(semilla).spawn(len(lotes))
+    else:
+        semillas = [None] * len(lotes)
+
     # Rentabilidad Total
-    rentabilidad_total = []
-    rentabilidad_total_nominal = []
-
-    # Rentabilidad Todos los periodos
-    rentabilidad_por_periodo = []
-    rentabilidad_por_periodo_nominal = []
-
-    for i in range(num_simulaciones):
-
-        # Hacer Simulacion 
-        t, S = geometric_brownian_motion(T = T,
-                                         #mu = metricas[0],
-                                         mu = ((1 + metricas[0][0]) ** 365 - 1),
-                                         #sigma = metricas[1],
-                                         sigma = (metricas[1][0]) *  math.sqrt(365),
-                                         S0 = metricas[2],
-                                         dt = 1/365 ,
-                                         num_assets = len(activos_seleccionados))
-    
-        # Calcular el cambio porcentual
-        cambio_porcentual_por_activo = compute_cambio_porcentual_por_activo(S = S)
-    
-        # Calcular rentabilidad real
-        rentabilidad_cartera_n, rentabilidad_cartera_n_por_periodo = rentabilidad_cartera_rebalanceo_inflacion(inversion_disponible = [inversion_inicial],
-                                                                 tasa_de_cambio = cambio_porcentual_por_activo,
-                                                                 pesos = distribucion_cartera,
-                                                                 num_periodos = len(cambio_porcentual_por_activo[0]),
-                                                                 num_assets = len(cambio_porcentual_por_activo),
-                                                                 balanceo = balanceo,
-                                                                 fase = fase,
-                                                                 fase_dinero = fase_dinero,
-                                                                 inflacion = inflacion,
-                                                                 tipo_rentabilidad = "real")
-        
-        # Calcular rentabilidad nominal
-        rentabilidad_cartera_n_nominal, rentabilidad_cartera_n_por_periodo_nominal = rentabilidad_cartera_rebalanceo_inflacion(inversion_disponible = [inversion_inicial],
-                                                                 tasa_de_cambio = cambio_porcentual_por_activo,
-                                                                 pesos = distribucion_cartera,
-                                                                 num_periodos = len(cambio_porcentual_por_activo[0]),
-                                                                 num_assets = len(cambio_porcentual_por_activo),
-                                                                 balanceo = balanceo,
-                                                                 fase = fase,
-                                                                 fase_dinero = fase_dinero,
-                                                                 inflacion = inflacion,
-                                                                 tipo_rentabilidad = "nominal")        
-    
-        # Guardar Rentabilidad Total
-        rentabilidad_total.append(rentabilidad_cartera_n)
-        rentabilidad_total_nominal.append(rentabilidad_cartera_n_nominal)
+    if almacen is not None:
+        rentabilidad_total = almacen.rentabilidad_total("real")
+        rentabilidad_total_nominal = almacen.rentabilidad_total("nominal")
+    else:
+        rentabilidad_total = np.empty((num_simulaciones, num_assets))
+        rentabilidad_total_nominal = np.empty((num_simulaciones, num_assets))
+
+    # Rentabilidad Todos los periodos (con almacen se escribe directamente en disco)
+    if modo == "completo" and almacen is None:
+        rentabilidad_por_periodo = np.empty((num_simulaciones, len(periodos)), dtype = PRECISIONES[precision])
+        rentabilidad_por_periodo_nominal = np.empty((num_simulaciones, len(periodos)), dtype = PRECISIONES[precision])
+    elif modo == "agregado":
+        acumulador = AcumuladorPorPeriodo(len(periodos), percentiles, num_trayectorias_muestra, periodos = periodos)
+        acumulador_nominal = AcumuladorPorPeriodo(len(periodos), percentiles, num_trayectorias_muestra, periodos = periodos)
+
+    medir_memoria = None if instrumentacion is None else instrumentacion.medir_memoria
+
+    # Al continuar una simulacion guardada solo se simulan los lotes que faltan
+    inicio = sum(lotes[:lotes_completados])
+    lotes, semillas = lotes[lotes_completados:], semillas[lotes_completados:]
+
+    if num_procesos > 1:
+        executor = ProcessPoolExecutor(max_workers = num_procesos)
+        resultados_lotes = executor.map(_simular_lote, repeat(parametros), lotes, semillas, repeat(medir_memoria))
+    else:
+        executor = None
+        resultados_lotes = map(_simular_lote, repeat(parametros), lotes, semillas, repeat(medir_memoria))
+
+    adaptativo = tolerancia is not None or tolerancia_media is not None or tiempo_maximo is not None
+    tiempo_inicio = time.perf_counter()
+
+    # Conteos de la rentabilidad final de la cartera para el criterio de parada: cada lote solo añade los suyos.
+    # Al continuar una simulacion guardada se parte de las simulaciones ya escritas
+    acumulado = _acumular_convergencia(None, rentabilidad_total[:inicio].sum(axis=1), rentabilidad_objetivo) if adaptativo else None
+
+    def parcial(completadas):
+
+        # Resultado de las simulaciones completadas, sobre vistas de los arrays del resultado
+        if almacen is not None:
+            return almacen.resultado()
+        if modo == "completo":
+            return SimulationResult(activos = activos_seleccionados,
+                                    rentabilidad_total = rentabilidad_total[:completadas],
+                                    rentabilidad_por_periodo = rentabilidad_por_periodo[:completadas],
+                                    rentabilidad_total_nominal = rentabilidad_total_nominal[:completadas],
+                                    rentabilidad_por_periodo_nominal = rentabilidad_por_periodo_nominal[:completadas],
+                                    periodos = periodos)
+        return SimulationResult(activos = activos_seleccionados,
+                                rentabilidad_total = rentabilidad_total[:completadas],
+                                rentabilidad_por_periodo = None,
+                                rentabilidad_total_nominal = rentabilidad_total_nominal[:completadas],
+                                rentabilidad_por_periodo_nominal = None,
+                                agregado_por_periodo = acumulador.resultado(),
+                                agregado_por_periodo_nominal = acumulador_nominal.resultado(),
+                                periodos = periodos)
+
+    # Los lotes se unen en orden, el resultado no depende del numero de procesos
+    convergencia = None
+    for tamano, resultado_lote in zip(lotes, resultados_lotes):
+
+        final = inicio + tamano
+
+        if instrumentacion is not None:
+            resultado_lote, etapas_lote = resultado_lote
+            instrumentacion.combinar(etapas_lote)
+
+        lote_total, lote_por_periodo, lote_total_nominal, lote_por_periodo_nominal = resultado_lote
+
+        with medir_etapa(instrumentacion, "agregacion", tamano):
+
+            if almacen is not None:
+                # Escribir el lote en disco y marcarlo como completado
+                almacen.escribir_lote(inicio, lote_total, lote_por_periodo, lote_total_nominal, lote_por_periodo_nominal)
+
+            else:
+                # Guardar Rentabilidad Total
+                rentabilidad_total[inicio:final] = lote_total
+                rentabilidad_total_nominal[inicio:final] = lote_total_nominal
+
+                # Guardar o agregar Rentabilidad por periodo
+                if modo == "completo":
+                    rentabilidad_por_periodo[inicio:final] = lote_por_periodo
+                    rentabilidad_por_periodo_nominal[inicio:final] = lote_por_periodo_nominal
+                else:
+                    acumulador.agregar(lote_por_periodo)
+                    acumulador_nominal.agregar(lote_por_periodo_nominal)
+
+            if adaptativo:
+                acumulado = _acumular_convergencia(acumulado, lote_total.sum(axis=1), rentabilidad_objetivo)
+
+        inicio = final
+
+        if progreso is not None:
+            progreso(final, num_simulaciones, lambda completadas = final: parcial(completadas))
+
+        # Los lotes pendientes se cancelan al cerrar el executor
+        if cancelar is not None and cancelar.is_set():
+            logger.info("Simulacion cancelada con %d de %d simulaciones", final, num_simulaciones)
+            break
+
+        if adaptativo:
+            convergencia = _evaluar_convergencia(acumulado, rentabilidad_objetivo, tolerancia, tolerancia_media,
+                                                 tiempo_maximo, time.perf_counter() - tiempo_inicio, confianza)
+            if convergencia["motivo"] is not None:
+                break
+
+    if executor is not None:
+        executor.shutdown(cancel_futures = True)
+
+    if adaptativo:
+        if convergencia is None or convergencia["num_simulaciones"] != inicio:
+            # Simulacion guardada que ya estaba completa, o cancelada antes de evaluar el ultimo lote
+            convergencia = _evaluar_convergencia(acumulado, rentabilidad_objetivo, tolerancia, tolerancia_media,
+                                                 tiempo_maximo, time.perf_counter() - tiempo_inicio, confianza)
+        if convergencia["motivo"] is None:
+            convergencia["motivo"] = "cancelacion" if inicio < num_simulaciones else "maximo"
+    else:
+        convergencia = None
+
+    # En modo adaptativo o si se cancelo solo se conservan las simulaciones realizadas (vistas, sin copia)
+    if inicio < num_simulaciones:
+        rentabilidad_total, rentabilidad_total_nominal = rentabilidad_total[:inicio], rentabilidad_total_nominal[:inicio]
+        if modo == "completo" and almacen is None:
+            rentabilidad_por_periodo, rentabilidad_por_periodo_nominal = rentabilidad_por_periodo[:inicio], rentabilidad_por_periodo_nominal[:inicio]
+
+    if almacen is not None:
+        return almacen.resultado(convergencia)
 
-        # Guardar Rentabilidad por periodo
-        rentabilidad_por_periodo.append(rentabilidad_cartera_n_por_periodo)
-        rentabilidad_por_periodo_nominal.append(rentabilidad_cartera_n_por_periodo_nominal)
+    if modo == "completo":
+        return SimulationResult(activos = activos_seleccionados,
+                                rentabilidad_total = rentabilidad_total,
+                                rentabilidad_por_periodo = rentabilidad_por_periodo,
+                                rentabilidad_total_nominal = rentabilidad_total_nominal,
+                                rentabilidad_por_periodo_nominal = rentabilidad_por_periodo_nominal,
+                                convergencia = convergencia,
+                                periodos = periodos)
 
-    return rentabilidad_total, rentabilidad_por_periodo, rentabilidad_total_nominal, rentabilidad_por_periodo_nominal
\ No newline at end of file
+    return SimulationResult(activos = activos_seleccionados,
+                            rentabilidad_total = rentabilidad_total,
+                            rentabilidad_por_periodo = None,
+                            rentabilidad_total_nominal = rentabilidad_total_nominal,
+                            rentabilidad_por_periodo_nominal = None,
+                            agregado_por_periodo = acumulador.resultado(),
+                            agregado_por_periodo_nominal = acumulador_nominal.resultado(),
+                            convergencia = convergencia,
+                            periodos = periodos)
@@ -0,0 +1,156 @@
+"""
+Simulaciones en segundo plano para la app
+
+La simulacion se ejecuta en un hilo mientras el script de Streamlit sigue respondiendo: en cada rerun la app
+lee el progreso y el ultimo resultado parcial de la tarea, y puede pedir que se cancele. Cada sesion tiene un
+GestorTareas en st.session_state con su tarea actual; volver a pulsar Simular con los mismos parametros
+mientras la tarea sigue en curso no lanza otra.
+"""
+
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Segundos minimos entre dos resultados parciales: construirlos tiene un coste y la app solo los lee al refrescar
+INTERVALO_PARCIAL = 1.0
+
+
+class TareaSimulacion:
+
+    """
+    Una simulacion ejecutandose en un hilo
+
+    La funcion recibe progreso y cancelar, y se los pasa a run_multiple_simulations o a src.etapas.simular.
+    Los resultados parciales se construyen en el propio hilo de la tarea, como mucho uno cada intervalo_parcial
+    segundos, por lo que la app nunca lee arrays que el hilo este escribiendo.
+
+    Args:
+    - clave: Identificador de los parametros de la tarea
+    - funcion: Funcion (progreso, cancelar) -> resultado
+    - intervalo_parcial: Segundos minimos entre dos resultados parciales
+    """
+
+    def __init__(self, clave, funcion, intervalo_parcial = INTERVALO_PARCIAL):
+
+        self.clave = clave
+        self.intervalo_parcial = intervalo_parcial
+
+        self.completadas = 0
+        self.total = None
+        self.parcial = None
+        self.resultado = None
+        self.error = None
+        self.inicio = None
+        self.fin = None
+
+        self._funcion = funcion
+        self._cancelar = threading.Event()
+        self._ultimo_parcial = None
+        self._hilo = threading.Thread(target = self._ejecutar, name = f"simulacion-{clave[:8]}", daemon = True)
+
+    def iniciar(self):
+
+        self.inicio = time.perf_counter()
+        self._hilo.start()
+
+        return self
+
+    def cancelar(self):
+
+        """
+        Pide que la simulacion se detenga antes del siguiente lote. El resultado son las simulaciones ya hechas
+        """
+
+        self._cancelar.set()
+
+    @property
+    def cancelada(self):
+        return self._cancelar.is_set()
+
+    @property
+    def terminada(self):
+        return self.fin is not None
+
+    @property
+    def fraccion(self):
+        return self.completadas / self.total if self.total else 0.0
+
+    @property
+    def tiempo(self):
+        return (self.fin or time.perf_counter()) - self.inicio if self.inicio is not None else 0.0
+
+    def esperar(self, tiempo_maximo = None):
+
+        """
+        Espera a que termine la tarea. Devuelve True si termino
+        """
+
+        self._hilo.join(tiempo_maximo)
+
+        return self.terminada
+
+    def _progreso(self, completadas, total, parcial):
+
+        self.completadas, self.total = completadas, total
+
+        ahora = time.perf_counter()
+        if self._ultimo_parcial is None or ahora - self._ultimo_parcial >= self.intervalo_parcial or completadas >= total:
+            self.parcial = parcial()
+            self._ultimo_parcial = ahora
+
+    def _ejecutar(self):
+
+        try:
+            self.resultado = self._funcion(progreso = self._progreso, cancelar = self._cancelar)
+        except Exception as error:
+            # El error se muestra en la app en el siguiente rerun
+            logger.exception("Error en la simulacion %s", self.clave)
+            self.error = error
+        finally:
+            self.fin = time.perf_counter()
+
+
+class GestorTareas:
+
+    """
+    Tarea actual de una sesion de la app
+
+    Lanzar una tarea con la misma clave que la tarea en curso devuelve la tarea en curso. Lanzar una con
+    otra clave cancela la anterior, para no acumular trabajo que ya nadie va a ver.
+    """
+
+    def __init__(self):
+
+        self.actual = None
+        self._bloqueo = threading.Lock()
+
+    def lanzar(self, clave, funcion, intervalo_parcial = INTERVALO_PARCIAL):
+
+        """
+        Args:
+        - clave: Identificador de los parametros de la tarea, por ejemplo src.etapas.clave_etapa de sus argumentos
+        - funcion: Funcion (progreso, cancelar) -> resultado
+
+        Returns:
+        - tarea (TareaSimulacion): La tarea en curso con la misma clave o la nueva tarea
+        """
+
+        with self._bloqueo:
+            actual = self.actual
+            if actual is not None and not actual.terminada:
+                if actual.clave == clave and not actual.cancelada:
+                    logger.info("Simulacion %s ya en curso, no se repite", clave)
+                    return actual
+                actual.cancelar()
+
+            self.actual = TareaSimulacion(clave, funcion, intervalo_parcial).iniciar()
+
+            return self.actual
+
+    def cancelar(self):
+
+        with self._bloqueo:
+            if self.actual is not None:
+                self.actual.cancelar()
@@ -0,0 +1,87 @@
+from src.almacen import AlmacenResultados, abrir_almacen, semilla_guardada
+from src.simulation import run_multiple_simulations
+import pandas as pd
+import numpy as np
+import threading
+import pytest
+
+
+ARGUMENTOS = dict(T = 1, activos_seleccionados = ["A", "B"], inversion_inicial = 1000, distribucion_cartera = [0.5, 0.5],
+                  num_simulaciones = 30, balanceo = "Trimestral", fase = "Acumulación", fase_dinero = 100, inflacion = 2, tamano_lote = 10)
+
+
+@pytest.fixture
+def precios():
+    generador = np.random.default_rng(1)
+    fechas = pd.bdate_range("2020-01-01", periods = 300)
+    return pd.DataFrame(100 * np.exp(np.cumsum(generador.normal(0, 0.01, (300, 2)), axis = 0)), index = fechas, columns = ["A", "B"])
+
+
+def test_crear_y_escribir_lote(tmp_path):
+
+    ruta = str(tmp_path / "simulacion")
+    almacen = AlmacenResultados.crear(ruta, {"semilla": 5}, ["A", "B"], num_simulaciones = 4, periodos = [1, 2, 3], dtype = np.float32)
+
+    assert almacen.progreso == {"lotes_completados": 0, "simulaciones_completadas": 0}
+    assert almacen.resultado().num_simulaciones == 0
+    assert not almacen.completo
+    assert semilla_guardada(ruta) == 5
+
+    # Un lote escrito queda marcado y es lo unico que devuelve el resultado
+    almacen.escribir_lote(0, np.ones((2, 2)), np.full((2, 3), 2), 3 * np.ones((2, 2)), np.full((2, 3), 4))
+
+    assert almacen.progreso == {"lotes_completados": 1, "simulaciones_completadas": 2}
+    resultado = almacen.resultado()
+    assert resultado.num_simulaciones == 2
+    assert resultado.rentabilidad_por_periodo("real").dtype == np.float32
+    np.testing.assert_array_equal(resultado.rentabilidad_por_periodo("nominal"), np.full((2, 3), 4))
+    np.testing.assert_array_equal(resultado.rentabilidad_final("real"), np.ones((2, 2)))
+
+
+def test_abrir_o_crear_con_otros_parametros(tmp_path):
+
+    ruta = str(tmp_path / "simulacion")
+    AlmacenResultados.crear(ruta, {"semilla": 5}, ["A"], 4, [1, 2])
+
+    # Mismos parametros aunque sean tuplas o floats de NumPy
+    AlmacenResultados.abrir_o_crear(ruta, {"semilla": 5}, ("A",), 4, np.array([1, 2]))
+
+    with pytest.raises(ValueError, match = "otros parametros"):
+        AlmacenResultados.abrir_o_crear(ruta, {"semilla": 6}, ["A"], 4, [1, 2])
+
+
+def test_continuar_sin_semilla_igual_que_en_memoria(tmp_path, precios):
+
+    ruta = str(tmp_path / "simulacion")
+
+    # Interrumpir despues del primer lote
+    cancelar = threading.Event()
+    parcial = run_multiple_simulations(precios, almacen = ruta, cancelar = cancelar, progreso = lambda *_: cancelar.set(), **ARGUMENTOS)
+    assert parcial.num_simulaciones == 10
+
+    # La misma llamada sin semilla continua la simulacion guardada con su semilla
+    resultado = run_multiple_simulations(precios, almacen = ruta, **ARGUMENTOS)
+    esperado = run_multiple_simulations(precios, semilla = semilla_guardada(ruta), **ARGUMENTOS)
+
+    assert abrir_almacen(ruta).completo
+    for tipo in ("real", "nominal"):
+        np.testing.assert_array_equal(resultado.rentabilidad_final(tipo), esperado.rentabilidad_final(tipo))
+        np.testing.assert_array_equal(resultado.rentabilidad_por_periodo(tipo), esperado.rentabilidad_por_periodo(tipo))
+
+
+def test_abrir_almacen_sin_cargar_los_datos(tmp_path, precios):
+
+    ruta = str(tmp_path / "simulacion")
+    esperado = run_multiple_simulations(precios, almacen = ruta, semilla = 3, **ARGUMENTOS)
+
+    almacen = abrir_almacen(ruta)
+
+    # Memoria mapeada de solo lectura: los datos se leen del disco al acceder a ellos
+    assert almacen.modo == "r"
+    assert isinstance(almacen.rentabilidad_por_periodo("real"), np.memmap)
+    assert not almacen.rentabilidad_por_periodo("real").flags.writeable
+
+    resultado = almacen.resultado()
+    assert resultado.activos == ["A", "B"]
+    np.testing.assert_array_equal(resultado.periodos, esperado.periodos)
+    np.testing.assert_array_equal(resultado.rentabilidad_por_periodo("real"), esperado.rentabilidad_por_periodo("real"))
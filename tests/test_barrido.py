@@ -0,0 +1,64 @@
+from src.barrido import barrido_parametros
+from src.simulation import run_multiple_simulations
+import pandas as pd
+import numpy as np
+import pytest
+
+
+ARGUMENTOS = dict(T = 1, activos_seleccionados = ["A", "B"], inversion_inicial = 1000, num_simulaciones = 120, fase = "Acumulación",
+                  tamano_lote = 50, semilla = 11)
+
+
+@pytest.fixture
+def precios():
+    generador = np.random.default_rng(2)
+    fechas = pd.bdate_range("2020-01-01", periods = 300)
+    return pd.DataFrame(100 * np.exp(np.cumsum(generador.normal(0, 0.01, (300, 2)), axis = 0)), index = fechas, columns = ["A", "B"])
+
+
+def final_simulado(precios, balanceo, fase_dinero, inflacion, pesos, tipo_rentabilidad = "real"):
+
+    resultado = run_multiple_simulations(precios, distribucion_cartera = pesos, balanceo = balanceo, fase_dinero = fase_dinero,
+                                         inflacion = inflacion, **ARGUMENTOS)
+    return resultado.rentabilidad_iteracion(tipo_rentabilidad)
+
+
+def test_un_punto_igual_a_run_multiple_simulations(precios):
+
+    barrido = barrido_parametros(precios, rentabilidad_objetivo = 1050, balanceos = ("Mensual",), fases_dinero = (20,), inflaciones = (3,),
+                                 distribuciones = [[0.3, 0.7]], **ARGUMENTOS)
+
+    fila = barrido.iloc[0]
+    for tipo in ("real", "nominal"):
+        finales = final_simulado(precios, "Mensual", 20, 3, [0.3, 0.7], tipo)
+        assert fila[f"media_{tipo}"] == pytest.approx(finales.mean(), rel = 1e-12)
+        assert fila[f"desv_{tipo}"] == pytest.approx(finales.std(ddof = 1), rel = 1e-12)
+        for percentil in (5, 50, 95):
+            assert fila[f"p{percentil}_{tipo}"] == pytest.approx(np.percentile(finales, percentil), rel = 1e-12)
+
+    assert fila["prob_objetivo_real"] == pytest.approx(100 * np.mean(final_simulado(precios, "Mensual", 20, 3, [0.3, 0.7]) > 1050))
+    assert fila["prob_objetivo_real_inferior"] <= fila["prob_objetivo_real"] <= fila["prob_objetivo_real_superior"]
+
+
+def test_diferencias_pareadas_con_la_primera_combinacion(precios):
+
+    barrido = barrido_parametros(precios, rentabilidad_objetivo = 1050, balanceos = ("Mensual", "Anual"), fases_dinero = (0, 50),
+                                 inflaciones = (2, 4), **ARGUMENTOS)
+
+    assert len(barrido) == 8
+    for tipo in ("real", "nominal"):
+        assert barrido.loc[0, f"diferencia_media_{tipo}"] == 0
+        assert barrido.loc[0, f"error_diferencia_{tipo}"] == 0
+
+    # Diferencia simulacion a simulacion con las mismas trayectorias que la primera combinacion
+    base = final_simulado(precios, "Mensual", 0, 2, [0.5, 0.5])
+    for _, fila in barrido.iloc[1:].iterrows():
+        diferencia = final_simulado(precios, fila["balanceo"], fila["fase_dinero"], fila["inflacion"], [0.5, 0.5]) - base
+        assert fila["diferencia_media_real"] == pytest.approx(diferencia.mean(), rel = 1e-9, abs = 1e-9)
+        assert fila["error_diferencia_real"] == pytest.approx(diferencia.std(ddof = 1) / np.sqrt(len(diferencia)), rel = 1e-9)
+
+
+def test_distribucion_sin_un_peso_por_activo(precios):
+
+    with pytest.raises(ValueError, match = "un peso por activo"):
+        barrido_parametros(precios, rentabilidad_objetivo = 1050, distribuciones = [[1.0]], **ARGUMENTOS)
@@ -0,0 +1,120 @@
+from src.batch import leer_escenarios, ejecutar_escenarios, ESCENARIO_POR_DEFECTO
+import pandas as pd
+import numpy as np
+import json
+import pytest
+
+
+def escribir(ruta, contenido):
+    ruta.write_text(contenido, encoding = "utf-8")
+    return str(ruta)
+
+
+def test_leer_escenarios_csv(tmp_path):
+
+    ruta = escribir(tmp_path / "escenarios.csv",
+                    "id,activos,pesos,inversion_inicial,fase\n"
+                    "a,AAPL;MSFT,0.25;0.75,5000,Distribución\n"
+                    "b,AAPL,1,,\n")
+
+    escenarios = leer_escenarios(ruta)
+
+    assert [escenario["id"] for escenario in escenarios] == ["a", "b"]
+    assert escenarios[0]["activos"] == ["AAPL", "MSFT"]
+    assert escenarios[0]["pesos"] == [0.25, 0.75]
+    assert escenarios[0]["inversion_inicial"] == 5000
+    assert escenarios[0]["fase"] == "Distribución"
+
+    # Un solo activo con un solo peso, y los campos vacios toman el valor por defecto
+    assert escenarios[1]["activos"] == ["AAPL"]
+    assert escenarios[1]["pesos"] == [1.0]
+    assert escenarios[1]["inversion_inicial"] == ESCENARIO_POR_DEFECTO["inversion_inicial"]
+    assert escenarios[1]["fase"] == ESCENARIO_POR_DEFECTO["fase"]
+
+
+def test_leer_escenarios_csv_con_pesos_numericos(tmp_path):
+
+    # Si todos los pesos son un solo numero, pandas los lee como numeros y no como texto
+    escenarios = leer_escenarios(escribir(tmp_path / "escenarios.csv", "id,activos,pesos\n1,AAPL,1\n2,MSFT,1.0\n"))
+
+    assert [escenario["pesos"] for escenario in escenarios] == [[1.0], [1.0]]
+    assert [escenario["activos"] for escenario in escenarios] == [["AAPL"], ["MSFT"]]
+
+
+def test_leer_escenarios_json_con_valores_por_defecto(tmp_path):
+
+    ruta = escribir(tmp_path / "escenarios.json", json.dumps([{"activos": ["AAPL", "MSFT", "GOOG"], "anios": 2},
+                                                               {"id": "x", "activos": ["AAPL"], "pesos": [1]}]))
+
+    escenarios = leer_escenarios(ruta)
+
+    # Sin id se numeran desde 1 y sin pesos la cartera es equiponderada
+    assert escenarios[0]["id"] == "1"
+    np.testing.assert_allclose(escenarios[0]["pesos"], [1 / 3] * 3)
+    assert escenarios[0]["anios"] == 2
+    assert {clave: escenarios[0][clave] for clave in ("balanceo", "inflacion", "fase_dinero")} == \
+           {clave: ESCENARIO_POR_DEFECTO[clave] for clave in ("balanceo", "inflacion", "fase_dinero")}
+    assert escenarios[1]["id"] == "x" and escenarios[1]["pesos"] == [1.0]
+
+
+@pytest.mark.parametrize("fila, mensaje", [({"activos": []}, "no tiene activos"),
+                                           ({"activos": ["AAPL", "MSFT"], "pesos": [1]}, "2 activos y 1 pesos"),
+                                           ({"activos": ["AAPL", "MSFT"], "pesos": [0.5, 0.6]}, "no suman 1")])
+def test_leer_escenarios_valida_los_pesos(tmp_path, fila, mensaje):
+
+    ruta = escribir(tmp_path / "escenarios.json", json.dumps([fila]))
+
+    with pytest.raises(ValueError, match = mensaje):
+        leer_escenarios(ruta)
+
+
+def test_leer_escenarios_formato_no_valido(tmp_path):
+
+    with pytest.raises(ValueError, match = "Formato"):
+        leer_escenarios(escribir(tmp_path / "escenarios.txt", ""))
+
+
+class Cargador:
+
+    """
+    Cargador con la firma de load_data que devuelve precios sinteticos y registra las llamadas
+    """
+
+    def __init__(self):
+        generador = np.random.default_rng(0)
+        fechas = pd.bdate_range("2021-01-01", periods = 300)
+        self.precios = pd.DataFrame(100 * np.exp(np.cumsum(generador.normal(0, 0.01, (300, 2)), axis = 0)), index = fechas,
+                                    columns = ["AAPL", "MSFT"])
+        self.llamadas = []
+
+    def __call__(self, empresas, start_date, end_date, offline = False):
+        self.llamadas.append(list(empresas))
+        return self.precios.reindex(columns = empresas)
+
+
+def test_ejecutar_escenarios(tmp_path):
+
+    escenarios = leer_escenarios(escribir(tmp_path / "escenarios.csv",
+                                          "id,activos,pesos\n"
+                                          "a,AAPL;MSFT,0.5;0.5\n"
+                                          "b,AAPL,1\n"
+                                          "c,NADA,1\n"))
+    cargador = Cargador()
+
+    resumen, estadisticas = ejecutar_escenarios(escenarios, num_simulaciones = 50, num_procesos = 1, semilla = 3, cargador = cargador)
+
+    # Una sola carga con todos los activos sin repetir
+    assert cargador.llamadas == [["AAPL", "MSFT", "NADA"]]
+
+    # El escenario sin precios da error sin detener el resto
+    assert list(resumen["id"]) == ["a", "b", "c"]
+    assert resumen["error"].isna().tolist() == [True, True, False]
+    assert "NADA" in resumen.loc[2, "error"]
+    assert estadisticas["escenarios"] == 3 and estadisticas["errores"] == 1
+
+    assert (resumen.loc[:1, "num_simulaciones"] == 50).all()
+    assert (resumen.loc[:1, "p5_real"] <= resumen.loc[:1, "p95_real"]).all()
+
+    # Con la misma semilla el resumen es el mismo
+    repetido, _ = ejecutar_escenarios(escenarios, num_simulaciones = 50, num_procesos = 1, semilla = 3, cargador = Cargador())
+    pd.testing.assert_frame_equal(resumen.drop(columns = "tiempo"), repetido.drop(columns = "tiempo"))
@@ -0,0 +1,62 @@
+from src.cache_precios import CachePrecios
+import pandas as pd
+import numpy as np
+import pytest
+
+
+class Mercado:
+
+    """
+    Descargador local con precios ajustados como los de yfinance: despues de un split de factor 4, todo el
+    historico anterior se divide por 4
+    """
+
+    def __init__(self):
+        fechas = pd.bdate_range("2024-01-01", "2024-12-31")
+        self.precios = pd.Series(np.linspace(100, 200, len(fechas)), index = fechas)
+        self.splits = []
+        self.descargas = []
+
+    def descargar(self, empresa, start_date, end_date):
+        self.descargas.append((empresa, start_date, end_date))
+        precios = self.precios.copy()
+        for fecha, factor in self.splits:
+            precios[precios.index < fecha] /= factor
+        return precios[(precios.index >= start_date) & (precios.index < end_date)]
+
+    def descargar_masivo(self, empresas, start_date, end_date):
+        return pd.DataFrame({empresa: self.descargar(empresa, start_date, end_date) for empresa in empresas})
+
+
+@pytest.mark.parametrize("masivo", [False, True])
+def test_cache_precios_solo_descarga_lo_que_falta(tmp_path, masivo):
+
+    mercado = Mercado()
+    cache = CachePrecios(str(tmp_path / "precios.sqlite"), descargador = mercado.descargar,
+                         descargador_masivo = mercado.descargar_masivo if masivo else None)
+
+    cache.obtener_varias(["AAA"], "2024-01-01", "2024-06-01")
+    precios = cache.obtener_varias(["AAA"], "2024-01-01", "2024-09-01")["AAA"]
+
+    # La segunda descarga empieza en el ultimo dia guardado, no en el inicio
+    assert mercado.descargas[-1][1] == "2024-05-31"
+    pd.testing.assert_series_equal(precios, mercado.descargar("AAA", "2024-01-01", "2024-09-01"), check_names = False, check_freq = False)
+
+
+@pytest.mark.parametrize("masivo", [False, True])
+def test_cache_precios_recarga_el_historico_tras_un_split(tmp_path, masivo):
+
+    mercado = Mercado()
+    cache = CachePrecios(str(tmp_path / "precios.sqlite"), descargador = mercado.descargar,
+                         descargador_masivo = mercado.descargar_masivo if masivo else None)
+
+    cache.obtener_varias(["AAA"], "2024-01-01", "2024-06-01")
+    mercado.splits.append((pd.Timestamp("2024-07-01"), 4))
+    precios = cache.obtener_varias(["AAA"], "2024-01-01", "2024-09-01")["AAA"]
+
+    # Todo el historico esta en la misma escala: ningun rendimiento diario parecido a -75%
+    assert precios.pct_change().min() > -0.01
+    pd.testing.assert_series_equal(precios, mercado.descargar("AAA", "2024-01-01", "2024-09-01"), check_names = False, check_freq = False)
+
+    # Sin conexion se leen los precios recargados
+    pd.testing.assert_series_equal(cache.obtener("AAA", "2024-01-01", "2024-09-01", offline = True), precios, check_names = False, check_freq = False)
@@ -0,0 +1,56 @@
+from src.calendario import CalendarioEventos
+import numpy as np
+import pytest
+
+
+def test_desde_fechas_en_dias_naturales():
+
+    # 2024-01-01 es lunes: el sabado 6 y el domingo 7 pasan al lunes 8, a 7 dias naturales del inicio
+    calendario = CalendarioEventos.desde_fechas(["2024-01-06", "2024-01-07", "2024-01-10"], "2024-01-01", 30, fase_dinero = 10,
+                                                dias_habiles = True)
+
+    np.testing.assert_array_equal(calendario.periodos_rebalanceo, [7, 9])
+    np.testing.assert_allclose(calendario.flujos, [20, 10])
+    assert calendario.dias_por_anio == 365
+
+    # Sin dias habiles las fechas no se mueven
+    calendario = CalendarioEventos.desde_fechas(["2024-01-06", "2024-01-10"], "2024-01-01", 30, fase_dinero = 10)
+    np.testing.assert_array_equal(calendario.periodos_rebalanceo, [5, 9])
+
+
+def test_calendario_bursatil_en_dias_naturales():
+
+    # Cada 21 dias habiles desde el lunes 2024-01-01: el 30 de enero (29 dias naturales), el 28 de febrero...
+    calendario = CalendarioEventos.desde_balanceo("Mensual", 366, fase_dinero = 10, calendario = "bursatil", inicio = "2024-01-01")
+
+    fechas = np.datetime64("2024-01-01") + calendario.periodos_rebalanceo
+    assert calendario.periodos_rebalanceo[:2].tolist() == [29, 58]
+    assert np.is_busday(fechas).all()
+    np.testing.assert_array_equal(np.busday_count("2024-01-01", fechas), 21 * np.arange(1, len(fechas) + 1))
+    assert len(calendario) == 12
+    np.testing.assert_allclose(calendario.flujos, 10)
+
+    # Anual son 252 dias habiles, que caen antes del final del año natural
+    anual = CalendarioEventos.desde_balanceo("Anual", 731, calendario = "bursatil", inicio = "2024-01-01")
+    assert anual.periodos_rebalanceo.tolist() == [np.busday_offset("2024-01-01", 252) - np.datetime64("2024-01-01"),
+                                                  np.busday_offset("2024-01-01", 504) - np.datetime64("2024-01-01")]
+    assert anual.periodos_rebalanceo[0] < 365
+
+
+@pytest.mark.parametrize("fase", ["Acumulación", "Distribución"])
+def test_por_unidad_es_el_flujo_de_un_aporte_de_1(fase):
+
+    calendario = CalendarioEventos.desde_balanceo("Mensual", 731, fase, 250, calendario = "natural", crecimiento = 5)
+
+    signo = 1 if fase == "Acumulación" else -1
+    np.testing.assert_allclose(calendario.flujos, signo * 250 * calendario.por_unidad)
+    np.testing.assert_allclose(calendario.por_unidad, 1.05 ** (calendario.periodos_rebalanceo / 365))
+
+
+def test_por_unidad_suma_los_eventos_del_mismo_periodo():
+
+    calendario = CalendarioEventos(30, [5, 5, 9], flujos = [1, 2, 3], por_unidad = [1, 1.5, 2])
+
+    np.testing.assert_array_equal(calendario.periodos_rebalanceo, [5, 9])
+    np.testing.assert_allclose(calendario.flujos, [3, 3])
+    np.testing.assert_allclose(calendario.por_unidad, [2.5, 2])
@@ -0,0 +1,89 @@
+from src.etapas import CacheEtapas, simular, buscar_objetivo
+from src.simulation import run_multiple_simulations
+from src.calendario import CalendarioEventos
+import pandas as pd
+import numpy as np
+import pytest
+
+
+ARGUMENTOS = dict(T = 2, activos_seleccionados = ["A", "B"], inversion_inicial = 1000, distribucion_cartera = [0.6, 0.4],
+                  num_simulaciones = 250, balanceo = "Trimestral", fase = "Acumulación", fase_dinero = 100, inflacion = 3,
+                  semilla = 7, tamano_lote = 100)
+
+
+@pytest.fixture
+def precios():
+    generador = np.random.default_rng(0)
+    fechas = pd.bdate_range("2020-01-01", periods = 500)
+    return pd.DataFrame(100 * np.exp(np.cumsum(generador.normal(0, 0.01, (500, 2)), axis = 0)), index = fechas, columns = ["A", "B"])
+
+
+def comprobar_iguales(resultado, esperado):
+
+    for tipo in ("real", "nominal"):
+        np.testing.assert_array_equal(resultado.rentabilidad_final(tipo), esperado.rentabilidad_final(tipo))
+        agregado, agregado_esperado = resultado.agregado_por_periodo(tipo), esperado.agregado_por_periodo(tipo)
+        np.testing.assert_array_equal(agregado.periodos, agregado_esperado.periodos)
+        np.testing.assert_array_equal(agregado.media, agregado_esperado.media)
+        np.testing.assert_array_equal(agregado.valores_percentiles, agregado_esperado.valores_percentiles)
+
+
+@pytest.mark.parametrize("modo, motor", [("agregado", "eventos"), ("completo", "eventos"), ("completo", "diario"), ("agregado", "diario")])
+def test_simular_por_etapas_igual_a_run_multiple_simulations(precios, modo, motor):
+
+    cache = CacheEtapas()
+    _, resultado = simular(cache, precios, modo = modo, motor = motor, **ARGUMENTOS)
+
+    comprobar_iguales(resultado, run_multiple_simulations(precios, modo = modo, motor = motor, **ARGUMENTOS))
+
+
+@pytest.mark.parametrize("motor", ["eventos", "diario"])
+def test_cambiar_inflacion_solo_repite_la_valoracion(precios, motor):
+
+    cache = CacheEtapas()
+    simular(cache, precios, modo = "agregado", motor = motor, **ARGUMENTOS)
+    entradas = len(cache)
+
+    argumentos = {**ARGUMENTOS, "inflacion": 5, "fase_dinero": 50}
+    _, resultado = simular(cache, precios, modo = "agregado", motor = motor, **argumentos)
+
+    # Solo se añade la valoracion nueva: las trayectorias se reutilizan
+    assert len(cache) == entradas + 1
+    comprobar_iguales(resultado, run_multiple_simulations(precios, modo = "agregado", motor = motor, **argumentos))
+
+
+@pytest.mark.parametrize("modo, motor", [("agregado", "eventos"), ("completo", "diario")])
+def test_buscar_objetivo_sobre_las_trayectorias_de_la_simulacion(precios, modo, motor):
+
+    argumentos = {nombre: valor for nombre, valor in ARGUMENTOS.items() if nombre != "fase_dinero"}
+    solucion = buscar_objetivo(CacheEtapas(), precios, rentabilidad_objetivo = 3000, probabilidad = 60, modo = modo, motor = motor,
+                               **argumentos)
+
+    # Con el aporte encontrado, la simulacion del grafico supera el objetivo con la probabilidad buscada
+    resultado = run_multiple_simulations(precios, fase_dinero = solucion["fase_dinero"], modo = modo, motor = motor, **argumentos)
+    assert 100 * np.mean(resultado.rentabilidad_final().sum(axis = 1) > 3000) == pytest.approx(solucion["probabilidad"])
+
+
+def test_buscar_objetivo_comprueba_la_memoria(precios):
+
+    argumentos = {nombre: valor for nombre, valor in ARGUMENTOS.items() if nombre != "fase_dinero"}
+    with pytest.raises(MemoryError):
+        buscar_objetivo(CacheEtapas(), precios, rentabilidad_objetivo = 3000, modo = "agregado", motor = "eventos", memoria_maxima = 1000,
+                        **argumentos)
+
+
+@pytest.mark.parametrize("motor", ["eventos", "diario"])
+def test_buscar_objetivo_con_el_calendario_de_la_simulacion(precios, motor):
+
+    argumentos = {nombre: valor for nombre, valor in ARGUMENTOS.items() if nombre not in ("fase_dinero", "balanceo")}
+    num_periodos = int(ARGUMENTOS["T"] / (1/365)) + 1
+    calendario = CalendarioEventos.desde_balanceo("Mensual", num_periodos, "Acumulación", 100, calendario = "natural", crecimiento = 5)
+
+    solucion = buscar_objetivo(CacheEtapas(), precios, balanceo = "Mensual", rentabilidad_objetivo = 3000, probabilidad = 60, motor = motor,
+                               calendario = calendario, **argumentos)
+
+    # El aporte encontrado crece como los flujos del calendario
+    calendario = CalendarioEventos.desde_balanceo("Mensual", num_periodos, "Acumulación", solucion["fase_dinero"], calendario = "natural",
+                                                  crecimiento = 5)
+    resultado = run_multiple_simulations(precios, balanceo = "Mensual", fase_dinero = 0, motor = motor, calendario = calendario, **argumentos)
+    assert 100 * np.mean(resultado.rentabilidad_final().sum(axis = 1) > 3000) == pytest.approx(solucion["probabilidad"])
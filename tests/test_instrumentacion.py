@@ -0,0 +1,48 @@
+from src.instrumentacion import Instrumentacion
+import numpy as np
+import threading
+import tracemalloc
+
+
+def test_etapa_mide_tiempo_y_memoria():
+
+    instrumentacion = Instrumentacion(medir_memoria = True)
+    with instrumentacion.etapa("generacion", 10):
+        datos = np.ones(2**20)
+    del datos
+
+    registro = instrumentacion.etapas["generacion"]
+    assert registro["llamadas"] == 1 and registro["trayectorias"] == 10
+    assert registro["memoria_pico"] >= 8 * 2**20
+    assert not tracemalloc.is_tracing()
+
+
+def test_etapas_concurrentes_no_comparten_tracemalloc():
+
+    # Dos sesiones miden una etapa a la vez en hilos distintos: solo una mide la memoria y tracemalloc
+    # no se detiene mientras la otra la esta midiendo
+    instrumentaciones = [Instrumentacion(medir_memoria = True) for _ in range(2)]
+    dentro = threading.Barrier(2)
+    errores = []
+
+    def medir(instrumentacion):
+        try:
+            with instrumentacion.etapa("rebalanceo"):
+                dentro.wait(timeout = 5)
+                datos = np.ones(2**20)
+                dentro.wait(timeout = 5)
+            del datos
+        except Exception as error:
+            errores.append(error)
+
+    hilos = [threading.Thread(target = medir, args = (instrumentacion,)) for instrumentacion in instrumentaciones]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert not errores
+    picos = [instrumentacion.etapas["rebalanceo"]["memoria_pico"] for instrumentacion in instrumentaciones]
+    assert sorted(pico is None for pico in picos) == [False, True]
+    assert [pico for pico in picos if pico is not None][0] >= 8 * 2**20
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,85 @@
+from src.simulation import run_multiple_simulations
+from src.muestreo import generar_shocks
+import src.muestreo as modulo_muestreo
+from scipy.special import ndtr
+import pandas as pd
+import numpy as np
+import pytest
+
+NUM_REPETICIONES = 40
+
+
+@pytest.fixture(scope = "module")
+def simulacion():
+
+    generador = np.random.default_rng(0)
+    fechas = pd.bdate_range("2021-01-01", periods = 750)
+    precios = pd.DataFrame(100 * np.exp(np.cumsum(generador.normal(0.0004, 0.012, (750, 2)), axis=0)), index = fechas, columns = ["A", "B"])
+
+    argumentos = dict(df_consolidado = precios, T = 1, activos_seleccionados = ["A", "B"], inversion_inicial = 1000,
+                      distribucion_cartera = [0.5, 0.5], balanceo = "Anual", fase = "Acumulación", fase_dinero = 0, inflacion = 2)
+
+    # Objetivo en la mediana de la rentabilidad final, donde la varianza de la probabilidad es maxima
+    referencia = run_multiple_simulations(num_simulaciones = 20000, semilla = 999, **argumentos)
+    objetivo = float(np.median(referencia.rentabilidad_iteracion("real")))
+
+    calculadas = {}
+
+    def probabilidades(muestreo):
+        if muestreo not in calculadas:
+            calculadas[muestreo] = np.array([run_multiple_simulations(num_simulaciones = 256, semilla = semilla, muestreo = muestreo, **argumentos)
+                                             .probabilidad_objetivo(objetivo, "real") for semilla in range(NUM_REPETICIONES)])
+        return calculadas[muestreo]
+
+    return probabilidades
+
+
+@pytest.mark.parametrize("muestreo", ["antitetico", "sobol", "estratificado"])
+def test_reduccion_de_varianza_de_la_probabilidad(simulacion, muestreo):
+
+    # Varianza de la probabilidad estimada entre semillas con 256 simulaciones, frente al muestreo estandar
+    estandar = simulacion("estandar")
+    reducida = simulacion(muestreo)
+
+    assert estandar.var(ddof = 1) / reducida.var(ddof = 1) > 2
+
+    # Sin sesgo: la media de las estimaciones sigue cerca del 50%
+    assert abs(reducida.mean() - 50) < 3 * np.sqrt(estandar.var(ddof = 1) / NUM_REPETICIONES)
+
+
+@pytest.mark.parametrize("muestreo", ["estandar", "antitetico", "sobol", "estratificado"])
+def test_float32_es_la_misma_muestra(muestreo):
+
+    # Con la misma semilla, los shocks float32 son los float64 redondeados, no otra muestra
+    shocks = generar_shocks(50, 3, 100, muestreo = muestreo, generador = np.random.default_rng(5))
+    shocks_float32 = generar_shocks(50, 3, 100, muestreo = muestreo, generador = np.random.default_rng(5), dtype = np.float32)
+
+    assert shocks_float32.dtype == np.float32
+    np.testing.assert_array_equal(shocks_float32, shocks.astype(np.float32))
+
+
+def test_float32_bloques_iguales_a_una_llamada(monkeypatch):
+
+    # Generar por bloques de simulaciones no cambia la secuencia
+    monkeypatch.setattr(modulo_muestreo, "VALORES_POR_BLOQUE", 7)
+    shocks = generar_shocks(10, 2, 5, generador = np.random.default_rng(1))
+    shocks_float32 = generar_shocks(10, 2, 5, generador = np.random.default_rng(1), dtype = np.float32)
+
+    np.testing.assert_array_equal(shocks_float32, shocks.astype(np.float32))
+
+
+def test_puente_browniano_con_pasos_desiguales():
+
+    # Malla de eventos: pasos de un dia y tramos largos entre rebalanceos
+    duraciones = np.array([1, 89, 1, 1, 270, 1])
+    shocks = generar_shocks(4000, 1, len(duraciones), muestreo = "estratificado", generador = np.random.default_rng(3),
+                            duraciones = duraciones)
+
+    # Cada paso sigue siendo una normal estandar independiente de las demas
+    np.testing.assert_allclose(shocks[:, 0].mean(axis = 0), 0, atol = 0.1)
+    np.testing.assert_allclose(np.cov(shocks[:, 0], rowvar = False), np.eye(len(duraciones)), atol = 0.1)
+
+    # El valor final del movimiento browniano, con cada paso pesado por la raiz de su duracion, tiene una simulacion por estrato
+    final = (shocks[:, 0] * np.sqrt(duraciones)).sum(axis = 1) / np.sqrt(duraciones.sum())
+    estratos = np.floor(ndtr(final) * 4000).astype(int)
+    np.testing.assert_array_equal(np.sort(estratos), np.arange(4000))
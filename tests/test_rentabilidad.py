@@ -0,0 +1,41 @@
+from src.rentabilidad import rentabilidad_cartera_rebalanceo_inflacion, rentabilidad_cartera_rebalanceo_inflacion_vectorizada
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("balanceo", ["Mensual", "Trimestral", "Semestral", "Anual"])
+@pytest.mark.parametrize("fase, fase_dinero", [("Acumulación", 50), ("Distribución", 20)])
+@pytest.mark.parametrize("tipo_rentabilidad", ["real", "nominal"])
+def test_rebalanceo_vectorizado_igual_al_loop(balanceo, fase, fase_dinero, tipo_rentabilidad):
+
+    num_simulaciones, num_assets, num_periodos = 3, 3, 400
+    pesos = [0.5, 0.3, 0.2]
+
+    generador = np.random.default_rng(7)
+    tasa_de_cambio = generador.normal(0.0003, 0.01, (num_simulaciones, num_assets, num_periodos))
+    tasa_de_cambio[:, :, 0] = 0
+
+    rentabilidad_cartera, rentabilidad_total_periodo = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(
+        1000, tasa_de_cambio, pesos, balanceo, fase, fase_dinero, 2, tipo_rentabilidad)
+
+    for simulacion in range(num_simulaciones):
+        esperada_cartera, esperada_periodo = rentabilidad_cartera_rebalanceo_inflacion([1000], tasa_de_cambio[simulacion].tolist(), pesos,
+                                                                                       num_periodos, num_assets, balanceo, fase, fase_dinero,
+                                                                                       2, tipo_rentabilidad)
+
+        np.testing.assert_allclose(rentabilidad_cartera[simulacion], esperada_cartera, rtol = 1e-10)
+        np.testing.assert_allclose(rentabilidad_total_periodo[simulacion], esperada_periodo, rtol = 1e-10)
+
+
+def test_rebalanceo_vectorizado_ambas():
+
+    # Con "ambas" se devuelven la rentabilidad real y la nominal, iguales a las de cada tipo por separado
+    tasa_de_cambio = np.random.default_rng(3).normal(0.0003, 0.01, (4, 2, 200))
+    tasa_de_cambio[:, :, 0] = 0
+
+    ambas = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(1000, tasa_de_cambio, [0.6, 0.4], "Mensual", "Acumulación", 10, 3, "ambas")
+    real = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(1000, tasa_de_cambio, [0.6, 0.4], "Mensual", "Acumulación", 10, 3, "real")
+    nominal = rentabilidad_cartera_rebalanceo_inflacion_vectorizada(1000, tasa_de_cambio, [0.6, 0.4], "Mensual", "Acumulación", 10, 3, "nominal")
+
+    for obtenido, esperado in zip(ambas, real + nominal):
+        np.testing.assert_allclose(obtenido, esperado, rtol = 1e-12)
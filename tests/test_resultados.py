@@ -0,0 +1,27 @@
+from src.resultados import AcumuladorPorPeriodo, NUM_INTERVALOS
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("tamano_lote", [1, 5, 1000])
+def test_acumulador_percentiles_con_lotes_pequenos(tamano_lote):
+
+    # El rango del primer lote no cubre los siguientes: el histograma se amplia en lugar de recortar los valores
+    valores = 1000 * np.exp(np.random.default_rng(1).normal(0, 0.15, (5000, 4)))
+    valores[:, 0] = 1000
+
+    acumulador = AcumuladorPorPeriodo(valores.shape[1])
+    for inicio in range(0, len(valores), tamano_lote):
+        acumulador.agregar(valores[inicio:inicio + tamano_lote])
+
+    agregado = acumulador.resultado()
+    exactos = np.percentile(valores, agregado.percentiles, axis=0)
+
+    # Error del orden del ancho de unos pocos intervalos del rango de los datos
+    tolerancia = 4 * (valores.max(axis=0) - valores.min(axis=0)) / NUM_INTERVALOS + 1e-9
+    assert np.all(np.abs(agregado.valores_percentiles - exactos) <= tolerancia)
+
+    np.testing.assert_allclose(agregado.media, valores.mean(axis=0))
+    np.testing.assert_allclose(agregado.minimo, valores.min(axis=0))
+    np.testing.assert_allclose(agregado.maximo, valores.max(axis=0))
+    assert agregado.num_simulaciones == len(valores)
@@ -0,0 +1,84 @@
+from src.simulation import geometric_brownian_motion, geometric_brownian_motion_batch, run_multiple_simulations
+from src.resultados import intervalo_media, intervalo_probabilidad
+import pandas as pd
+import numpy as np
+import pytest
+
+
+def test_geometric_brownian_motion_batch_igual_al_loop():
+
+    # Con el mismo estado de np.random, el lote reproduce num_simulaciones llamadas seguidas al loop
+    T, dt, num_assets, num_simulaciones = 1, 1/365, 3, 5
+    mu = np.array([0.05, 0.08, 0.02])
+    sigma = np.array([0.2, 0.3, 0.1])
+    S0 = [100.0, 50.0, 20.0]
+
+    np.random.seed(12345)
+    trayectorias = [geometric_brownian_motion(T, mu, sigma, S0, dt, num_assets)[1] for _ in range(num_simulaciones)]
+
+    np.random.seed(12345)
+    t, S = geometric_brownian_motion_batch(T, mu, sigma, S0, dt, num_assets, num_simulaciones)
+
+    assert S.shape == (num_simulaciones, num_assets, int(T / dt) + 1)
+    np.testing.assert_allclose(t, np.linspace(0, T, int(T / dt) + 1))
+    np.testing.assert_allclose(S, np.stack(trayectorias), rtol = 1e-10)
+
+
+@pytest.mark.parametrize("modo, motor", [("completo", "diario"), ("agregado", "diario"), ("completo", "eventos"), ("agregado", "eventos")])
+def test_resultado_igual_con_varios_procesos(modo, motor):
+
+    # Con semilla y tamano de lote fijos, cada lote tiene su generador: el resultado no depende del numero de procesos
+    generador = np.random.default_rng(4)
+    fechas = pd.bdate_range("2020-01-01", periods = 300)
+    precios = pd.DataFrame(100 * np.exp(np.cumsum(generador.normal(0, 0.01, (300, 2)), axis = 0)), index = fechas, columns = ["A", "B"])
+
+    argumentos = dict(T = 1, activos_seleccionados = ["A", "B"], inversion_inicial = 1000, distribucion_cartera = [0.4, 0.6],
+                      num_simulaciones = 45, balanceo = "Trimestral", fase = "Acumulación", fase_dinero = 50, inflacion = 2,
+                      modo = modo, motor = motor, semilla = 21, tamano_lote = 10)
+
+    un_proceso = run_multiple_simulations(precios, num_procesos = 1, **argumentos)
+    dos_procesos = run_multiple_simulations(precios, num_procesos = 2, **argumentos)
+
+    for tipo in ("real", "nominal"):
+        np.testing.assert_array_equal(un_proceso.rentabilidad_final(tipo), dos_procesos.rentabilidad_final(tipo))
+        agregado, agregado_dos = un_proceso.agregado_por_periodo(tipo), dos_procesos.agregado_por_periodo(tipo)
+        np.testing.assert_array_equal(agregado.media, agregado_dos.media)
+        np.testing.assert_array_equal(agregado.valores_percentiles, agregado_dos.valores_percentiles)
+        if modo == "completo":
+            np.testing.assert_array_equal(un_proceso.rentabilidad_por_periodo(tipo), dos_procesos.rentabilidad_por_periodo(tipo))
+
+
+def test_tolerancia_sin_rentabilidad_objetivo():
+
+    precios = pd.DataFrame({"A": np.linspace(100, 120, 300)}, index = pd.bdate_range("2020-01-01", periods = 300))
+
+    with pytest.raises(ValueError, match = "rentabilidad_objetivo"):
+        run_multiple_simulations(precios, T = 1, activos_seleccionados = ["A"], inversion_inicial = 1000, distribucion_cartera = [1],
+                                 num_simulaciones = 10, balanceo = "Mensual", fase = "Acumulación", fase_dinero = 0, inflacion = 2,
+                                 tolerancia = 1.0)
+
+
+def test_convergencia_con_conteos_acumulados():
+
+    # Los intervalos de los conteos acumulados lote a lote son los de todas las simulaciones hechas
+    generador = np.random.default_rng(5)
+    precios = pd.DataFrame(100 * np.exp(np.cumsum(generador.normal(0, 0.01, (300, 2)), axis = 0)),
+                           index = pd.bdate_range("2020-01-01", periods = 300), columns = ["A", "B"])
+
+    resultado = run_multiple_simulations(precios, T = 1, activos_seleccionados = ["A", "B"], inversion_inicial = 1000,
+                                         distribucion_cartera = [0.5, 0.5], num_simulaciones = 2000, balanceo = "Mensual",
+                                         fase = "Acumulación", fase_dinero = 0, inflacion = 2, semilla = 8, tamano_lote = 50,
+                                         rentabilidad_objetivo = 1000, tolerancia = 5.0, tolerancia_media = 0.01)
+
+    convergencia = resultado.convergencia
+    finales = resultado.rentabilidad_iteracion()
+    assert convergencia["motivo"] == "tolerancia"
+    assert convergencia["num_simulaciones"] == len(finales) < 2000
+
+    media, inferior, superior = intervalo_media(finales)
+    assert convergencia["media"] == pytest.approx(media, rel = 1e-12)
+    np.testing.assert_allclose(convergencia["intervalo_media"], (inferior, superior), rtol = 1e-12)
+
+    probabilidad, inferior, superior = intervalo_probabilidad(int((finales > 1000).sum()), len(finales))
+    assert convergencia["probabilidad"] == pytest.approx(100 * probabilidad)
+    np.testing.assert_allclose(convergencia["intervalo_probabilidad"], (100 * inferior, 100 * superior))
@@ -0,0 +1,138 @@
+from src.tareas import GestorTareas
+import threading
+import pytest
+
+ESPERA = 10
+
+
+class Trabajo:
+
+    """
+    Trabajo falso con la firma (progreso, cancelar) de las tareas de la app
+
+    Simula num_lotes lotes: antes de cada uno espera a que se abra el paso (o a que se cancele), informa del progreso y
+    cuenta cuantas veces se construye el resultado parcial. Devuelve los lotes completados
+    """
+
+    def __init__(self, num_lotes = 3, abierto = False):
+
+        self.num_lotes = num_lotes
+        self.paso = threading.Event()
+        if abierto:
+            self.paso.set()
+        self.llamadas = 0
+        self.parciales = 0
+
+    def construir_parcial(self, completados):
+
+        self.parciales += 1
+        return list(range(completados))
+
+    def __call__(self, progreso, cancelar):
+
+        self.llamadas += 1
+        completados = 0
+        for _ in range(self.num_lotes):
+            while not self.paso.wait(0.01):
+                if cancelar.is_set():
+                    return list(range(completados))
+            if cancelar.is_set():
+                break
+            completados += 1
+            progreso(completados, self.num_lotes, lambda: self.construir_parcial(completados))
+
+        return list(range(completados))
+
+
+def test_lanzar_y_resultado_final():
+
+    trabajo = Trabajo()
+    tarea = GestorTareas().lanzar("a", trabajo)
+
+    assert not tarea.terminada and tarea.resultado is None
+
+    trabajo.paso.set()
+    assert tarea.esperar(ESPERA)
+
+    assert tarea.resultado == [0, 1, 2]
+    assert tarea.error is None and not tarea.cancelada
+    assert (tarea.completadas, tarea.total, tarea.fraccion) == (3, 3, 1.0)
+    # El ultimo lote siempre deja el resultado parcial completo
+    assert tarea.parcial == [0, 1, 2]
+
+
+def test_misma_clave_devuelve_la_tarea_en_curso():
+
+    gestor = GestorTareas()
+    trabajo = Trabajo()
+
+    tarea = gestor.lanzar("a", trabajo)
+    assert gestor.lanzar("a", trabajo) is tarea
+    assert gestor.actual is tarea
+
+    trabajo.paso.set()
+    assert tarea.esperar(ESPERA)
+    assert trabajo.llamadas == 1
+
+    # Terminada la tarea, la misma clave se vuelve a lanzar
+    repetida = gestor.lanzar("a", trabajo)
+    assert repetida is not tarea
+    assert repetida.esperar(ESPERA) and trabajo.llamadas == 2
+
+
+def test_otra_clave_cancela_la_tarea_en_curso():
+
+    gestor = GestorTareas()
+    primero, segundo = Trabajo(), Trabajo(abierto = True)
+
+    anterior = gestor.lanzar("a", primero)
+    nueva = gestor.lanzar("b", segundo)
+
+    assert anterior.cancelada and not nueva.cancelada
+    assert gestor.actual is nueva
+
+    # La tarea cancelada termina con los lotes hechos, sin error
+    assert anterior.esperar(ESPERA)
+    assert anterior.resultado == [] and anterior.error is None
+    assert nueva.esperar(ESPERA) and nueva.resultado == [0, 1, 2]
+
+
+def test_cancelar_y_relanzar_con_la_misma_clave():
+
+    gestor = GestorTareas()
+    trabajo = Trabajo()
+
+    tarea = gestor.lanzar("a", trabajo)
+    gestor.cancelar()
+
+    assert tarea.cancelada
+    assert tarea.esperar(ESPERA) and tarea.resultado == []
+
+    # Una tarea cancelada no se reutiliza aunque la clave sea la misma
+    trabajo.paso.set()
+    nueva = gestor.lanzar("a", trabajo)
+    assert nueva is not tarea
+    assert nueva.esperar(ESPERA) and nueva.resultado == [0, 1, 2]
+
+
+@pytest.mark.parametrize("intervalo_parcial, parciales", [(60, 2), (0, 10)])
+def test_resultados_parciales_limitados(intervalo_parcial, parciales):
+
+    # Con un intervalo largo solo se construyen el primer parcial y el del ultimo lote
+    trabajo = Trabajo(num_lotes = 10, abierto = True)
+    tarea = GestorTareas().lanzar("a", trabajo, intervalo_parcial = intervalo_parcial)
+
+    assert tarea.esperar(ESPERA)
+    assert trabajo.parciales == parciales
+    assert tarea.parcial == list(range(10))
+
+
+def test_error_en_el_trabajo():
+
+    def trabajo(progreso, cancelar):
+        raise RuntimeError("sin datos")
+
+    tarea = GestorTareas().lanzar("a", trabajo)
+
+    assert tarea.esperar(ESPERA)
+    assert isinstance(tarea.error, RuntimeError) and tarea.resultado is None